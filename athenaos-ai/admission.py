@@ -0,0 +1,246 @@
+# admission.py
+import math
+import time
+import asyncio
+import logging
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Mapping, Optional, Set
+
+from fastapi import HTTPException, Request
+
+from config import (
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TARGET_MS,
+    ADMISSION_DEFAULT_DEADLINE_MS, DEADLINE_HEADER
+)
+from metrics import ADMISSION_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Smoothing factor of the request service-time EWMA used to estimate queue waits
+EWMA_ALPHA = 0.1
+# Starting guess for the service time, until real requests have been measured
+INITIAL_SERVICE_TIME = 1.0
+# Status for requests whose client went away (nginx convention; never seen by the client)
+CLIENT_CLOSED_REQUEST = 499
+
+
+def request_deadline(headers: Mapping[str, str]) -> Optional[float]:
+    """Monotonic deadline from the caller's time budget header, or the default budget."""
+    budget_ms = ADMISSION_DEFAULT_DEADLINE_MS
+    value = headers.get(DEADLINE_HEADER)
+    if value:
+        try:
+            budget_ms = float(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid {DEADLINE_HEADER} header: {value!r}")
+    return time.monotonic() + budget_ms / 1000.0 if budget_ms > 0 else None
+
+
+def _reject(status_code: int, reason: str, detail: str, retry_after: float) -> HTTPException:
+    ADMISSION_REJECTIONS.inc(reason=reason)
+    return HTTPException(
+        status_code=status_code, detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class Ticket:
+    """An admitted request's slot. Released exactly once, however the request ends."""
+
+    def __init__(self, controller: "AdmissionController", session_id: Optional[str], deadline: Optional[float]):
+        self.controller = controller
+        self.session_id = session_id
+        self.deadline = deadline
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (never negative), or None without a deadline."""
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    async def _guarded(self, body: AsyncIterator) -> AsyncIterator:
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            try:
+                await body.aclose()
+            finally:
+                self.release()
+
+    def guard(self, body: AsyncIterator) -> AsyncIterator:
+        """
+        Wraps a streaming response body so the ticket is held until the stream
+        ends. A body that is dropped without ever being started (the client
+        left before streaming began) releases it when garbage collected.
+        """
+        guarded = self._guarded(body)
+        weakref.finalize(guarded, self.release)
+        return guarded
+
+
+class AdmissionController:
+    """
+    Global in-flight limit with a bounded FIFO queue and load shedding.
+
+    A request that can't start immediately waits in the queue only if its
+    expected wait (queue position x service-time EWMA / slots) fits within the
+    queue latency target and its own deadline; otherwise it is rejected at
+    once with 503 and a Retry-After estimate, instead of piling up behind
+    work that will time out anyway. Slots are handed to waiters directly on
+    release, so the queue stays FIFO.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_target: float = ADMISSION_QUEUE_TARGET_MS / 1000.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_target = queue_target
+        self.in_flight = 0
+        self.service_time = INITIAL_SERVICE_TIME
+        self.active_sessions: Set[str] = set()
+        self._waiters: "deque[asyncio.Future]" = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def estimated_wait(self) -> float:
+        return (len(self._waiters) + 1) * self.service_time / self.max_in_flight
+
+    async def acquire(self, session_id: Optional[str] = None, deadline: Optional[float] = None) -> Ticket:
+        """Admits a request or raises a 429 (session busy) / 503 (overloaded) HTTPException."""
+        if session_id is not None:
+            if session_id in self.active_sessions:
+                raise _reject(429, "session_busy", "A reply for this session is already in progress.",
+                              self.service_time)
+            self.active_sessions.add(session_id)
+        try:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+            else:
+                await self._wait_for_slot(deadline)
+        except BaseException:
+            if session_id is not None:
+                self.active_sessions.discard(session_id)
+            raise
+        return Ticket(self, session_id, deadline)
+
+    async def _wait_for_slot(self, deadline: Optional[float]):
+        budget = self.queue_target
+        if deadline is not None:
+            budget = min(budget, deadline - time.monotonic())
+        estimated_wait = self.estimated_wait()
+        if len(self._waiters) >= self.max_queue or estimated_wait > budget:
+            raise _reject(503, "overloaded", "The service is overloaded; please retry shortly.", estimated_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=budget)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return
+            waiter.cancel()
+            raise _reject(503, "queue_timeout", "The service is overloaded; please retry shortly.",
+                          self.estimated_wait())
+        except asyncio.CancelledError:
+            # A slot handed over just as this request was cancelled must be passed on
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _release_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Hand the slot straight to the next waiter; in_flight is unchanged
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _release(self, ticket: Ticket):
+        elapsed = time.monotonic() - ticket.admitted_at
+        self.service_time = EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.service_time
+        if ticket.session_id is not None:
+            self.active_sessions.discard(ticket.session_id)
+        self._release_slot()
+
+    @asynccontextmanager
+    async def admit(self, session_id: Optional[str] = None, deadline: Optional[float] = None):
+        ticket = await self.acquire(session_id, deadline)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'active_sessions': len(self.active_sessions),
+            'service_time_ewma': round(self.service_time, 3),
+        }
+
+
+async def _wait_for_disconnect(request: Request):
+    # The body has already been read, so the next message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnect(request: Request, awaitable, timeout: Optional[float] = None):
+    """
+    Runs `awaitable`, cancelling it if the client disconnects (499) or the
+    deadline passes (504) first, so abandoned requests stop consuming
+    upstream calls and admission slots.
+    """
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({work, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if work in done:
+        return work.result()
+
+    work.cancel()
+    try:
+        await work
+    except BaseException:
+        pass
+    if watcher in done:
+        logger.info("Client disconnected; cancelled its request.")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed request.")
+    ADMISSION_REJECTIONS.inc(reason="deadline")
+    raise HTTPException(status_code=504, detail="The request deadline was exceeded.")
+
+
+async def iterate_with_deadline(iterator: AsyncIterator, deadline: Optional[float]) -> AsyncIterator:
+    """Re-yields `iterator`, raising asyncio.TimeoutError once `deadline` passes."""
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await iterator.aclose()
@@ -0,0 +1,70 @@
+# batching.py
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+
+logger = logging.getLogger(__name__)
+
+# Sends a list of texts to one model and returns one result (or None) per text
+BatchSender = Callable[[str, List[str]], Awaitable[List[Optional[Any]]]]
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests for one model into a single batched call.
+
+    Texts submitted within `max_wait` seconds of the first pending text are
+    sent together (at most `max_batch_size` per call), and each caller gets
+    back its own per-item result. Identical texts in a batch are sent once.
+    """
+
+    def __init__(self, api_url: str, send_batch: BatchSender,
+                 max_batch_size: int = BATCH_MAX_SIZE, max_wait: float = BATCH_MAX_WAIT_MS / 1000.0):
+        self.api_url = api_url
+        self.send_batch = send_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+        self.batches_sent = 0
+        self.items_sent = 0
+
+    async def submit(self, text: str):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Keep a reference so the task isn't garbage-collected mid-flight
+            task = asyncio.ensure_future(self._send(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            results = await self.send_batch(self.api_url, texts)
+        except Exception as e:
+            logger.error(f"Batched request to {self.api_url} failed: {e}")
+            results = [None] * len(texts)
+
+        self.batches_sent += 1
+        self.items_sent += len(texts)
+        by_text = dict(zip(texts, results))
+        for text, future in batch:
+            # Callers that were cancelled meanwhile already have a done future
+            if not future.done():
+                future.set_result(by_text.get(text))
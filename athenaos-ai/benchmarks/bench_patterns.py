@@ -0,0 +1,69 @@
+# benchmarks/bench_patterns.py
+"""
+Microbenchmark: single-pass PatternEngine vs. the original per-pattern loop.
+
+Run from the athenaos-ai directory:
+    python benchmarks/bench_patterns.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import CRISIS_PATTERNS, CONCERN_PATTERNS  # noqa: E402
+from patterns import PatternEngine  # noqa: E402
+
+SAMPLE_TEXTS = [
+    "I don't know, I guess today was fine but work has been a lot lately.",
+    "Everyone always leaves and it's my fault, nothing I do ever works out.",
+    "I feel so hopeless and I can't take it anymore, I just want it to stop.",
+    "thanks, that actually helped a bit. I'll try the breathing thing tonight.",
+]
+
+
+def build_patterns(count):
+    """Real crisis/concern patterns padded with synthetic ones of a similar shape."""
+    base = CRISIS_PATTERNS + CONCERN_PATTERNS
+    synthetic = [
+        rf"\bi (keep|always) (thinking|worrying) about (thing{i}|item{i}) (again|anymore)\b"
+        for i in range(max(0, count - len(base)))
+    ]
+    patterns = (base + synthetic)[:count]
+    # Split into categories of ten patterns each
+    return {f"category_{i // 10}": patterns[i:i + 10] for i in range(0, len(patterns), 10)}
+
+
+def per_pattern_loop(categories, text):
+    """The original approach: lowercase, then re.search every raw pattern string."""
+    text_lower = text.lower()
+    matched = []
+    for name, patterns in categories.items():
+        for pattern in patterns:
+            if re.search(pattern, text_lower):
+                matched.append(name)
+                break
+    return matched
+
+
+def main():
+    print(f"{'patterns':>8} {'per-pattern loop (us)':>22} {'PatternEngine (us)':>19} {'speedup':>8}")
+    for count in (10, 100, 1000):
+        categories = build_patterns(count)
+        engine = PatternEngine(categories)
+        for text in SAMPLE_TEXTS:
+            assert per_pattern_loop(categories, text) == list(engine.scan(text)), text
+
+        number = max(20, 20000 // count)
+        loop_time = timeit.timeit(
+            lambda: [per_pattern_loop(categories, t) for t in SAMPLE_TEXTS], number=number
+        ) / (number * len(SAMPLE_TEXTS))
+        engine_time = timeit.timeit(
+            lambda: [engine.scan(t) for t in SAMPLE_TEXTS], number=number
+        ) / (number * len(SAMPLE_TEXTS))
+        print(f"{count:>8} {loop_time * 1e6:>22.1f} {engine_time * 1e6:>19.1f} {loop_time / engine_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
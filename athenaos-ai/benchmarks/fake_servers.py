@@ -0,0 +1,151 @@
+# benchmarks/fake_servers.py
+"""
+Local stand-ins for the Hugging Face Inference API and the Groq chat-completions
+API, with configurable latency distributions and error rates, so the AI service
+can be load-tested without spending API quota.
+
+    python benchmarks/fake_servers.py --port 9100 --hf-latency-ms 80 --groq-ttft-ms 300
+
+Point the service at it with:
+    HF_API_BASE_URL=http://127.0.0.1:9100/models/  GROQ_BASE_URL=http://127.0.0.1:9100
+"""
+import time
+import json
+import random
+import asyncio
+import argparse
+from typing import List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Label sets matching the three classifiers in config.py
+MODEL_LABELS = {
+    "roberta-hate-speech-dynabench-r4-target": ["nothate", "hate"],
+    "twitter-roberta-base-sentiment-latest": ["negative", "neutral", "positive"],
+    "distilbert-base-uncased-emotion": ["sadness", "joy", "love", "anger", "fear", "surprise"],
+}
+
+# Labels that should dominate, so the fake behaves like real traffic
+BENIGN_BIAS = {"roberta-hate-speech-dynabench-r4-target": "nothate"}
+
+REPLY_WORDS = (
+    "Thank you for telling me how you feel. What you're describing sounds heavy, and it makes sense "
+    "that it's weighing on you. Could you tell me a little more about what today has been like?"
+).split()
+
+
+class LatencyModel:
+    """Log-normally distributed delays around a median, which is how real service latency tends to look."""
+
+    def __init__(self, median_ms: float, sigma: float):
+        self.median = median_ms / 1000.0
+        self.sigma = sigma
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.sigma) * self.median
+
+
+def classify(model: str, text: str) -> List[dict]:
+    labels = MODEL_LABELS.get(model, ["negative", "neutral", "positive"])
+    # Deterministic per text, so cache behaviour in the service is realistic
+    rng = random.Random(hash((model, text)))
+    weights = [rng.random() for _ in labels]
+    if model in BENIGN_BIAS:
+        # Most real traffic is not hateful; keep the moderation gate mostly open
+        weights[labels.index(BENIGN_BIAS[model])] += 4.0
+    total = sum(weights)
+    scores = [{"label": label, "score": w / total} for label, w in zip(labels, weights)]
+    return sorted(scores, key=lambda x: x["score"], reverse=True)
+
+
+def create_app(hf_latency: LatencyModel, groq_ttft: LatencyModel, groq_token_ms: float,
+               error_rate: float) -> FastAPI:
+    app = FastAPI(title="Athena fake upstreams")
+    app.state.requests = {"hf": 0, "hf_items": 0, "groq": 0}
+
+    @app.post("/models/{owner}/{model}")
+    async def hf_inference(owner: str, model: str, request: Request):
+        payload = await request.json()
+        inputs = payload.get("inputs")
+        app.state.requests["hf"] += 1
+        app.state.requests["hf_items"] += len(inputs) if isinstance(inputs, list) else 1
+        await asyncio.sleep(hf_latency.sample())
+        if random.random() < error_rate:
+            return JSONResponse({"error": f"Model {owner}/{model} is currently loading", "estimated_time": 1.0},
+                                status_code=503)
+        if isinstance(inputs, list):
+            return [classify(model, text) for text in inputs]
+        return [classify(model, inputs)]
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        app.state.requests["groq"] += 1
+        await asyncio.sleep(groq_ttft.sample())
+        if random.random() < error_rate:
+            return JSONResponse({"error": {"message": "Service unavailable", "type": "server_error"}},
+                                status_code=503)
+        words = REPLY_WORDS[:max(1, min(len(REPLY_WORDS), payload.get("max_tokens", 256)))]
+        model = payload.get("model", "fake-model")
+        created = int(time.time())
+
+        if not payload.get("stream"):
+            await asyncio.sleep(len(words) * groq_token_ms / 1000.0)
+            return {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            }
+
+        async def stream():
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "finish_reason": None,
+                                 "delta": {"content": word if i == 0 else " " + word}}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(groq_token_ms / 1000.0)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/openai/v1/models")
+    async def list_models():
+        # Used by the service's warm-up ping
+        return {"object": "list", "data": [{"id": "fake-model", "object": "model"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.requests
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--hf-latency-ms", type=float, default=80.0, help="median inference latency")
+    parser.add_argument("--groq-ttft-ms", type=float, default=300.0, help="median time to first token")
+    parser.add_argument("--groq-token-ms", type=float, default=5.0, help="delay between streamed tokens")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(
+        LatencyModel(args.hf_latency_ms, args.latency_sigma),
+        LatencyModel(args.groq_ttft_ms, args.latency_sigma),
+        args.groq_token_ms,
+        args.error_rate,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# benchmarks/loadtest.py
+"""
+Offline load test for the AI service.
+
+Starts benchmarks/fake_servers.py as a subprocess, points the service at it,
+and drives main.app in-process at a fixed concurrency. Reports throughput,
+p50/p95/p99 latency, event-loop lag and RSS growth over time. httpx's ASGI
+transport buffers response bodies, so time to first token is only meaningful
+with --base-url pointing at a running server.
+
+    python benchmarks/loadtest.py --concurrency 50 --requests 2000
+    python benchmarks/loadtest.py --endpoint /chat/stream --error-rate 0.05
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import resource
+import statistics
+import subprocess
+from typing import List, Optional
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+SAMPLE_MESSAGES = [
+    "hi",
+    "thanks",
+    "I don't know",
+    "I'm feeling anxious today",
+    "I feel hopeless and nothing ever works out",
+    "Work has been really stressful and I can't sleep",
+    "Everyone always leaves, it's my fault",
+    "I had a pretty good day actually, I went for a walk",
+    "My exam is tomorrow and I'm going to fail completely",
+    "I keep arguing with my partner and I don't know what to do",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        # Peak RSS: kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def start_fake_servers(args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_servers.py"),
+        "--port", str(args.port),
+        "--hf-latency-ms", str(args.hf_latency_ms),
+        "--groq-ttft-ms", str(args.groq_ttft_ms),
+        "--groq-token-ms", str(args.groq_token_ms),
+        "--latency-sigma", str(args.latency_sigma),
+        "--error-rate", str(args.error_rate),
+    ])
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.port}/stats", timeout=0.5)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Fake upstream servers did not start")
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic timer fires: a direct reading of event-loop blocking."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def run_load(app, args):
+    latencies: List[float] = []
+    first_token: List[float] = []
+    statuses = {}
+    rss_timeline = [(0.0, current_rss_mb())]
+    remaining = iter(range(args.requests))
+    rng = random.Random(1)
+
+    def next_message() -> str:
+        message = rng.choice(SAMPLE_MESSAGES)
+        if rng.random() < args.unique_ratio:
+            message += f" (note {rng.randint(0, 10 ** 9)})"
+        return message
+
+    if args.base_url:
+        client_args = dict(base_url=args.base_url)
+    else:
+        client_args = dict(transport=httpx.ASGITransport(app=app), base_url="http://athena")
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=args.concurrency),
+                                 **client_args) as client:
+
+        async def worker():
+            for _ in remaining:
+                payload = {"user_input": next_message(), "history": []}
+                start = time.perf_counter()
+                if args.endpoint == "/chat/stream":
+                    async with client.stream("POST", args.endpoint, json=payload) as response:
+                        seen_token = False
+                        async for line in response.aiter_lines():
+                            if line == "event: token" and not seen_token:
+                                first_token.append(time.perf_counter() - start)
+                                seen_token = True
+                        status = response.status_code
+                else:
+                    response = await client.post(args.endpoint, json=payload)
+                    status = response.status_code
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        async def rss_sampler(begin: float):
+            while True:
+                await asyncio.sleep(1.0)
+                rss_timeline.append((time.perf_counter() - begin, current_rss_mb()))
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        begin = time.perf_counter()
+        sampler = asyncio.ensure_future(rss_sampler(begin))
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - begin
+        sampler.cancel()
+        await monitor.stop()
+        rss_timeline.append((elapsed, current_rss_mb()))
+
+    return latencies, first_token, statuses, elapsed, monitor.lags, rss_timeline
+
+
+def report(args, latencies, first_token, statuses, elapsed, lags, rss_timeline):
+    ms = lambda seconds: f"{seconds * 1000:8.1f} ms"  # noqa: E731
+    print(f"\n{args.endpoint}: {len(latencies)} requests at concurrency {args.concurrency} in {elapsed:.2f}s")
+    print(f"  throughput       {len(latencies) / elapsed:8.1f} req/s")
+    print(f"  status codes     {dict(sorted(statuses.items()))}")
+    print(f"  latency p50      {ms(percentile(latencies, 50))}")
+    print(f"  latency p95      {ms(percentile(latencies, 95))}")
+    print(f"  latency p99      {ms(percentile(latencies, 99))}")
+    if first_token:
+        print(f"  first token p50  {ms(percentile(first_token, 50))}")
+        print(f"  first token p99  {ms(percentile(first_token, 99))}")
+    if lags:
+        print(f"  loop lag mean    {ms(statistics.mean(lags))}")
+        print(f"  loop lag p99     {ms(percentile(lags, 99))}")
+        print(f"  loop lag max     {ms(max(lags))}")
+    print(f"  RSS start/end    {rss_timeline[0][1]:.1f} MB -> {rss_timeline[-1][1]:.1f} MB")
+    print("  RSS over time    " + ", ".join(f"{t:.0f}s:{rss:.1f}MB" for t, rss in rss_timeline))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", default="/chat", choices=["/chat", "/chat/stream"])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--unique-ratio", type=float, default=0.5, help="fraction of messages made unique (cache misses)")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--base-url", help="drive a running server (started against the fakes) instead of main.app; "
+                             "loop lag and RSS then describe this client process")
+    parser.add_argument("--with-fallback", action="store_true",
+                        help="also register the fake as an OpenAI-compatible fallback provider (exercises hedging)")
+    parser.add_argument("--no-spawn", action="store_true", help="use fake servers that are already running")
+    parser.add_argument("--hf-latency-ms", type=float, default=80.0)
+    parser.add_argument("--groq-ttft-ms", type=float, default=300.0)
+    parser.add_argument("--groq-token-ms", type=float, default=5.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    process = None if args.no_spawn else start_fake_servers(args)
+    # Always target the stand-ins, never the real (paid) APIs
+    os.environ["HF_API_BASE_URL"] = f"http://127.0.0.1:{args.port}/models/"
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["GROQ_API_KEY"] = "fake-benchmark-key"
+    os.environ["HUGGINGFACE_API_KEY"] = "fake-benchmark-key"
+    if args.with_fallback:
+        os.environ["LLM_FALLBACK_BASE_URL"] = f"http://127.0.0.1:{args.port}/openai/v1"
+
+    import logging
+    logging.disable(logging.WARNING)
+    import main as service
+
+    async def run():
+        async with service.app.router.lifespan_context(service.app):
+            # Let the startup warm-up pings finish so they don't overlap the measured load
+            while not service.startup.ready:
+                await asyncio.sleep(0.05)
+            print(f"  startup          {service.startup.report()}")
+            return await run_load(service.app, args)
+
+    try:
+        results = asyncio.run(run())
+        report(args, *results)
+        upstream = httpx.get(f"http://127.0.0.1:{args.port}/stats").json()
+        print(f"  upstream calls   {upstream}")
+        from metrics import GENERATION_HEDGES
+        hedges = {key[0]: int(value) for key, value in GENERATION_HEDGES._values.items()}
+        if hedges:
+            print(f"  hedged requests  {hedges}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
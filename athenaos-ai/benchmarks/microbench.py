@@ -0,0 +1,87 @@
+# benchmarks/microbench.py
+"""
+Microbenchmarks for the CPU-bound hot paths that run on the event loop for
+every message: sanitization, chunking, crisis/CBT pattern detection and repetition
+analysis (full rescan vs. the incremental per-session tracker). Run from the athenaos-ai directory:
+    python benchmarks/microbench.py
+"""
+import os
+import sys
+import timeit
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from processing import (  # noqa: E402
+    sanitize_input, enhanced_crisis_detection, detect_cbt_patterns, analyze_conversation_patterns
+)
+from repetition import RepetitionTracker  # noqa: E402
+from chunking import split_into_chunks  # noqa: E402
+from config import ANALYSIS_MAX_LENGTH, ANALYSIS_CHUNK_CHARS  # noqa: E402
+
+SHORT = "I feel hopeless, everyone always leaves."
+MEDIUM = (
+    "Work has been really stressful lately and I can't sleep. My manager keeps giving me more "
+    "to do and I'm sure I'm going to fail. <b>Nothing</b> ever works out for me & I don't know why. "
+) * 3
+LONG = MEDIUM * 40
+# An oversized payload: sanitization is bounded, so it should cost about as much as LONG
+HUGE = MEDIUM * 2000
+
+REPLIES = [
+    "I hear you. That sounds really difficult, and it makes sense you feel worn down.",
+    "It sounds like work is taking a lot out of you. What would help most tonight?",
+    "I understand. Have you noticed when these thoughts tend to show up?",
+    "That's understandable. Let's look at the evidence for that thought together.",
+]
+
+
+# Per-match INFO logging would otherwise dominate the timings
+logging.disable(logging.INFO)
+
+
+def history_of(turns):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": MEDIUM})
+        history.append({"role": "assistant", "content": REPLIES[i % len(REPLIES)]})
+    return history
+
+
+def bench(label, func, number):
+    seconds = timeit.timeit(func, number=number) / number
+    print(f"  {label:<44} {seconds * 1e6:>10.1f} us")
+
+
+def main():
+    print("sanitize_input")
+    for name, text in (("short", SHORT), ("medium", MEDIUM), ("long", LONG), ("huge", HUGE)):
+        bench(f"{name} ({len(text)} chars)", lambda t=text: sanitize_input(t), 2000)
+    bench(f"huge, analysis length ({len(HUGE)} chars)", lambda: sanitize_input(HUGE, ANALYSIS_MAX_LENGTH), 2000)
+
+    print("split_into_chunks")
+    analysis_text = sanitize_input(LONG, ANALYSIS_MAX_LENGTH)
+    bench(f"long ({len(analysis_text)} chars)", lambda: split_into_chunks(analysis_text, ANALYSIS_CHUNK_CHARS), 2000)
+
+    print("enhanced_crisis_detection")
+    for name, text in (("short", SHORT), ("medium", MEDIUM), ("long", LONG)):
+        bench(f"{name} ({len(text)} chars)", lambda t=text: enhanced_crisis_detection(t), 2000)
+
+    print("detect_cbt_patterns")
+    for name, text in (("short", SHORT), ("medium", MEDIUM), ("long", LONG)):
+        bench(f"{name} ({len(text)} chars)", lambda t=text: detect_cbt_patterns(t), 2000)
+
+    print("analyze_conversation_patterns")
+    for turns in (5, 25, 100):
+        history = history_of(turns)
+        bench(f"rescan, {turns} turns", lambda h=history: analyze_conversation_patterns(h), 2000)
+        tracker = RepetitionTracker.from_responses(m["content"] for m in history if m["role"] == "assistant")
+
+        def incremental(t=tracker):
+            t.add(REPLIES[0])
+            return t.repetitive_patterns()
+        bench(f"incremental, {turns} turns", incremental, 2000)
+
+
+if __name__ == "__main__":
+    main()
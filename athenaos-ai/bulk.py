@@ -0,0 +1,195 @@
+# bulk.py
+import json
+import codecs
+import asyncio
+import logging
+import tempfile
+from collections import deque
+from typing import IO, Any, AsyncIterator, Iterator, List, Tuple
+
+from fastapi import HTTPException, Request
+
+from config import (
+    ANALYZE_BATCH_SIZE, ANALYZE_CONCURRENT_BATCHES, ANALYZE_SPOOL_MEMORY_BYTES, ANALYZE_MAX_ITEM_BYTES,
+    ANALYZE_MAX_BODY_BYTES
+)
+from metrics import ANALYZE_ITEMS
+from processing import analyze_batch
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class BulkInputError(ValueError):
+    """The request body is not a JSON array or NDJSON stream of items."""
+
+
+def _body_too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes.")
+
+
+async def spool_request_body(request: Request, max_bytes: int = ANALYZE_MAX_BODY_BYTES) -> IO[bytes]:
+    """
+    Copies the request body into a temporary file (in memory up to
+    ANALYZE_SPOOL_MEMORY_BYTES, on disk beyond), rewound for reading. Raises
+    a 413 once the body exceeds `max_bytes`, whether or not the client sent a
+    Content-Length.
+
+    The body is read in full before the response starts: with ASGI servers on
+    spec 2.3 (uvicorn) a streaming response listens for the client's
+    disconnect on the same channel and would swallow unread body chunks.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise _body_too_large(max_bytes)
+    spool = tempfile.SpooledTemporaryFile(max_size=ANALYZE_SPOOL_MEMORY_BYTES)
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise _body_too_large(max_bytes)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def iter_json_items(stream: IO[bytes], max_item_chars: int = ANALYZE_MAX_ITEM_BYTES) -> Iterator[Any]:
+    """
+    Yields the items of a JSON array, or the values of an NDJSON stream, one
+    at a time, reading `stream` in chunks so memory stays bounded by the
+    largest item rather than the whole body. Raises BulkInputError on
+    malformed input, after yielding every item before the error.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, consumed = "", 0, 0
+    is_array, eof = None, False
+    while True:
+        # Whitespace separates NDJSON values; commas also separate array items
+        while pos < len(buffer) and (buffer[pos].isspace() or (is_array and buffer[pos] == ",")):
+            pos += 1
+        if pos < len(buffer):
+            if is_array is None:
+                is_array = buffer[pos] == "["
+                if is_array:
+                    pos += 1
+                    continue
+            if is_array and buffer[pos] == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise BulkInputError(f"Invalid JSON at character {consumed + e.pos}.")
+            else:
+                # A value ending exactly at the buffer's end may be cut short (e.g. a number)
+                if end < len(buffer) or eof:
+                    yield value
+                    pos = end
+                    continue
+        elif eof:
+            if is_array:
+                raise BulkInputError("Unterminated JSON array.")
+            return
+
+        if len(buffer) - pos > max_item_chars:
+            raise BulkInputError(f"Item at character {consumed + pos} exceeds {max_item_chars} characters.")
+        chunk = stream.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        consumed += pos
+        buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+
+def parse_item(value: Any, index: int) -> Tuple[Any, str]:
+    """
+    (id, text) of one input item: a string, or an object with "text" (or
+    "content", as stored in the backend's Message table) and an optional
+    "id". Items without an id are identified by their position.
+    """
+    if isinstance(value, str):
+        return index, value
+    if isinstance(value, dict):
+        text = value.get("text", value.get("content"))
+        if isinstance(text, str):
+            return value.get("id", index), text
+        raise BulkInputError("Item has no string 'text' or 'content' field.")
+    raise BulkInputError("Item must be a string or an object.")
+
+
+async def _analyze(batch: List[Tuple[Any, Any]]) -> List[dict]:
+    valid = [(item_id, text) for item_id, text in batch if not isinstance(text, BulkInputError)]
+    labels = await analyze_batch([text for _, text in valid]) if valid else []
+    by_position = iter(labels)
+
+    results = []
+    for item_id, text in batch:
+        if isinstance(text, BulkInputError):
+            ANALYZE_ITEMS.inc(result='invalid')
+            results.append({'id': item_id, 'error': str(text)})
+            continue
+        result = next(by_position)
+        partial = any(result[field] is None for field in ('sentiment', 'emotions', 'moderation'))
+        ANALYZE_ITEMS.inc(result='partial' if partial else 'ok')
+        results.append({'id': item_id, **result})
+    return results
+
+
+def _batches(items: Iterator[Any], batch_size: int) -> Iterator[List[Tuple[Any, Any]]]:
+    batch = []
+    try:
+        for index, value in enumerate(items):
+            try:
+                batch.append(parse_item(value, index))
+            except BulkInputError as e:
+                item_id = value.get("id", index) if isinstance(value, dict) else index
+                batch.append((item_id, e))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except BulkInputError:
+        # Items read before malformed input are still analyzed
+        if batch:
+            yield batch
+        raise
+    if batch:
+        yield batch
+
+
+async def stream_analysis(body: IO[bytes], batch_size: int = ANALYZE_BATCH_SIZE,
+                          concurrency: int = ANALYZE_CONCURRENT_BATCHES) -> AsyncIterator[bytes]:
+    """
+    NDJSON response body for /analyze: one line per input item, in input
+    order. Up to `concurrency` batches are analyzed at once while earlier
+    results are written out. Malformed input ends the stream with an
+    {"error": ...} line after the results for every item before it.
+    """
+    pending = deque()
+    error = None
+    batches = _batches(iter_json_items(body), max(1, batch_size))
+    try:
+        while True:
+            try:
+                batch = next(batches, None)
+            except BulkInputError as e:
+                error, batch = str(e), None
+            if batch is not None:
+                pending.append(asyncio.ensure_future(_analyze(batch)))
+            if pending and (batch is None or len(pending) >= max(1, concurrency)):
+                for result in await pending.popleft():
+                    yield (json.dumps(result) + "\n").encode("utf-8")
+            elif batch is None:
+                break
+        if error is not None:
+            logger.warning(f"Bulk analysis stopped on malformed input: {error}")
+            yield (json.dumps({'error': error}) + "\n").encode("utf-8")
+    finally:
+        # Cancel outstanding batches if the client went away
+        for task in pending:
+            task.cancel()
+        body.close()
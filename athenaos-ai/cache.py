@@ -0,0 +1,159 @@
+# cache.py
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from config import (
+    INFERENCE_CACHE_ENABLED, INFERENCE_CACHE_MAX_ENTRIES, INFERENCE_CACHE_TTL, INFERENCE_CACHE_DB_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace and case so trivially different inputs share a cache entry."""
+    return _WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+def make_cache_key(api_url: str, text: str) -> str:
+    """Content-addressed key: hash of the model URL plus the normalized input."""
+    return hashlib.sha256(f"{api_url}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class InferenceCache:
+    """
+    Two-tier cache for model inference results.
+
+    The first tier is a bounded in-process LRU with a TTL. The optional second
+    tier is a SQLite file (WAL mode) so several uvicorn workers share hits.
+    Disk reads and writes run on a single background thread, which keeps them
+    off the event loop and serializes access to the connection; writes are
+    write-behind, so a request never waits on one.
+    """
+
+    # Expired rows in the disk tier are purged once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, max_entries: int = INFERENCE_CACHE_MAX_ENTRIES, ttl: float = INFERENCE_CACHE_TTL,
+                 db_path: str = INFERENCE_CACHE_DB_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            self._db = self._open_db(db_path)
+        if self._db is not None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference-cache")
+
+    @staticmethod
+    def _open_db(db_path: str) -> Optional[sqlite3.Connection]:
+        try:
+            db = sqlite3.connect(db_path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS inference_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            return db
+        except sqlite3.Error as e:
+            logger.error(f"Could not open inference cache database {db_path}: {e}")
+            return None
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self._executor is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._executor, self._read, key)
+            if row and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self._executor is not None:
+            self._executor.submit(self._write, key, json.dumps(value), expires_at)
+
+    def _read(self, key: str) -> Optional[tuple]:
+        """(value, expires_at) from the disk tier; runs on the cache thread."""
+        try:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM inference_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Inference cache read failed: {e}")
+            return None
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def _write(self, key: str, value: str, expires_at: float):
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO inference_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._db.execute("DELETE FROM inference_cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.error(f"Inference cache write failed: {e}")
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        if self._executor is not None:
+            self._executor.submit(self._db.execute, "DELETE FROM inference_cache").result()
+
+    def close(self):
+        """Waits for pending disk writes, then closes the database."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._db.close()
+            self._db = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+def create_inference_cache() -> Optional[InferenceCache]:
+    """Builds the inference cache, or returns None when INFERENCE_CACHE_ENABLED is off."""
+    return InferenceCache() if INFERENCE_CACHE_ENABLED else None
@@ -0,0 +1,66 @@
+# chunking.py
+from typing import Dict, List, Sequence, Tuple
+
+# Where a sentence may end: terminal punctuation followed by a space, or a line
+# break (paragraphs and list items in journal entries often lack punctuation)
+SENTENCE_BOUNDARIES = (". ", "! ", "? ", "\n")
+
+# A model response for one chunk (a one-element list of label/score dicts),
+# paired with the chunk's length in characters
+WeightedResponse = Tuple[list, int]
+
+
+def split_into_chunks(text: str, max_chars: int) -> List[str]:
+    """
+    Splits text into chunks of at most `max_chars` characters, each ending at
+    the last sentence boundary that fits, so whole sentences are packed
+    greedily. A sentence longer than `max_chars` is broken at the last space
+    that fits. Text that already fits is returned as one chunk.
+
+    Boundaries are found with str.rfind on each window rather than a regex
+    over the whole text, which keeps this at a few microseconds per chunk.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    chunks = []
+    start = 0
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        # Cut just after the boundary's first character (the punctuation or newline)
+        cut = max(text.rfind(sep, start, end + len(sep) - 1) + 1 for sep in SENTENCE_BOUNDARIES)
+        if cut <= start:
+            cut = text.rfind(" ", start, end + 1)
+            if cut <= start:
+                cut = end
+        chunk = text[start:cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = cut
+    chunk = text[start:].strip()
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def mean_label_scores(responses: Sequence[WeightedResponse]) -> Dict[str, float]:
+    """
+    Length-weighted mean score of every label across chunks, so a long
+    paragraph counts for more than a short aside. A single response is
+    returned as is.
+    """
+    if len(responses) == 1:
+        return {item['label']: item['score'] for item in responses[0][0][0]}
+    total = sum(weight for _, weight in responses) or 1
+    scores: Dict[str, float] = {}
+    for response, weight in responses:
+        for item in response[0]:
+            scores[item['label']] = scores.get(item['label'], 0.0) + item['score'] * weight
+    return {label: score / total for label, score in scores.items()}
+
+
+def max_label_score(responses: Sequence[WeightedResponse], label: str) -> float:
+    """Highest score of `label` in any chunk: one harmful passage flags the whole text."""
+    return max(
+        (item['score'] for response, _ in responses for item in response[0] if item['label'] == label),
+        default=0.0
+    )
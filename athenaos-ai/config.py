@@ -21,11 +21,197 @@ GENERATIVE_MODEL_ID = "llama-3.1-8b-instant"
 # ==============================================================================
 # API URLs for the models, replacing the local model IDs
 # We use these endpoints to call the models via API instead of loading them locally
-API_BASE_URL = "https://api-inference.huggingface.co/models/"
+# HF_API_BASE_URL can point at a compatible stand-in (e.g. benchmarks/fake_servers.py)
+API_BASE_URL = os.getenv("HF_API_BASE_URL", "https://api-inference.huggingface.co/models/")
 MODERATION_API_URL = API_BASE_URL + "facebook/roberta-hate-speech-dynabench-r4-target"
 SENTIMENT_API_URL = API_BASE_URL + "cardiffnlp/twitter-roberta-base-sentiment-latest"
 EMOTION_API_URL = API_BASE_URL + "bhadresh-savani/distilbert-base-uncased-emotion"
 
+# ==============================================================================
+# INFERENCE BACKEND
+# ==============================================================================
+# "remote" calls the Hugging Face Inference API; "local" runs the same three
+# classifiers in-process with ONNX Runtime from LOCAL_MODEL_DIR, laid out as
+# <LOCAL_MODEL_DIR>/<model id>/{model.onnx or model_quantized.onnx, tokenizer.json, config.json}
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "remote").lower()
+LOCAL_MODEL_DIR = os.getenv("LOCAL_MODEL_DIR", "model_store")
+LOCAL_INFERENCE_THREADS = int(os.getenv("LOCAL_INFERENCE_THREADS", "2"))
+LOCAL_INFERENCE_INTRA_OP_THREADS = int(os.getenv("LOCAL_INFERENCE_INTRA_OP_THREADS", "1"))
+LOCAL_MAX_SEQUENCE_LENGTH = int(os.getenv("LOCAL_MAX_SEQUENCE_LENGTH", "256"))
+
+# ==============================================================================
+# INFERENCE TRANSPORT (CONNECTION POOL, RETRIES & CIRCUIT BREAKER)
+# ==============================================================================
+# Timeouts are in seconds. Retries use jittered exponential backoff, and a 503
+# "model is loading" response waits for the reported estimated_time (capped).
+HF_CONNECT_TIMEOUT = float(os.getenv("HF_CONNECT_TIMEOUT", "3.0"))
+HF_READ_TIMEOUT = float(os.getenv("HF_READ_TIMEOUT", "10.0"))
+HF_MAX_RETRIES = int(os.getenv("HF_MAX_RETRIES", "2"))
+HF_BACKOFF_BASE = float(os.getenv("HF_BACKOFF_BASE", "0.25"))
+HF_BACKOFF_MAX = float(os.getenv("HF_BACKOFF_MAX", "5.0"))
+HF_MAX_CONNECTIONS = int(os.getenv("HF_MAX_CONNECTIONS", "100"))
+HF_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HF_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HF_KEEPALIVE_EXPIRY = float(os.getenv("HF_KEEPALIVE_EXPIRY", "60.0"))
+
+# A model endpoint's circuit opens after this many consecutive failed calls and
+# stays open (callers get the fallback values immediately) for the reset timeout.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30.0"))
+
+# ==============================================================================
+# INFERENCE RESULT CACHE
+# ==============================================================================
+# Moderation/sentiment/emotion results are cached per (model URL, normalized text).
+# Set INFERENCE_CACHE_DB_PATH to a SQLite file to share hits between workers.
+INFERENCE_CACHE_ENABLED = os.getenv("INFERENCE_CACHE_ENABLED", "true").lower() == "true"
+INFERENCE_CACHE_MAX_ENTRIES = int(os.getenv("INFERENCE_CACHE_MAX_ENTRIES", "4096"))
+INFERENCE_CACHE_TTL = float(os.getenv("INFERENCE_CACHE_TTL", "3600"))
+INFERENCE_CACHE_DB_PATH = os.getenv("INFERENCE_CACHE_DB_PATH", "")
+
+# ==============================================================================
+# RESPONSE CACHE
+# ==============================================================================
+# Opt-in cache of generated replies for short, generic, low-risk openers: no
+# crisis or concern match, at most RESPONSE_CACHE_MAX_WORDS words (a one-word
+# change in a short message drops it well below the similarity threshold, in a
+# long one it doesn't), and the first message of a conversation (a reply written
+# with one user's history in context is never served to another). Messages
+# whose hashed n-gram vectors have cosine similarity >= RESPONSE_CACHE_SIMILARITY
+# and the same sentiment/emotion/CBT patterns share an entry. An entry is only
+# served once it holds RESPONSE_CACHE_VARIANTS replies, which are then rotated.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "900"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.85"))
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+RESPONSE_CACHE_MAX_WORDS = int(os.getenv("RESPONSE_CACHE_MAX_WORDS", "6"))
+
+# ==============================================================================
+# INPUT BOUNDS & CHUNKED ANALYSIS
+# ==============================================================================
+# Raw input is cut before sanitization, so oversized payloads cost no more
+# than long ones. The first SANITIZE_MAX_LENGTH characters go into the prompt,
+# but up to ANALYSIS_MAX_LENGTH are analyzed: texts longer than
+# ANALYSIS_CHUNK_CHARS are split into sentence-aligned chunks that are
+# classified as one batch and aggregated (max for moderation, length-weighted
+# mean for sentiment and emotions). Crisis and CBT patterns are matched on the
+# whole analyzed text. ANALYSIS_MAX_LENGTH=1000 restores single-call analysis.
+SANITIZE_MAX_LENGTH = int(os.getenv("SANITIZE_MAX_LENGTH", "1000"))
+ANALYSIS_MAX_LENGTH = int(os.getenv("ANALYSIS_MAX_LENGTH", "8000"))
+ANALYSIS_CHUNK_CHARS = int(os.getenv("ANALYSIS_CHUNK_CHARS", "1000"))
+
+# ==============================================================================
+# INFERENCE MICRO-BATCHING
+# ==============================================================================
+# Texts sent to the same model within BATCH_MAX_WAIT_MS are coalesced into one
+# request (up to BATCH_MAX_SIZE inputs), since the API accepts a list of inputs.
+BATCHING_ENABLED = os.getenv("BATCHING_ENABLED", "true").lower() == "true"
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "15"))
+
+# ==============================================================================
+# SESSION STORE
+# ==============================================================================
+# "memory" keeps sessions in this process only. "sqlite" (WAL mode, shared file)
+# and "redis" let several uvicorn workers and replicas share conversation history.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_KEY_PREFIX = os.getenv("SESSION_KEY_PREFIX", "athena:session:")
+# A Redis call that takes longer than this fails the request instead of stalling it
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2.0"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1.0"))
+
+# Conversation history is capped per session, sessions idle for longer than
+# SESSION_IDLE_TTL seconds are evicted, and once the store holds more than
+# SESSION_MAX_BYTES the least recently used sessions are evicted first.
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "50"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+# ==============================================================================
+# STARTUP
+# ==============================================================================
+# Logging is configured when the app starts, not on import. Once clients are
+# built, each model endpoint and generation provider is pinged concurrently
+# (if WARMUP_ENABLED) so connections are open and hosted models loaded before
+# real traffic; /ready fails until that finishes or WARMUP_TIMEOUT seconds pass.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "20"))
+
+# ==============================================================================
+# OBSERVABILITY
+# ==============================================================================
+# When enabled, a request sent with the PROFILE_HEADER header is sampled by a
+# background profiler and the hottest stacks are logged.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Athena-Profile")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+# ==============================================================================
+# ADMISSION CONTROL
+# ==============================================================================
+# At most ADMISSION_MAX_IN_FLIGHT chat requests run at once; up to
+# ADMISSION_MAX_QUEUE more wait for a slot, but only while their expected wait
+# stays under ADMISSION_QUEUE_TARGET_MS. Past that, requests are shed at once
+# with 503 + Retry-After. A session can only have one reply in progress (429).
+# Callers may send a time budget in DEADLINE_HEADER (milliseconds); without it
+# ADMISSION_DEFAULT_DEADLINE_MS applies, just under the Node backend's 60s
+# timeout, so work is abandoned before the caller gives up (0 disables).
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_QUEUE_TARGET_MS = float(os.getenv("ADMISSION_QUEUE_TARGET_MS", "2000"))
+ADMISSION_DEFAULT_DEADLINE_MS = float(os.getenv("ADMISSION_DEFAULT_DEADLINE_MS", "55000"))
+DEADLINE_HEADER = os.getenv("DEADLINE_HEADER", "X-Request-Timeout-Ms")
+
+# ==============================================================================
+# GENERATION ROUTING
+# ==============================================================================
+# Replies are generated by Groq and, when LLM_FALLBACK_BASE_URL is set, by any
+# OpenAI-compatible endpoint (vLLM, llama.cpp server, Ollama, ...). Providers
+# are tried in order of their observed time-to-first-token and error rate. If
+# the first provider hasn't produced a token by the p95 of its recent
+# time-to-first-token (clamped to HEDGE_MIN/MAX_DELAY_MS), a hedged request
+# goes to the next provider and whichever answers first wins.
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "32"))
+LLM_FALLBACK_BASE_URL = os.getenv("LLM_FALLBACK_BASE_URL", "")
+LLM_FALLBACK_API_KEY = os.getenv("LLM_FALLBACK_API_KEY", "")
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", GENERATIVE_MODEL_ID)
+LLM_FALLBACK_MAX_CONCURRENCY = int(os.getenv("LLM_FALLBACK_MAX_CONCURRENCY", "8"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "150"))
+HEDGE_MAX_DELAY_MS = float(os.getenv("HEDGE_MAX_DELAY_MS", "3000"))
+
+# ==============================================================================
+# PROMPT ASSEMBLY
+# ==============================================================================
+# Estimated-token budget for the whole prompt (system prompt, history and the
+# new message). History is filled newest first until the budget or
+# PROMPT_MAX_HISTORY_MESSAGES is reached; older user turns that didn't fit are
+# condensed into a summary line of at most PROMPT_SUMMARY_TOKENS (0 drops them).
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+PROMPT_MAX_HISTORY_MESSAGES = int(os.getenv("PROMPT_MAX_HISTORY_MESSAGES", "6"))
+PROMPT_SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", "80"))
+
+# ==============================================================================
+# BULK ANALYSIS
+# ==============================================================================
+# /analyze labels stored messages without generating replies. Items are
+# analyzed ANALYZE_BATCH_SIZE at a time (one model call per batch of
+# BATCH_MAX_SIZE texts), with up to ANALYZE_CONCURRENT_BATCHES batches in
+# flight per job and at most ANALYZE_MAX_JOBS jobs at once. The request body is
+# spooled to disk beyond ANALYZE_SPOOL_MEMORY_BYTES and refused with a 413
+# beyond ANALYZE_MAX_BODY_BYTES; a single item may not exceed ANALYZE_MAX_ITEM_BYTES.
+ANALYZE_BATCH_SIZE = int(os.getenv("ANALYZE_BATCH_SIZE", "64"))
+ANALYZE_CONCURRENT_BATCHES = int(os.getenv("ANALYZE_CONCURRENT_BATCHES", "2"))
+ANALYZE_MAX_JOBS = int(os.getenv("ANALYZE_MAX_JOBS", "2"))
+ANALYZE_SPOOL_MEMORY_BYTES = int(os.getenv("ANALYZE_SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+ANALYZE_MAX_ITEM_BYTES = int(os.getenv("ANALYZE_MAX_ITEM_BYTES", str(64 * 1024)))
+ANALYZE_MAX_BODY_BYTES = int(os.getenv("ANALYZE_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
+
 
 # ==============================================================================
 # ENHANCED CRISIS & CONCERN PATTERNS
@@ -108,4 +294,8 @@ ANTI_REPETITION_STARTERS = [
     "It's completely normal to"
 ]
 
-print("API-based configuration file loaded successfully.")
\ No newline at end of file
+# Repetition is tracked incrementally over the last REPETITION_WINDOW assistant
+# replies of a session. Besides the fixed starters above, any opening of
+# REPETITION_OPENING_WORDS words that keeps recurring is flagged.
+REPETITION_WINDOW = int(os.getenv("REPETITION_WINDOW", "20"))
+REPETITION_OPENING_WORDS = int(os.getenv("REPETITION_OPENING_WORDS", "3"))
@@ -0,0 +1,2 @@
+# conftest.py
+"""Makes the service's flat modules importable from tests/ (run pytest from athenaos-ai)."""
@@ -0,0 +1,331 @@
+# generation.py
+import json
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from config import (
+    GROQ_API_KEY, GENERATIVE_MODEL_ID, GROQ_MAX_CONCURRENCY,
+    LLM_FALLBACK_BASE_URL, LLM_FALLBACK_API_KEY, LLM_FALLBACK_MODEL, LLM_FALLBACK_MAX_CONCURRENCY,
+    LLM_REQUEST_TIMEOUT, HEDGE_ENABLED, HEDGE_MIN_DELAY_MS, HEDGE_MAX_DELAY_MS
+)
+from metrics import UPSTREAM_ERRORS, GENERATION_HEDGES
+
+logger = logging.getLogger(__name__)
+
+# Smoothing factor of the per-provider time-to-first-token and error EWMAs
+EWMA_ALPHA = 0.2
+# Recent time-to-first-token samples kept per provider for the hedge deadline
+LATENCY_WINDOW = 200
+# Until a provider has this many samples its hedge deadline is HEDGE_MAX_DELAY_MS
+MIN_LATENCY_SAMPLES = 20
+HEDGE_QUANTILE = 0.95
+
+
+class GenerationUnavailable(Exception):
+    """Raised when every provider failed before producing a token."""
+
+
+class Provider(ABC):
+    """
+    A chat-completions backend plus the statistics the router ranks it by:
+    EWMAs of time-to-first-token and of errors, and a window of recent
+    time-to-first-token samples for the hedge deadline. At most
+    `max_concurrency` requests are in flight per provider; more wait for a slot.
+    """
+
+    def __init__(self, name: str, model: str, max_concurrency: int):
+        self.name = name
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.ttft_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+        # Created on first use so it binds to the serving event loop
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight += 1
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            self.in_flight -= 1
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _update_ttft(self, seconds: float):
+        self.ttft_ewma = seconds if self.ttft_ewma is None else (
+            EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ttft_ewma
+        )
+
+    def record_first_token(self, seconds: float):
+        self.samples.append(seconds)
+        self._update_ttft(seconds)
+        self.error_ewma *= (1 - EWMA_ALPHA)
+
+    def record_abandoned(self, seconds: float):
+        """A cancelled hedge loser: its first token would have taken at least `seconds`."""
+        if self.ttft_ewma is None or seconds > self.ttft_ewma:
+            self._update_ttft(seconds)
+
+    def record_error(self):
+        self.error_ewma = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_ewma
+
+    def hedge_delay(self) -> float:
+        """How long to wait for this provider's first token before hedging: its recent p95, clamped."""
+        low, high = HEDGE_MIN_DELAY_MS / 1000.0, HEDGE_MAX_DELAY_MS / 1000.0
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return high
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))]
+        return min(high, max(low, p95))
+
+    def score(self) -> float:
+        """Lower is better: expected time to first token, inflated by the error rate and saturation."""
+        ttft = self.ttft_ewma if self.ttft_ewma is not None else HEDGE_MAX_DELAY_MS / 1000.0
+        score = ttft * (1 + 4 * self.error_ewma)
+        if self.in_flight >= self.max_concurrency:
+            score += HEDGE_MAX_DELAY_MS / 1000.0
+        return score
+
+    @abstractmethod
+    def stream(self, messages: List[dict], **params) -> AsyncIterator[str]:
+        """Yields the reply's text deltas."""
+
+    async def warm_up(self):
+        """A cheap request that opens a connection without generating anything; raises on failure."""
+
+    async def aclose(self):
+        pass
+
+
+class GroqProvider(Provider):
+    def __init__(self, client, model: str = GENERATIVE_MODEL_ID, max_concurrency: int = GROQ_MAX_CONCURRENCY):
+        super().__init__("groq", model, max_concurrency)
+        self.client = client
+
+    async def stream(self, messages: List[dict], **params) -> AsyncIterator[str]:
+        response = await self.client.chat.completions.create(
+            messages=messages, model=self.model, stream=True, **params
+        )
+        try:
+            async for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            close = getattr(response, "close", None) or getattr(response, "aclose", None)
+            if close is not None:
+                await close()
+
+    async def warm_up(self):
+        await self.client.models.list()
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class OpenAICompatibleProvider(Provider):
+    """Any server implementing the OpenAI streaming chat-completions API (vLLM, llama.cpp, Ollama, ...)."""
+
+    def __init__(self, name: str, base_url: str, model: str, api_key: Optional[str] = None,
+                 max_concurrency: int = LLM_FALLBACK_MAX_CONCURRENCY, timeout: float = LLM_REQUEST_TIMEOUT):
+        super().__init__(name, model, max_concurrency)
+        self.base_url = base_url.rstrip("/")
+        self.url = self.base_url + "/chat/completions"
+        self.api_key = api_key
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+                headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else None,
+            )
+        return self._client
+
+    async def stream(self, messages: List[dict], **params) -> AsyncIterator[str]:
+        payload = {"model": self.model, "messages": messages, "stream": True, **params}
+        async with self.client.stream("POST", self.url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if delta:
+                    yield delta
+
+    async def warm_up(self):
+        (await self.client.get(self.base_url + "/models")).raise_for_status()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class _Attempt:
+    """One provider's stream, holding a concurrency slot until closed."""
+
+    def __init__(self, provider: Provider, messages: List[dict], params: dict):
+        self.provider = provider
+        self.stream = provider.stream(messages, **params)
+        self.started = time.perf_counter()
+        self._holding_slot = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    async def first_token(self) -> str:
+        await self.provider.acquire()
+        self._holding_slot = True
+        try:
+            first = await self.stream.__anext__()
+        except StopAsyncIteration:
+            # No reply at all is a failure, so another provider gets the request
+            raise GenerationUnavailable(f"{self.provider.name} returned an empty stream.") from None
+        self.provider.record_first_token(self.elapsed())
+        return first
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self._holding_slot:
+                self._holding_slot = False
+                self.provider.release()
+
+
+class GenerationRouter:
+    """
+    Routes each generation to the best-ranked provider.
+
+    If that provider fails before its first token, the next one is tried. If
+    it is merely slow (no token by its hedge deadline), a second request is
+    sent to the next provider; the first to produce a token wins and the other
+    is cancelled. Once tokens flow there is no failover.
+    """
+
+    def __init__(self, providers: List[Provider], hedge_enabled: bool = HEDGE_ENABLED):
+        self.providers = providers
+        self.hedge_enabled = hedge_enabled
+
+    def ranked(self) -> List[Provider]:
+        order = {id(p): i for i, p in enumerate(self.providers)}
+        return sorted(self.providers, key=lambda p: (p.score(), order[id(p)]))
+
+    def _record_failure(self, provider: Provider, error: BaseException):
+        provider.record_error()
+        UPSTREAM_ERRORS.inc(endpoint=provider.name, reason=type(error).__name__)
+        logger.warning(f"Generation provider {provider.name} failed: {error!r}")
+
+    async def stream(self, messages: List[dict], **params) -> AsyncIterator[str]:
+        candidates = self.ranked()
+        if not candidates:
+            raise GenerationUnavailable("No generation provider is configured.")
+
+        attempts: Dict[asyncio.Future, _Attempt] = {}
+        winner: Optional[_Attempt] = None
+        first = ""
+        last_error: Optional[BaseException] = None
+        hedged = False
+
+        def launch() -> _Attempt:
+            attempt = _Attempt(candidates.pop(0), messages, params)
+            attempts[asyncio.ensure_future(attempt.first_token())] = attempt
+            return attempt
+
+        current = launch()
+        try:
+            while attempts and winner is None:
+                timeout = None
+                if self.hedge_enabled and not hedged and candidates:
+                    timeout = max(0.0, current.provider.hedge_delay() - current.elapsed())
+                done, _ = await asyncio.wait(set(attempts), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    current = launch()
+                    GENERATION_HEDGES.inc(provider=current.provider.name)
+                    continue
+                for task in done:
+                    attempt = attempts.pop(task)
+                    if winner is None and task.exception() is None:
+                        winner, first = attempt, task.result()
+                        continue
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        self._record_failure(attempt.provider, last_error)
+                    await attempt.aclose()
+                if winner is None and not attempts and candidates:
+                    current = launch()
+        finally:
+            # Cancel the losers, or everything if the caller went away
+            for task in attempts:
+                task.cancel()
+            for task, attempt in attempts.items():
+                try:
+                    await task
+                except BaseException:
+                    pass
+                attempt.provider.record_abandoned(attempt.elapsed())
+                await attempt.aclose()
+            attempts.clear()
+
+        if winner is None:
+            raise GenerationUnavailable("All generation providers failed.") from last_error
+
+        try:
+            yield first
+            async for delta in winner.stream:
+                yield delta
+        except Exception as e:
+            self._record_failure(winner.provider, e)
+            raise
+        finally:
+            await winner.aclose()
+
+    async def complete(self, messages: List[dict], **params) -> str:
+        """The whole reply as one string. Streams internally, so hedging applies to the first token."""
+        parts = []
+        async for delta in self.stream(messages, **params):
+            parts.append(delta)
+        return "".join(parts)
+
+    async def aclose(self):
+        for provider in self.providers:
+            await provider.aclose()
+
+
+def create_generation_router(groq_api_key: Optional[str] = GROQ_API_KEY) -> GenerationRouter:
+    """Groq (when configured) plus the optional OpenAI-compatible fallback from config."""
+    providers: List[Provider] = []
+    if groq_api_key:
+        # Imported here rather than at module load: the SDK is the slowest import in the service
+        from groq import AsyncGroq
+        providers.append(GroqProvider(AsyncGroq(api_key=groq_api_key)))
+        logger.info(f"Groq client configured for model: {GENERATIVE_MODEL_ID}")
+    else:
+        logger.error("GROQ_API_KEY not found in environment variables.")
+    if LLM_FALLBACK_BASE_URL:
+        providers.append(OpenAICompatibleProvider(
+            "fallback", LLM_FALLBACK_BASE_URL, LLM_FALLBACK_MODEL, api_key=LLM_FALLBACK_API_KEY or None
+        ))
+    return GenerationRouter(providers)
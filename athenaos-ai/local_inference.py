@@ -0,0 +1,145 @@
+# local_inference.py
+"""
+In-process inference backend for the moderation, sentiment and emotion models.
+
+Each model is loaded from <LOCAL_MODEL_DIR>/<model id>/, which must contain an
+ONNX export (model_quantized.onnx is preferred over model.onnx), tokenizer.json
+and config.json (for id2label). An int8 export can be produced with e.g.:
+
+    optimum-cli export onnx --model cardiffnlp/twitter-roberta-base-sentiment-latest \\
+        model_store/cardiffnlp/twitter-roberta-base-sentiment-latest
+    optimum-cli onnxruntime quantize --avx2 \\
+        --onnx_model model_store/cardiffnlp/twitter-roberta-base-sentiment-latest \\
+        -o model_store/cardiffnlp/twitter-roberta-base-sentiment-latest
+
+Results have exactly the shape the Inference API returns for one string input,
+so moderate_text, analyze_sentiment and analyze_emotions parse them unchanged.
+"""
+import os
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from config import (
+    API_BASE_URL, INFERENCE_BACKEND, LOCAL_MODEL_DIR, LOCAL_INFERENCE_THREADS,
+    LOCAL_INFERENCE_INTRA_OP_THREADS, LOCAL_MAX_SEQUENCE_LENGTH
+)
+
+logger = logging.getLogger(__name__)
+
+# Preferred model files, in order: int8-quantized first
+MODEL_FILENAMES = ("model_quantized.onnx", "model.onnx")
+
+
+def model_id_from_url(api_url: str) -> str:
+    """Maps an Inference API URL to its model id, e.g. 'cardiffnlp/twitter-roberta-base-sentiment-latest'."""
+    if api_url.startswith(API_BASE_URL):
+        return api_url[len(API_BASE_URL):].strip("/")
+    return "/".join(api_url.rstrip("/").split("/")[-2:])
+
+
+class OnnxClassifier:
+    """A text-classification model run with ONNX Runtime on CPU."""
+
+    def __init__(self, model_dir: str, max_length: int = LOCAL_MAX_SEQUENCE_LENGTH,
+                 intra_op_threads: int = LOCAL_INFERENCE_INTRA_OP_THREADS):
+        # Optional dependencies, only needed when INFERENCE_BACKEND=local
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self._np = np
+        model_path = next(
+            (os.path.join(model_dir, name) for name in MODEL_FILENAMES
+             if os.path.exists(os.path.join(model_dir, name))),
+            None
+        )
+        if model_path is None:
+            raise FileNotFoundError(f"No ONNX model found in {model_dir}")
+
+        with open(os.path.join(model_dir, "config.json")) as f:
+            id2label = json.load(f)["id2label"]
+        self.labels = [id2label[str(i)] for i in range(len(id2label))]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"Loaded local model {model_path}")
+
+    def classify(self, texts: List[str]) -> List[List[dict]]:
+        """Returns, for each text, every label with its softmax score, highest first."""
+        np = self._np
+        encodings = self.tokenizer.encode_batch(texts)
+        features = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {k: v for k, v in features.items() if k in self.input_names})[0]
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return [
+            sorted(
+                ({'label': label, 'score': float(score)} for label, score in zip(self.labels, row)),
+                key=lambda x: x['score'], reverse=True
+            )
+            for row in probabilities
+        ]
+
+
+class LocalInferenceBackend:
+    """
+    Runs classifiers in a bounded thread pool so inference never blocks the
+    event loop. Models are loaded lazily, on first use.
+    """
+
+    def __init__(self, model_dir: str = LOCAL_MODEL_DIR, max_workers: int = LOCAL_INFERENCE_THREADS,
+                 classifier_factory: Callable[[str], OnnxClassifier] = OnnxClassifier):
+        self.model_dir = model_dir
+        self.classifier_factory = classifier_factory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local-inference")
+        self._classifiers: Dict[str, Optional[OnnxClassifier]] = {}
+        self._load_lock = threading.Lock()
+
+    def _classifier_for(self, api_url: str) -> Optional[OnnxClassifier]:
+        if api_url not in self._classifiers:
+            # Pool threads may race to load the same model; load it only once
+            with self._load_lock:
+                if api_url not in self._classifiers:
+                    model_dir = os.path.join(self.model_dir, model_id_from_url(api_url))
+                    try:
+                        self._classifiers[api_url] = self.classifier_factory(model_dir)
+                    except Exception as e:
+                        logger.error(f"Could not load local model from {model_dir}: {e}")
+                        self._classifiers[api_url] = None
+        return self._classifiers[api_url]
+
+    def _classify_sync(self, api_url: str, texts: List[str]):
+        classifier = self._classifier_for(api_url)
+        if classifier is None:
+            return [None] * len(texts)
+        return [[labels] for labels in classifier.classify(texts)]
+
+    async def classify_batch(self, api_url: str, texts: List[str]):
+        """Classifies a batch of texts, returning one API-shaped result (or None) per text."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._classify_sync, api_url, texts)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def create_local_backend() -> Optional[LocalInferenceBackend]:
+    """Builds the local backend when INFERENCE_BACKEND=local, otherwise returns None."""
+    if INFERENCE_BACKEND != "local":
+        return None
+    return LocalInferenceBackend()
@@ -1,42 +1,146 @@
 # main.py
+import time
+# Import time of the app and everything it loads, reported at startup
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import json
 import traceback
 import random
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
 import logging
-from groq import Groq, APIError
 
 # Import configs and processing functions
-from config import GROQ_API_KEY, GENERATIVE_MODEL_ID, MENTAL_HEALTH_RESOURCES
-from processing import (
-    sanitize_input, moderate_text, combined_sentiment_analysis,
-    generate_anti_repetition_instruction
+from config import (
+    MENTAL_HEALTH_RESOURCES, LOG_LEVEL,
+    PROFILING_ENABLED, PROFILE_HEADER, PROFILE_SAMPLE_INTERVAL_MS, ANALYZE_MAX_JOBS
+)
+from response_cache import response_cache, cache_context
+from metrics import (
+    Counter, Gauge, MetricsMiddleware, STAGE_DURATION, FALLBACKS, ADMISSION_REJECTIONS, render_metrics
 )
+import models
+from transport import get_transport, get_bulk_transport
+from generation import GenerationRouter, GenerationUnavailable, create_generation_router
+from admission import AdmissionController, request_deadline, run_until_disconnect, iterate_with_deadline
+from bulk import spool_request_body, stream_analysis
+from sessions import SessionBackend, create_session_store
+from processing import run_analysis_pipeline, precompile_patterns
+from prompts import build_generation_messages
+from startup import StartupState
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure Groq client 
-if not GROQ_API_KEY:
-    logger.error("GROQ_API_KEY not found in environment variables.")
-    client = None
-else:
-    client = Groq(api_key=GROQ_API_KEY)
-    logger.info(f"Groq client configured for model: {GENERATIVE_MODEL_ID}")
+# Built at startup (see lifespan), so importing this module opens no connections:
+# routes generations between Groq and any configured fallback provider
+router: Optional[GenerationRouter] = None
+# Conversation history backend (in-memory by default; SQLite or Redis to share
+# sessions between workers and replicas)
+session_store: Optional[SessionBackend] = None
+
+# Sampling parameters shared by the regular and streaming chat endpoints
+GENERATION_PARAMS = dict(temperature=0.7, max_tokens=256, top_p=0.9)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global router, session_store
+    start = time.perf_counter()
+    logging.basicConfig(level=LOG_LEVEL)
+    precompile_patterns()
+    models.init_inference()
+    router = create_generation_router()
+    session_store = create_session_store()
+    startup.started(time.perf_counter() - start)
+    startup.begin_warm_up(router)
+    yield
+    await startup.aclose()
+    # Release pooled connections on shutdown
+    await models.close_inference()
+    await session_store.close()
+    await router.aclose()
 
 # Configure FastAPI app
 app = FastAPI(
     title="Athena AI Therapist API (API-Only Architecture with Groq/Llama3)",
     version="8.0.0",
-    description="A lightweight, API-powered AI therapist with CBT integration."
+    description="A lightweight, API-powered AI therapist with CBT integration.",
+    lifespan=lifespan
+)
+app.add_middleware(
+    MetricsMiddleware,
+    profile_header=PROFILE_HEADER if PROFILING_ENABLED else None,
+    profile_interval=PROFILE_SAMPLE_INTERVAL_MS / 1000.0
 )
 
-# In-memory conversation history (for simplicity)
-conversation_history = {}
+# Global in-flight limit, bounded queue and one reply at a time per session
+admission = AdmissionController()
+# Bulk /analyze jobs are long-lived; beyond ANALYZE_MAX_JOBS they are refused rather than queued
+bulk_admission = AdmissionController(max_in_flight=ANALYZE_MAX_JOBS, max_queue=0)
+
+# Scrape-time metrics read from the components that already track them
+Gauge(
+    "athena_live_sessions", "Sessions currently held by the session store.",
+    callback=lambda: {(): session_store.stats().get('live_sessions', 0)}
+)
+Gauge(
+    "athena_session_bytes", "Estimated bytes of conversation history held in memory.",
+    callback=lambda: {(): session_store.stats().get('bytes_in_use', 0)}
+)
+Counter(
+    "athena_inference_cache_lookups_total", "Inference cache lookups by result.", ["result"],
+    callback=lambda: {
+        ('hit',): models.inference_cache.hits, ('disk_hit',): models.inference_cache.disk_hits,
+        ('miss',): models.inference_cache.misses
+    } if models.inference_cache is not None else {}
+)
+Counter(
+    "athena_response_cache_lookups_total", "Response cache lookups by result.", ["result"],
+    callback=lambda: {
+        ('hit',): response_cache.hits, ('miss',): response_cache.misses
+    } if response_cache is not None else {}
+)
+Gauge(
+    "athena_generation_ttft_ewma_seconds", "Smoothed time to first token per generation provider.", ["provider"],
+    callback=lambda: {(p.name,): p.ttft_ewma for p in router.providers if p.ttft_ewma is not None}
+)
+Gauge(
+    "athena_generation_in_flight", "Generations in flight (or waiting for a slot) per provider.", ["provider"],
+    callback=lambda: {(p.name,): p.in_flight for p in router.providers}
+)
+Gauge(
+    "athena_admission_in_flight", "Chat requests holding an admission slot.",
+    callback=lambda: {(): admission.in_flight}
+)
+Gauge(
+    "athena_admission_queued", "Chat requests waiting for an admission slot.",
+    callback=lambda: {(): admission.queued}
+)
+Gauge(
+    "athena_startup_seconds", "Time spent importing, starting and warming up this process.", ["phase"],
+    callback=lambda: {
+        (phase,): seconds for phase, seconds in (
+            ('import', startup.import_seconds), ('startup', startup.startup_seconds),
+            ('warmup', startup.warmup_seconds)
+        ) if seconds is not None
+    }
+)
+Gauge(
+    "athena_circuit_open",
+    "Whether an upstream model endpoint's circuit breaker is open (1) or not (0), for live or bulk traffic.",
+    ["endpoint", "pool"],
+    callback=lambda: {
+        (transport.endpoint_label(url), pool): int(breaker.state == breaker.OPEN)
+        for pool, transport in (('live', get_transport()), ('bulk', get_bulk_transport()))
+        for url, breaker in transport.breakers.items()
+    }
+)
 
 # --- Pydantic Models ---
 class HistoryItem(BaseModel):
@@ -90,107 +194,130 @@ def prepare_analysis_for_response(analysis_dict: dict) -> dict:
         prepared['resources'] = None
     return prepared
 
+# How long a streamed crisis response waits for the background analysis update
+BACKGROUND_ANALYSIS_TIMEOUT = 5.0
+
+FALLBACK_RESPONSE = "I'm having a little trouble processing my thoughts right now, but I'm still here to listen. Could you tell me a bit more?"
+
+def build_crisis_response() -> str:
+    crisis_resources = MENTAL_HEALTH_RESOURCES['crisis'][:2]
+    return (
+        "I hear the pain and urgency in your words, and I'm deeply concerned for your safety. "
+        "Please know you're not alone.\n\n**IMMEDIATE HELP IS AVAILABLE:**\n" +
+        "\n".join([f"• {r}" for r in crisis_resources]) +
+        "\n\nPlease reach out to these services immediately."
+    )
+
+async def prepare_session(request: ChatRequest):
+    """Resolves the session id and merges the caller's history into the session store."""
+    session_id = request.session_id or str(uuid.uuid4())
+    logger.info(f"Processing request for session: {session_id}")
+
+    # Only history the session doesn't already hold is stored
+    await session_store.merge_history(
+        session_id, [{"role": item.role, "content": item.content} for item in request.history]
+    )
+    return session_id, await session_store.get_history(session_id)
+
+async def analyze_input(user_input: str, history: List[dict], session_id: Optional[str] = None,
+                        complete_in_background: bool = False):
+    """
+    Runs the staged analysis pipeline (see processing.run_analysis_pipeline);
+    raises a 400 for harmful content.
+    """
+    repetition = await session_store.repetition(session_id) if session_id else None
+    pipeline = await run_analysis_pipeline(user_input, history, repetition, complete_in_background)
+    moderation_result = pipeline.moderation
+    if moderation_result and moderation_result['is_harmful']:
+        logger.warning(f"Harmful content detected via API (score: {moderation_result['score']:.3f})")
+        raise HTTPException(
+            status_code=400,
+            detail="Input contains harmful content."
+        )
+    return pipeline
+
+def response_cache_context(analysis_result_dict: dict, history: List[dict], sanitized_input: str):
+    """Cache partition for this turn's reply, or None if it must be generated."""
+    if response_cache is None:
+        return None
+    return cache_context(analysis_result_dict, history, sanitized_input)
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 # --- API Endpoints ---
 @app.get("/", tags=["Status"])
 async def read_root():
     return {
         "status": "Athena AI API (API-Only) is running",
         "version": "8.0.0",
-        "features": ["API-Based Analysis", "CBT Pattern Detection", "Crisis Detection", "Groq/Llama-3 Powered"]
+        "features": ["API-Based Analysis", "CBT Pattern Detection", "Crisis Detection", "Groq/Llama-3 Powered"],
+        "sessions": session_store.stats()
     }
 
+@app.get("/ready", tags=["Status"])
+async def read_ready():
+    """Readiness probe: 503 until startup warm-up has finished, then 200. Both report the startup timings."""
+    return JSONResponse(startup.report(), status_code=200 if startup.ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Status"])
+async def read_metrics():
+    """Prometheus text exposition of stage latencies, upstream errors, fallbacks, cache and session stats."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/chat", response_model=ChatResponse, tags=["Chat"])
-async def handle_chat(request: ChatRequest):
-    if not client:
+async def handle_chat(request: ChatRequest, http_request: Request):
+    """
+    Admission-controlled (see admission.py): sheds load with 429/503 and
+    Retry-After, and cancels the work if the client disconnects or the
+    request deadline passes.
+    """
+    if not router.providers:
         raise HTTPException(status_code=500, detail="Groq API key is not configured.")
 
-    session_id = request.session_id or str(uuid.uuid4())
-    logger.info(f"Processing request for session: {session_id}")
+    async with admission.admit(request.session_id, request_deadline(http_request.headers)) as ticket:
+        return await run_until_disconnect(http_request, generate_chat_response(request), ticket.remaining())
 
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-    conversation_history[session_id].extend(
-        [{"role": item.role, "content": item.content} for item in request.history]
-    )
+async def generate_chat_response(request: ChatRequest) -> ChatResponse:
+    session_id, history = await prepare_session(request)
 
-    sanitized_input = sanitize_input(request.user_input)
-    
-    # Step 1: Moderate content using the new API-based function
-    moderation_result = moderate_text(sanitized_input)
-    if moderation_result['is_harmful']:
-        logger.warning(f"Harmful content detected via API (score: {moderation_result['score']:.3f})")
-        raise HTTPException(
-            status_code=400,
-            detail="Input contains harmful content."
-        )
+    # Steps 1 & 2: Staged analysis (local checks first, then moderation and models)
+    pipeline = await analyze_input(request.user_input, history, session_id)
+    sanitized_input = pipeline.sanitized_input
+    analysis_result_dict = pipeline.analysis
 
-    # Step 2: Get combined analysis using the new API-based function
-    analysis_result_dict = combined_sentiment_analysis(sanitized_input, conversation_history[session_id])
-    
-    # Step 3: Handle crisis situations  
-    if analysis_result_dict.get('urgency_level') == 'crisis':
+    # Step 3: Handle crisis situations (the pipeline short-circuits on these)
+    if pipeline.short_circuit == 'crisis':
         analysis_for_response = prepare_analysis_for_response(analysis_result_dict)
-        crisis_resources = MENTAL_HEALTH_RESOURCES['crisis'][:2]
-        crisis_response = (
-            "I hear the pain and urgency in your words, and I'm deeply concerned for your safety. "
-            "Please know you're not alone.\n\n**IMMEDIATE HELP IS AVAILABLE:**\n" +
-            "\n".join([f"• {r}" for r in crisis_resources]) +
-            "\n\nPlease reach out to these services immediately."
-        )
         return ChatResponse(
-            response=crisis_response,
+            response=build_crisis_response(),
             analysis=AnalysisResult(**analysis_for_response),
             conversation_id=session_id,
             timestamp=datetime.now().isoformat(),
             word_count=len(sanitized_input.split())
         )
 
-    # Step 4: Generate the AI response using Groq (no changes in this logic)
+    # Step 4: Serve generic low-risk messages from the response cache, or generate with Groq
+    reply_context = response_cache_context(analysis_result_dict, history, sanitized_input)
     try:
-        repetitive_patterns = analysis_result_dict.get('cbt_analysis', {}).get('repetitive_patterns', [])
-        anti_repetition_instruction = generate_anti_repetition_instruction(repetitive_patterns)
-        cbt_instruction = ""
-        detected_patterns = analysis_result_dict.get('cbt_analysis', {}).get('patterns', [])
-        
-        if detected_patterns:
-            primary_pattern = detected_patterns[0]
-            intervention = analysis_result_dict.get('cbt_analysis', {}).get('intervention')
-            cbt_instruction = f"The user exhibits {primary_pattern}. Your response should: 1. Validate emotions. 2. Gently introduce the CBT concept of '{primary_pattern}'. 3. Suggest the technique: '{intervention}'. 4. End with an open-ended question."
-        elif any(emo['label'].lower() in ['sadness', 'anger', 'fear'] and emo['score'] > 0.7 for emo in analysis_result_dict.get('emotions', [])):
-            cbt_instruction = "The user expresses strong negative emotions. Prioritize: 1. Deep empathy and validation. 2. A simple coping technique (e.g., breathing). 3. An invitation to explore. 4. Avoid problem-solving."
-        
-        primary_emotion = max(analysis_result_dict.get('emotions', []), key=lambda x: x['score'])['label'] if analysis_result_dict.get('emotions') else 'unclear'
-        
-        system_prompt = f"""
-You are Athena, a compassionate AI therapist specializing in Cognitive Behavioral Therapy (CBT).
-
-CRITICAL GUIDELINES:
-- Your purpose is to support mental and emotional well-being. If asked about unrelated topics (e.g., politics, trivia), politely decline.
-- ANTI-REPETITION: Do NOT start with "It sounds like..." or "It seems like...". {anti_repetition_instruction}
-- Be concise (100-150 words) and end with an open-ended question.
-
-CURRENT USER STATE:
-- Sentiment: {analysis_result_dict.get('sentiment')}
-- Primary Emotion: {primary_emotion}
-- Detected CBT Patterns: {', '.join(detected_patterns) if detected_patterns else 'None'}
-
-{cbt_instruction}
-"""
-        messages_for_groq = [{"role": "system", "content": system_prompt}]
-        messages_for_groq.extend(conversation_history[session_id][-6:])
-        messages_for_groq.append({"role": "user", "content": sanitized_input})
-        
-        chat_completion = client.chat.completions.create(
-            messages=messages_for_groq,
-            model=GENERATIVE_MODEL_ID,
-            temperature=0.7, max_tokens=256, top_p=0.9,
-        )
-        
-        ai_response = chat_completion.choices[0].message.content.strip()
+        ai_response = None
+        if reply_context is not None:
+            ai_response = response_cache.lookup(sanitized_input, reply_context)
+
+        if ai_response is None:
+            with STAGE_DURATION.time(stage='prompt_build'):
+                messages_for_groq = build_generation_messages(analysis_result_dict, history, sanitized_input)
+
+            with STAGE_DURATION.time(stage='generation'):
+                ai_response = (await router.complete(messages_for_groq, **GENERATION_PARAMS)).strip()
+            if reply_context is not None:
+                response_cache.add(sanitized_input, reply_context, ai_response)
         word_count = len(ai_response.split())
 
-        conversation_history[session_id].append({'role': 'user', 'content': request.user_input})
-        conversation_history[session_id].append({'role': 'assistant', 'content': ai_response})
+        await session_store.append(session_id, [
+            {'role': 'user', 'content': request.user_input},
+            {'role': 'assistant', 'content': ai_response}
+        ])
 
         final_analysis = prepare_analysis_for_response(analysis_result_dict)
 
@@ -202,18 +329,159 @@ CURRENT USER STATE:
             word_count=word_count
         )
 
-    except APIError as e:
-        logger.error(f"Groq API Error: {e}")
+    except GenerationUnavailable as e:
+        logger.error(f"Generation failed on every provider: {e!r}")
         raise HTTPException(status_code=503, detail="Service Unavailable: Generative AI service failed.")
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         traceback.print_exc()
-        fallback_response = "I'm having a little trouble processing my thoughts right now, but I'm still here to listen. Could you tell me a bit more?"
+        FALLBACKS.inc(stage='generation')
         analysis_for_response = prepare_analysis_for_response(analysis_result_dict)
         return ChatResponse(
-            response=fallback_response,
+            response=FALLBACK_RESPONSE,
             analysis=AnalysisResult(**analysis_for_response),
             conversation_id=session_id,
             timestamp=datetime.now().isoformat(),
-            word_count=len(fallback_response.split())
-        )
\ No newline at end of file
+            word_count=len(FALLBACK_RESPONSE.split())
+        )
+
+@app.post("/chat/stream", tags=["Chat"])
+async def handle_chat_stream(request: ChatRequest, http_request: Request):
+    """
+    Same gating and admission control as /chat, but streams the reply as Server-Sent Events:
+    an `analysis` event, then `token` events with text deltas, then a final
+    `done` event with the word count and conversation id (or an `error` event).
+    On the crisis fast path a second `analysis` event follows the crisis
+    response once the skipped model stages have completed in the background.
+    """
+    if not router.providers:
+        raise HTTPException(status_code=500, detail="Groq API key is not configured.")
+
+    ticket = await admission.acquire(request.session_id, request_deadline(http_request.headers))
+    try:
+        session_id, history = await prepare_session(request)
+        # Moderation failures, disconnects and deadlines are still plain HTTP errors before streaming starts
+        pipeline = await run_until_disconnect(
+            http_request, analyze_input(request.user_input, history, session_id, complete_in_background=True),
+            ticket.remaining()
+        )
+        sanitized_input = pipeline.sanitized_input
+        analysis_result_dict = pipeline.analysis
+        analysis_for_response = AnalysisResult(**prepare_analysis_for_response(analysis_result_dict))
+        reply_context = response_cache_context(analysis_result_dict, history, sanitized_input)
+    except BaseException:
+        ticket.release()
+        raise
+
+    async def event_stream():
+        yield format_sse("analysis", {"analysis": analysis_for_response.model_dump(), "conversation_id": session_id})
+
+        if pipeline.short_circuit == 'crisis':
+            yield format_sse("token", {"delta": build_crisis_response()})
+            # The skipped model stages finish in the background; send them as an update
+            completed = None
+            if pipeline.background is not None:
+                try:
+                    completed = await asyncio.wait_for(
+                        asyncio.shield(pipeline.background), timeout=BACKGROUND_ANALYSIS_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            if completed is not None:
+                yield format_sse("analysis", {
+                    "analysis": AnalysisResult(**prepare_analysis_for_response(completed)).model_dump(),
+                    "conversation_id": session_id
+                })
+            yield format_sse("done", {
+                "conversation_id": session_id,
+                "timestamp": datetime.now().isoformat(),
+                "word_count": len(sanitized_input.split())
+            })
+            return
+
+        parts = []
+        cached_reply = None
+        if reply_context is not None:
+            cached_reply = response_cache.lookup(sanitized_input, reply_context)
+        try:
+            if cached_reply is not None:
+                parts.append(cached_reply)
+                yield format_sse("token", {"delta": cached_reply})
+            else:
+                with STAGE_DURATION.time(stage='prompt_build'):
+                    messages_for_groq = build_generation_messages(analysis_result_dict, history, sanitized_input)
+                start = time.perf_counter()
+                deltas = router.stream(messages_for_groq, **GENERATION_PARAMS)
+                async for delta in iterate_with_deadline(deltas, ticket.deadline):
+                    if not parts:
+                        STAGE_DURATION.observe(time.perf_counter() - start, stage='generation_first_token')
+                    parts.append(delta)
+                    yield format_sse("token", {"delta": delta})
+                STAGE_DURATION.observe(time.perf_counter() - start, stage='generation')
+        except asyncio.TimeoutError:
+            logger.warning(f"Request deadline exceeded while streaming for session {session_id}.")
+            ADMISSION_REJECTIONS.inc(reason="deadline")
+            yield format_sse("error", {"detail": "The request deadline was exceeded."})
+            return
+        except GenerationUnavailable as e:
+            logger.error(f"Generation failed on every provider: {e!r}")
+            yield format_sse("error", {"detail": "Service Unavailable: Generative AI service failed."})
+            return
+        except Exception as e:
+            logger.error(f"An unexpected error occurred while streaming: {e}")
+            traceback.print_exc()
+            FALLBACKS.inc(stage='generation')
+            if parts:
+                yield format_sse("error", {"detail": "Generation was interrupted."})
+                return
+            yield format_sse("token", {"delta": FALLBACK_RESPONSE})
+            yield format_sse("done", {
+                "conversation_id": session_id,
+                "timestamp": datetime.now().isoformat(),
+                "word_count": len(FALLBACK_RESPONSE.split())
+            })
+            return
+
+        ai_response = "".join(parts).strip()
+        if reply_context is not None and cached_reply is None:
+            response_cache.add(sanitized_input, reply_context, ai_response)
+        await session_store.append(session_id, [
+            {'role': 'user', 'content': request.user_input},
+            {'role': 'assistant', 'content': ai_response}
+        ])
+        yield format_sse("done", {
+            "conversation_id": session_id,
+            "timestamp": datetime.now().isoformat(),
+            "word_count": len(ai_response.split())
+        })
+
+    return StreamingResponse(
+        ticket.guard(event_stream()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/analyze", tags=["Analysis"])
+async def handle_analyze(http_request: Request):
+    """
+    Analysis-only bulk labeling, e.g. to backfill stored messages; no replies are generated.
+
+    The body is a JSON array or NDJSON of strings or {"id", "text"} objects
+    ("content" is accepted for "text"). The response is NDJSON, one line per
+    item in input order: {"id", "sentiment", "sentiment_score", "emotions",
+    "cbt_patterns", "urgency_level", "moderation"}, with null for a model
+    whose call failed, or {"id", "error"} for an invalid item. Items are
+    analyzed in batches and streamed back as they complete (see bulk.py).
+    """
+    ticket = await bulk_admission.acquire()
+    try:
+        body = await spool_request_body(http_request)
+    except BaseException:
+        ticket.release()
+        raise
+    return StreamingResponse(ticket.guard(stream_analysis(body)), media_type="application/x-ndjson")
+
+
+# Everything above ran at import; the lifespan reports this alongside the startup time
+startup = StartupState(time.perf_counter() - IMPORT_STARTED)
@@ -0,0 +1,207 @@
+# metrics.py
+"""
+Minimal, dependency-free metrics with Prometheus text exposition.
+
+Recording a value is a dict lookup plus an addition (a bisect for histograms),
+so instrumentation stays cheap on the request path. Values that already live
+elsewhere (cache counters, session counts) are read by callbacks at scrape time.
+"""
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond regex work to slow generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _format_labels(labelnames: Sequence[str], key: LabelKey, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelKey, float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Optional scrape-time source of values, returning {label tuple: value}
+        self.callback = callback
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        values = dict(self._values)
+        if self.callback is not None:
+            try:
+                values.update(self.callback())
+            except Exception:
+                pass
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render_metrics() -> str:
+    """Renders every registered metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# ==============================================================================
+# SERVICE METRICS
+# ==============================================================================
+STAGE_DURATION = Histogram(
+    "athena_stage_duration_seconds",
+    "Time spent in each request stage (sanitize, patterns, moderation, sentiment, emotion, prompt_build, generation).",
+    ["stage"]
+)
+REQUEST_DURATION = Histogram(
+    "athena_request_duration_seconds", "End-to-end request latency by endpoint.", ["endpoint"]
+)
+UPSTREAM_ERRORS = Counter(
+    "athena_upstream_errors_total", "Failed calls to upstream model endpoints.", ["endpoint", "reason"]
+)
+UPSTREAM_RETRIES = Counter(
+    "athena_upstream_retries_total", "Retried calls to upstream model endpoints.", ["endpoint"]
+)
+FALLBACKS = Counter(
+    "athena_fallbacks_total", "Responses that used fallback values because an upstream call failed.", ["stage"]
+)
+URGENCY_DETECTIONS = Counter(
+    "athena_urgency_detections_total", "Messages matching crisis or concern patterns.", ["level"]
+)
+GENERATION_HEDGES = Counter(
+    "athena_generation_hedges_total",
+    "Hedged generation requests, sent because the first provider had no token by its deadline.", ["provider"]
+)
+ADMISSION_REJECTIONS = Counter(
+    "athena_admission_rejections_total",
+    "Chat requests shed by admission control (session_busy, overloaded, queue_timeout, deadline).", ["reason"]
+)
+ANALYZE_ITEMS = Counter(
+    "athena_analyze_items_total",
+    "Items labeled by /analyze (ok, partial when a model call failed, invalid).", ["result"]
+)
+PROMPT_TOKENS = Histogram(
+    "athena_prompt_tokens", "Estimated tokens per generation prompt.",
+    buckets=(64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096)
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per endpoint. When `profile_header`
+    is set, requests carrying that header are also run under a SamplingProfiler
+    and the report is logged.
+    """
+
+    def __init__(self, app, profile_header: Optional[str] = None, profile_interval: float = 0.005):
+        self.app = app
+        self.profile_header = profile_header.lower().encode("latin-1") if profile_header else None
+        self.profile_interval = profile_interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profiler = None
+        if self.profile_header is not None and any(
+            name == self.profile_header for name, _ in scope.get("headers", [])
+        ):
+            profiler = SamplingProfiler(interval=self.profile_interval).start()
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The matched route template keeps label cardinality bounded
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - start, endpoint=endpoint)
+            if profiler is not None:
+                profiler.stop()
+                logger.info(f"Profile for {scope.get('method')} {scope.get('path')}:\n{profiler.report()}")
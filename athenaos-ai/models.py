@@ -1,35 +1,159 @@
 # models.py
-import requests
+import asyncio
 import logging
-from config import HUGGINGFACE_API_KEY
+from functools import partial
+from typing import Dict, List, Optional
+from config import HUGGINGFACE_API_KEY, BATCHING_ENABLED, BATCH_MAX_SIZE
+from batching import MicroBatcher
+from cache import InferenceCache, create_inference_cache, make_cache_key
+from local_inference import LocalInferenceBackend, create_local_backend
+from transport import InferenceTransport, get_transport, get_bulk_transport, close_transport
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+# Input sent by warm_up_model
+WARMUP_TEXT = "hello"
+
+# One micro-batching dispatcher per model endpoint
+_batchers: Dict[str, MicroBatcher] = {}
+
+# Built at startup (see init_inference), so importing this module opens nothing:
+# in-process ONNX backend, or None when using the remote Inference API
+local_backend: Optional[LocalInferenceBackend] = None
+# Result cache used by query_huggingface_api, or None when disabled
+inference_cache: Optional[InferenceCache] = None
+
+
+def init_inference():
+    """Builds the local backend and the inference cache (called on application startup)."""
+    global local_backend, inference_cache
+    local_backend = create_local_backend()
+    inference_cache = create_inference_cache()
+
+
+async def close_inference():
+    """Closes the inference transport, local backend and cache (called on application shutdown)."""
+    global local_backend, inference_cache
+    await close_transport()
+    # Batchers hold the sender of the backend being shut down
+    _batchers.clear()
+    if local_backend is not None:
+        local_backend.shutdown()
+        local_backend = None
+    if inference_cache is not None:
+        inference_cache.close()
+        inference_cache = None
+
+
+async def post_batch(api_url: str, texts: List[str], transport: Optional[InferenceTransport] = None):
+    """
+    Sends several texts to a model in one request, through `transport`
+    (the shared live-traffic transport by default).
+
+    Returns one result per text, each shaped like the response to a single
+    string input (a one-element list of label/score dicts), or None on failure.
+    """
+    transport = transport or get_transport()
+    if len(texts) == 1:
+        return [await transport.post_json(api_url, {"inputs": texts[0]})]
+
+    response = await transport.post_json(api_url, {"inputs": texts})
+    if not isinstance(response, list) or len(response) != len(texts):
+        if response is not None:
+            logger.error(f"Unexpected batched response shape from {api_url}.")
+        return [None] * len(texts)
+    return [[item] for item in response]
+
+
+def _batch_sender():
+    return local_backend.classify_batch if local_backend is not None else post_batch
+
+
+def get_batcher(api_url: str) -> MicroBatcher:
+    if api_url not in _batchers:
+        _batchers[api_url] = MicroBatcher(api_url, _batch_sender())
+    return _batchers[api_url]
+
+
 # This is the helper function that will call the Hugging Face Inference API
-def query_huggingface_api(api_url: str, text: str):
+async def query_huggingface_api(api_url: str, text: str):
     """
-    Sends a request to a specified Hugging Face Inference API endpoint.
-    
+    Sends a request to a specified Hugging Face Inference API endpoint, or runs
+    the same model in-process when INFERENCE_BACKEND=local (see local_inference.py).
+
+    Results are served from the inference cache when possible (see cache.py),
+    and concurrent cache misses for the same model are coalesced into one
+    batched request (see batching.py).
+    Connection pooling, timeouts, retries and the per-endpoint circuit breaker
+    are handled by the shared transport (see transport.py).
+
     Args:
         api_url (str): The URL of the model's API endpoint.
         text (str): The input text to be analyzed.
-        
+
     Returns:
         dict: The JSON response from the API, or None if an error occurs.
     """
-    if not HUGGINGFACE_API_KEY:
+    if local_backend is None and not HUGGINGFACE_API_KEY:
         logger.error("HUGGINGFACE_API_KEY not found. Cannot query API.")
         return None
 
-    headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
-    payload = {"inputs": text}
-    
-    try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=10)
-        response.raise_for_status()  
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"API request to {api_url} failed: {e}")
-        return None
+    cache_key = None
+    if inference_cache is not None:
+        cache_key = make_cache_key(api_url, text)
+        cached = await inference_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # The local backend always batches: one ONNX run per batch is much cheaper
+    if BATCHING_ENABLED or local_backend is not None:
+        result = await get_batcher(api_url).submit(text)
+    else:
+        result = await get_transport().post_json(api_url, {"inputs": text})
+    # Failed calls are not cached so the endpoint is retried next time
+    if result is not None and cache_key is not None:
+        inference_cache.set(cache_key, result)
+    return result
+
+
+async def warm_up_model(api_url: str) -> bool:
+    """
+    Sends one short input to a model so that, before real traffic arrives,
+    the pool holds an open connection and the hosted model is loaded (or,
+    with the local backend, its ONNX session is created). Bypasses the caches.
+    """
+    if local_backend is not None:
+        return (await local_backend.classify_batch(api_url, [WARMUP_TEXT]))[0] is not None
+    if not HUGGINGFACE_API_KEY:
+        return False
+    return await get_transport().post_json(api_url, {"inputs": WARMUP_TEXT}) is not None
+
+
+async def query_huggingface_api_batch(api_url: str, texts: List[str]):
+    """
+    Bulk counterpart of query_huggingface_api for offline analysis.
+
+    Sends `texts` straight to the model in requests of BATCH_MAX_SIZE inputs,
+    without the micro-batching wait, and returns one result (or None) per
+    text. The inference cache is bypassed so a backfill over historical
+    messages doesn't evict the entries live chat traffic relies on, and
+    remote calls go through the bulk transport's own circuit breakers.
+    """
+    if local_backend is None and not HUGGINGFACE_API_KEY:
+        logger.error("HUGGINGFACE_API_KEY not found. Cannot query API.")
+        return [None] * len(texts)
+
+    if local_backend is not None:
+        send_batch = local_backend.classify_batch
+    else:
+        send_batch = partial(post_batch, transport=get_bulk_transport())
+    chunks = [texts[i:i + BATCH_MAX_SIZE] for i in range(0, len(texts), BATCH_MAX_SIZE)]
+    responses = await asyncio.gather(*(send_batch(api_url, chunk) for chunk in chunks), return_exceptions=True)
+    results = []
+    for chunk, response in zip(chunks, responses):
+        if isinstance(response, Exception):
+            logger.error(f"Bulk request to {api_url} failed: {response}")
+            response = [None] * len(chunk)
+        results.extend(response)
+    return results
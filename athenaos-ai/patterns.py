@@ -0,0 +1,148 @@
+# patterns.py
+import re
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+# Patterns using backreferences or global inline flags can't be merged into an
+# alternation, so they are matched on their own
+_STANDALONE_RE = re.compile(r"\\[1-9]|\(\?P=|^\(\?[aiLmsux]+\)")
+# Compiled alternations kept for the category subsets that rescans use
+MATCHER_CACHE_SIZE = 64
+
+
+class PatternMatch(NamedTuple):
+    category: str
+    pattern: str
+    span: Tuple[int, int]
+
+
+def without_capture_groups(pattern: str) -> str:
+    """
+    Rewrites every capturing group in a regex as a non-capturing one.
+
+    The regex engine saves and restores capture marks on every branch it
+    tries, so a large alternation full of capturing groups gets slower with
+    the total number of groups; without them the cost stays linear.
+    """
+    out = []
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            out.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if char == "]":
+                in_class = False
+        elif char == "[":
+            in_class = True
+            out.append(char)
+            i += 1
+            # A ']' straight after '[' or '[^' is a literal, not the end of the class
+            for literal in ("^", "]"):
+                if pattern.startswith(literal, i):
+                    out.append(literal)
+                    i += 1
+            continue
+        elif char == "(":
+            if pattern.startswith("(?P<", i):
+                out.append("(?:")
+                i = pattern.index(">", i) + 1
+                continue
+            if not pattern.startswith("(?", i):
+                out.append("(?:")
+                i += 1
+                continue
+        out.append(char)
+        i += 1
+    return "".join(out)
+
+
+class PatternEngine:
+    """
+    Matches many regex patterns, grouped into categories, in a single scan.
+
+    All patterns are compiled at construction into one alternation without
+    capturing groups, and the (once-lowercased) text is scanned with it a
+    single time. Only at the rare positions where it hits are the per-category
+    matchers consulted to tell which category matched. At any position only
+    the first matching alternative is reported, so once a scan has matched
+    some categories they are dropped and the remaining ones are rescanned; the
+    number of scans is bounded by the number of matched categories plus one.
+    Spans refer to the lowercased text.
+    """
+
+    def __init__(self, categories: Dict[str, Sequence[str]], flags: int = 0):
+        self.flags = flags
+        # Categories without patterns can never match
+        self.categories = [category for category, patterns in categories.items() if patterns]
+        self._patterns: Dict[str, List[Tuple[str, "re.Pattern"]]] = {}
+        self._mergeable: Dict[str, List[str]] = {}
+        self._standalone: Dict[str, List[Tuple[str, "re.Pattern"]]] = {}
+        for category in self.categories:
+            self._patterns[category] = [(p, re.compile(p, flags)) for p in categories[category]]
+            self._mergeable[category] = [
+                without_capture_groups(p) for p in categories[category] if not _STANDALONE_RE.search(p)
+            ]
+            self._standalone[category] = [
+                (p, compiled) for p, compiled in self._patterns[category] if _STANDALONE_RE.search(p)
+            ]
+        self._category_matchers = {category: self._compile((category,)) for category in self.categories}
+        # Compile the full matcher up front, so it is ready before the first request
+        self._compile(tuple(self.categories))
+
+    def precompile(self, max_matchers: int = MATCHER_CACHE_SIZE) -> int:
+        """
+        Compiles the matchers a rescan falls back to once some categories have
+        matched, largest category subsets first, up to `max_matchers`, so no
+        request pays for compiling one. Returns how many were compiled.
+        """
+        compiled = 0
+        for size in range(len(self.categories), 0, -1):
+            for subset in combinations(self.categories, size):
+                if compiled >= max_matchers:
+                    return compiled
+                self._compile(subset)
+                compiled += 1
+        return compiled
+
+    @lru_cache(maxsize=MATCHER_CACHE_SIZE)
+    def _compile(self, categories: Tuple[str, ...]) -> "re.Pattern":
+        alternatives = [f"(?:{p})" for category in categories for p in self._mergeable[category]]
+        # An empty alternation would match everywhere; use a pattern that never matches
+        return re.compile("|".join(alternatives) or r"(?!)", self.flags)
+
+    def _identify(self, text: str, start: int, categories: Tuple[str, ...]) -> Tuple[str, str]:
+        """Finds the first category, and its pattern, that matches at `start`."""
+        for category in categories:
+            if self._category_matchers[category].match(text, start):
+                for pattern, compiled in self._patterns[category]:
+                    if compiled.match(text, start):
+                        return category, pattern
+                return category, self._patterns[category][0][0]
+        raise LookupError(f"No category matches at position {start}")
+
+    def scan(self, text: str) -> Dict[str, List[PatternMatch]]:
+        """Returns every matched category, in definition order, with its matches."""
+        found: Dict[str, List[PatternMatch]] = {}
+        if not text:
+            return found
+        text = text.lower()
+        remaining = tuple(self.categories)
+        while remaining:
+            matched_now: Dict[str, List[PatternMatch]] = {}
+            for match in self._compile(remaining).finditer(text):
+                category, pattern = self._identify(text, match.start(), remaining)
+                matched_now.setdefault(category, []).append(PatternMatch(category, pattern, match.span()))
+            for category in remaining:
+                for pattern, compiled in self._standalone[category]:
+                    for match in compiled.finditer(text):
+                        matched_now.setdefault(category, []).append(PatternMatch(category, pattern, match.span()))
+            if not matched_now:
+                break
+            found.update(matched_now)
+            remaining = tuple(c for c in remaining if c not in matched_now)
+        return {category: found[category] for category in self.categories if category in found}
@@ -1,75 +1,157 @@
 # processing.py
 import re
+import time
 import random
+import asyncio
 import logging
-from models import query_huggingface_api  
+from contextlib import contextmanager
+from models import query_huggingface_api, query_huggingface_api_batch
+from patterns import PatternEngine
+from repetition import RepetitionTracker
+from chunking import split_into_chunks, mean_label_scores, max_label_score
+from metrics import STAGE_DURATION, FALLBACKS, URGENCY_DETECTIONS
 from config import (
     CRISIS_PATTERNS, CONCERN_PATTERNS,
-    CBT_PATTERNS, CBT_INTERVENTIONS, GENERAL_CBT_TECHNIQUES, ANTI_REPETITION_STARTERS,
-    MODERATION_API_URL, SENTIMENT_API_URL, EMOTION_API_URL  
+    CBT_PATTERNS, CBT_INTERVENTIONS, GENERAL_CBT_TECHNIQUES,
+    MODERATION_API_URL, SENTIMENT_API_URL, EMOTION_API_URL,
+    SANITIZE_MAX_LENGTH, ANALYSIS_MAX_LENGTH, ANALYSIS_CHUNK_CHARS
 )
 
 logger = logging.getLogger(__name__)
 
-def sanitize_input(text):
-    """Enhanced sanitization to clean input text. (No changes here)"""
+# All crisis, concern and CBT patterns are compiled into one engine, so each
+# message is scanned once rather than once per pattern. It is built at startup
+# (see precompile_patterns) rather than at import.
+URGENCY_CATEGORIES = ('crisis', 'concern')
+_pattern_engine = None
+
+def get_pattern_engine():
+    global _pattern_engine
+    if _pattern_engine is None:
+        _pattern_engine = PatternEngine({
+            'crisis': CRISIS_PATTERNS,
+            'concern': CONCERN_PATTERNS,
+            **{name: [regex] for name, regex in CBT_PATTERNS.items()}
+        })
+    return _pattern_engine
+
+def precompile_patterns():
+    """Builds the pattern engine and compiles every matcher a scan can need; returns how many."""
+    return get_pattern_engine().precompile()
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_DISALLOWED_CHARS_RE = re.compile(r'[^\w\s.,!?\'"-]')
+TRUNCATION_MARKER = "... [truncated]"
+# Raw input beyond this multiple of the output length is dropped before the
+# regex passes; the slack absorbs markup and symbols they remove
+RAW_INPUT_FACTOR = 2
+
+def truncate_text(text, max_length=SANITIZE_MAX_LENGTH):
+    """Cuts sanitized text to `max_length` characters, marking the cut."""
+    if len(text) > max_length:
+        return (text[:max_length] + TRUNCATION_MARKER).strip()
+    return text
+
+def sanitize_input(text, max_length=SANITIZE_MAX_LENGTH):
+    """
+    Enhanced sanitization to clean input text, truncated to `max_length`.
+    The raw text is bounded first, so oversized payloads cost no more than long ones.
+    """
     if not text:
         return ""
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'[^\w\s.,!?\'"-]', '', text)
-    max_length = 1000
-    if len(text) > max_length:
-        text = text[:max_length] + "... [truncated]"
+    bound = max_length * RAW_INPUT_FACTOR
+    cut = len(text) > bound
+    text = _TAG_RE.sub('', text[:bound])
+    text = _DISALLOWED_CHARS_RE.sub('', text)
+    if cut or len(text) > max_length:
+        text = text[:max_length] + TRUNCATION_MARKER
     return text.strip()
 
-def moderate_text(text):
+# The *_from_responses helpers take (model response, chunk length) pairs, one
+# per chunk of the text (see classify_chunks); a short text is a single chunk
+
+def moderation_from_responses(responses):
+    """Harmfulness: the highest score of the 'hate' label in any chunk."""
+    harmful_score = max_label_score(responses, 'hate')
+    return {'is_harmful': harmful_score > 0.7, 'score': harmful_score}
+
+def sentiment_from_responses(responses):
+    """The top (label, score) of the length-weighted mean sentiment."""
+    scores = mean_label_scores(responses)
+    label = max(scores, key=scores.get)
+    return label.lower(), scores[label]
+
+def emotions_from_responses(responses):
+    """Emotions whose length-weighted mean score is above 0.1, strongest first."""
+    scores = mean_label_scores(responses)
+    return sorted(
+        [{'label': label, 'score': score} for label, score in scores.items() if score > 0.1],
+        key=lambda x: x['score'], reverse=True
+    )
+
+async def classify_chunks(api_url, text):
+    """
+    Classifies `text` in sentence-aligned chunks of ANALYSIS_CHUNK_CHARS and
+    returns (response, chunk length) per chunk, or an empty list if any
+    chunk's call failed: like bulk analysis, a text is only labeled from all
+    of its chunks, and callers count the stage as a fallback otherwise.
+    The chunks are submitted together, so the micro-batcher sends them as one
+    request; text that fits in a chunk costs a single call as before.
+    """
+    chunks = split_into_chunks(text, ANALYSIS_CHUNK_CHARS)
+    responses = await asyncio.gather(*(query_huggingface_api(api_url, chunk) for chunk in chunks))
+    failed = sum(1 for response in responses if not response)
+    if failed:
+        if failed < len(chunks):
+            logger.warning(f"{failed} of {len(chunks)} chunks failed for {api_url}; using fallback values.")
+        return []
+    return [(response, len(chunk)) for response, chunk in zip(responses, chunks)]
+
+async def moderate_text(text):
     """
     Moderates text by calling the Hugging Face Inference API.
     """
     try:
-        api_response = query_huggingface_api(MODERATION_API_URL, text)
-        if not api_response:
+        responses = await classify_chunks(MODERATION_API_URL, text)
+        if not responses:
+            FALLBACKS.inc(stage='moderation')
             return {'is_harmful': False, 'score': 0.0}
 
-        # Find the score for the 'hate' label
-        harmful_score = 0.0
-        for item in api_response[0]:
-            if item['label'] == 'hate':
-                harmful_score = item['score']
-                break
-        
-        logger.info(f"Moderation score from API: {harmful_score:.3f}")
-        return {'is_harmful': harmful_score > 0.7, 'score': harmful_score}
+        moderation = moderation_from_responses(responses)
+        logger.info(f"Moderation score from API: {moderation['score']:.3f}")
+        return moderation
     except Exception as e:
         logger.error(f"Error processing moderation API response: {e}")
+        FALLBACKS.inc(stage='moderation')
         return {'is_harmful': False, 'score': 0.0}
 
 
-def enhanced_crisis_detection(text):
-    """Enhanced crisis detection with expanded patterns. (No changes here)"""
+def scan_patterns(text):
+    """Scans text once for every crisis, concern and CBT pattern category."""
+    return get_pattern_engine().scan(text)
+
+
+def enhanced_crisis_detection(text, matches=None):
+    """Enhanced crisis detection with expanded patterns. Accepts a prior scan_patterns result."""
     if not text:
         return None
-    text_lower = text.lower()
-    for pattern in CRISIS_PATTERNS:
-        if re.search(pattern, text_lower):
-            logger.warning(f"Crisis pattern detected: {pattern}")
-            return "crisis"
-    for pattern in CONCERN_PATTERNS:
-        if re.search(pattern, text_lower):
-            logger.info(f"Concern pattern detected: {pattern}")
-            return "concern"
+    if matches is None:
+        matches = scan_patterns(text)
+    if 'crisis' in matches:
+        logger.warning(f"Crisis pattern detected: {matches['crisis'][0].pattern}")
+        return "crisis"
+    if 'concern' in matches:
+        logger.info(f"Concern pattern detected: {matches['concern'][0].pattern}")
+        return "concern"
     return None
 
-def detect_cbt_patterns(text):
-    """Detect cognitive distortions using CBT patterns. (No changes here)"""
+def detect_cbt_patterns(text, matches=None):
+    """Detect cognitive distortions using CBT patterns. Accepts a prior scan_patterns result."""
     if not text:
         return []
-    text_lower = text.lower()
-    detected_patterns = []
-    for pattern_name, regex in CBT_PATTERNS.items():
-        if re.search(regex, text_lower):
-            detected_patterns.append(pattern_name)
-    return detected_patterns
+    if matches is None:
+        matches = scan_patterns(text)
+    return [name for name in matches if name not in URGENCY_CATEGORIES]
 
 def generate_cbt_intervention(detected_patterns, emotions):
     """Generate targeted CBT intervention. (No changes here)"""
@@ -82,72 +164,262 @@ def generate_cbt_intervention(detected_patterns, emotions):
 
 
 def analyze_conversation_patterns(history):
-    """Analyze conversation history for repetitive patterns. (No changes here)"""
+    """
+    Analyze conversation history for repetitive starters and openings.
+
+    Sessions keep this state incrementally (see SessionBackend.repetition);
+    this rebuilds it from a plain history for callers without a session.
+    """
     if not history:
         return []
-    assistant_responses = [msg['content'] for msg in history if msg['role'] == 'assistant']
-    repetitive_phrases = []
-    for phrase in ANTI_REPETITION_STARTERS:
-        count = sum(1 for response in assistant_responses if phrase.lower() in response.lower())
-        if count > 1 and count > len(assistant_responses) * 0.3:
-            repetitive_phrases.append(phrase)
-    return repetitive_phrases
-
-def combined_sentiment_analysis(text, history=None):
+    return RepetitionTracker.from_responses(
+        msg['content'] for msg in history if msg['role'] == 'assistant'
+    ).repetitive_patterns()
+
+async def analyze_sentiment(text):
+    """Returns the top (label, score) from the sentiment model, or ('unknown', 0.0)."""
+    try:
+        sentiment_responses = await classify_chunks(SENTIMENT_API_URL, text)
+        if sentiment_responses:
+            return sentiment_from_responses(sentiment_responses)
+    except Exception as e:
+        logger.error(f"Error processing sentiment API response: {e}")
+    FALLBACKS.inc(stage='sentiment')
+    return 'unknown', 0.0
+
+async def analyze_emotions(text):
+    """Returns emotions scoring above 0.1, strongest first."""
+    try:
+        emotion_responses = await classify_chunks(EMOTION_API_URL, text)
+        if emotion_responses:
+            return emotions_from_responses(emotion_responses)
+    except Exception as e:
+        logger.error(f"Error processing emotion API response: {e}")
+    FALLBACKS.inc(stage='emotion')
+    return []
+
+def _result_or_fallback(result, stage, fallback):
+    """A gather(return_exceptions=True) result, or `fallback` (counted) if that stage raised."""
+    if isinstance(result, Exception):
+        logger.error(f"Error in {stage} stage: {result!r}")
+        FALLBACKS.inc(stage=stage)
+        return fallback
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+def build_analysis_result(sentiment_label, sentiment_score, emotions, detected_patterns,
+                          cbt_intervention, urgency_level, repetitive_patterns):
+    # Override sentiment if urgency is detected
+    if urgency_level:
+        sentiment_label = 'crisis' if urgency_level == 'crisis' else 'concern'
+    return {
+        'sentiment': sentiment_label,
+        'sentiment_score': sentiment_score,
+        'emotions': emotions,
+        'cbt_analysis': {
+            'patterns': detected_patterns,
+            'intervention': cbt_intervention,
+            'repetitive_patterns': repetitive_patterns
+        },
+        'urgency_level': urgency_level,
+    }
+
+# ==============================================================================
+# STAGED ANALYSIS PIPELINE
+# ==============================================================================
+
+class AnalysisTrace:
+    """Records the decision and timing of every analysis stage, and feeds the stage latency histogram."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, decision='ran'):
+        record = {'stage': name, 'decision': decision, 'ms': 0.0}
+        self.stages.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            record['ms'] = round(elapsed * 1000, 3)
+            STAGE_DURATION.observe(elapsed, stage=name)
+
+    async def timed(self, name, awaitable, decision='ran'):
+        with self.stage(name, decision):
+            return await awaitable
+
+    def skip(self, name, reason):
+        self.stages.append({'stage': name, 'decision': f"skipped: {reason}", 'ms': 0.0})
+
+
+# Background stage tasks still running after their request has been answered
+_background_tasks = set()
+
+
+class PipelineResult:
+    __slots__ = ('sanitized_input', 'analysis', 'moderation', 'short_circuit', 'trace', 'background')
+
+    def __init__(self, sanitized_input, analysis, moderation, short_circuit, trace, background=None):
+        self.sanitized_input = sanitized_input
+        self.analysis = analysis
+        self.moderation = moderation
+        # Name of the stage that ended the pipeline early (e.g. 'crisis'), if any
+        self.short_circuit = short_circuit
+        self.trace = trace
+        # Task completing skipped stages after the fact; resolves to the filled-in analysis
+        self.background = background
+
+
+async def _complete_analysis_in_background(text, analysis, trace):
+    """Fills the sentiment/emotion fields of a short-circuited analysis after the response has gone out."""
+    try:
+        (_, sentiment_score), emotions = await asyncio.gather(
+            trace.timed('sentiment', analyze_sentiment(text), decision='background'),
+            trace.timed('emotion', analyze_emotions(text), decision='background'),
+        )
+        analysis['sentiment_score'] = sentiment_score
+        analysis['emotions'] = emotions
+        logger.debug("Background analysis complete: %s", analysis)
+    except Exception as e:
+        logger.error(f"Background analysis failed: {e}")
+    return analysis
+
+async def run_analysis_pipeline(user_input, history=None, repetition=None, complete_in_background=False):
     """
-    Combines all analysis steps into one function, using API calls for ML tasks.
+    Staged analysis: cheap local stages run first and may short-circuit.
+
+    1. sanitize, pattern scan (crisis/concern/CBT) and repetition checks run locally.
+       Up to ANALYSIS_MAX_LENGTH characters are analyzed (the model stages
+       classify long text in chunks); the returned sanitized_input, used in
+       the prompt, is cut to SANITIZE_MAX_LENGTH.
+       Repetition reads the session's RepetitionTracker when one is passed and
+       only falls back to scanning `history` without it.
+    2. A crisis match ends the pipeline: the canned crisis response doesn't depend
+       on moderation, sentiment or emotion, so those remote calls are skipped.
+       With `complete_in_background` (set by callers that send the completed
+       analysis on, like /chat/stream), sentiment/emotion are completed in
+       the background instead.
+    3. Otherwise moderation, sentiment and emotion run concurrently.
     """
-    try:
-        # Get sentiment from API
-        sentiment_response = query_huggingface_api(SENTIMENT_API_URL, text)
-        if sentiment_response:
-            sentiment_result = max(sentiment_response[0], key=lambda x: x['score'])
-            sentiment_label = sentiment_result['label'].lower()
-            sentiment_score = sentiment_result['score']
+    trace = AnalysisTrace()
+    with trace.stage('sanitize'):
+        analysis_text = sanitize_input(user_input, ANALYSIS_MAX_LENGTH)
+        text = truncate_text(analysis_text, SANITIZE_MAX_LENGTH)
+    with trace.stage('patterns') as record:
+        pattern_matches = scan_patterns(analysis_text)
+        urgency_level = enhanced_crisis_detection(analysis_text, pattern_matches)
+        detected_patterns = detect_cbt_patterns(analysis_text, pattern_matches)
+        record['decision'] = urgency_level or 'no urgency'
+        if urgency_level:
+            URGENCY_DETECTIONS.inc(level=urgency_level)
+    with trace.stage('repetition'):
+        if repetition is not None:
+            repetitive_patterns = repetition.repetitive_patterns()
         else:
-            sentiment_label, sentiment_score = 'unknown', 0.0
+            repetitive_patterns = analyze_conversation_patterns(history) if history else []
 
-        # Get emotions from API
-        emotion_response = query_huggingface_api(EMOTION_API_URL, text)
-        if emotion_response:
-            # Filter emotions with a score > 0.1 and sort them
-            emotions = sorted([res for res in emotion_response[0] if res['score'] > 0.1], key=lambda x: x['score'], reverse=True)
-        else:
-            emotions = []
-
-        # The following functions are regex/logic-based and do not need API calls
-        detected_patterns = detect_cbt_patterns(text)
-        cbt_intervention = generate_cbt_intervention(detected_patterns, emotions)
-        urgency_level = enhanced_crisis_detection(text)
-        
-        # Override sentiment if urgency is detected
-        if urgency_level:
-            sentiment_label = 'crisis' if urgency_level == 'crisis' else 'concern'
-
-        repetitive_patterns = analyze_conversation_patterns(history) if history else []
-
-        result = {
-            'sentiment': sentiment_label,
-            'sentiment_score': sentiment_score,
-            'emotions': emotions,
-            'cbt_analysis': {
-                'patterns': detected_patterns,
-                'intervention': cbt_intervention,
-                'repetitive_patterns': repetitive_patterns
-            },
-            'urgency_level': urgency_level,
-        }
-        logger.info(f"API-based analysis complete: {result}")
-        return result
-        
+    if urgency_level == 'crisis':
+        for name in ('moderation', 'sentiment', 'emotion'):
+            trace.skip(name, 'crisis fast path')
+        analysis = build_analysis_result(
+            'unknown', 0.0, [], detected_patterns, generate_cbt_intervention(detected_patterns, []),
+            urgency_level, repetitive_patterns
+        )
+        background = None
+        if complete_in_background:
+            background = asyncio.ensure_future(_complete_analysis_in_background(analysis_text, analysis, trace))
+            # Keep a reference so the task outlives the request that started it
+            _background_tasks.add(background)
+            background.add_done_callback(_background_tasks.discard)
+        return PipelineResult(text, analysis, None, 'crisis', trace, background)
+
+    # Each stage falls back on its own, so a failed sentiment or emotion
+    # stage never discards the moderation verdict
+    moderation, sentiment, emotions = await asyncio.gather(
+        trace.timed('moderation', moderate_text(analysis_text)),
+        trace.timed('sentiment', analyze_sentiment(analysis_text)),
+        trace.timed('emotion', analyze_emotions(analysis_text)),
+        return_exceptions=True
+    )
+    moderation = _result_or_fallback(moderation, 'moderation', {'is_harmful': False, 'score': 0.0})
+    sentiment_label, sentiment_score = _result_or_fallback(sentiment, 'sentiment', ('unknown', 0.0))
+    emotions = _result_or_fallback(emotions, 'emotion', [])
+
+    analysis = build_analysis_result(
+        sentiment_label, sentiment_score, emotions, detected_patterns,
+        generate_cbt_intervention(detected_patterns, emotions), urgency_level, repetitive_patterns
+    )
+    logger.debug("Analysis pipeline complete: %s (stages: %s)", analysis, trace.stages)
+    return PipelineResult(text, analysis, moderation, None, trace)
+
+# ==============================================================================
+# BULK ANALYSIS
+# ==============================================================================
+
+def _aggregate_or_none(aggregate, responses):
+    # A text is only labeled once every one of its chunks has been classified
+    if not responses or any(not response for response, _ in responses):
+        return None
+    try:
+        return aggregate(responses)
     except Exception as e:
-        logger.error(f"Error in combined_sentiment_analysis (API version): {e}")
-        # Return a default structure on error
-        return {
-            'sentiment': 'unknown', 'sentiment_score': 0.0, 'emotions': [],
-            'cbt_analysis': {'patterns': [], 'intervention': None, 'repetitive_patterns': []},
-            'urgency_level': None
-        }
+        logger.error(f"Unexpected model response in bulk analysis: {e}")
+        return None
+
+async def analyze_batch(texts):
+    """
+    Labels many messages at once for offline backfills (see bulk.py).
+
+    Runs the same stages as run_analysis_pipeline without the live-traffic
+    parts: no crisis short-circuit (every message gets every label), no
+    repetition check or CBT intervention, and no per-message logging or
+    urgency metrics. Long messages are analyzed in chunks, as in the live
+    path, and each model is called once per batch of unique chunks.
+    Returns one dict per text; sentiment, emotions or moderation are None
+    when their model call failed, so the caller can retry just those.
+    """
+    sanitized = [sanitize_input(text, ANALYSIS_MAX_LENGTH) for text in texts]
+    chunks = {text: split_into_chunks(text, ANALYSIS_CHUNK_CHARS) for text in sanitized if text}
+    unique = list(dict.fromkeys(chunk for text_chunks in chunks.values() for chunk in text_chunks))
+
+    moderation, sentiment, emotions = {}, {}, {}
+    if unique:
+        responses = await asyncio.gather(
+            query_huggingface_api_batch(MODERATION_API_URL, unique),
+            query_huggingface_api_batch(SENTIMENT_API_URL, unique),
+            query_huggingface_api_batch(EMOTION_API_URL, unique),
+        )
+        mod_by_chunk, sent_by_chunk, emo_by_chunk = (dict(zip(unique, r)) for r in responses)
+        for text, text_chunks in chunks.items():
+            moderation[text] = _aggregate_or_none(
+                moderation_from_responses, [(mod_by_chunk[c], len(c)) for c in text_chunks])
+            sentiment[text] = _aggregate_or_none(
+                sentiment_from_responses, [(sent_by_chunk[c], len(c)) for c in text_chunks])
+            emotions[text] = _aggregate_or_none(
+                emotions_from_responses, [(emo_by_chunk[c], len(c)) for c in text_chunks])
+
+    results = []
+    for text in sanitized:
+        if not text:
+            results.append({
+                'sentiment': 'unknown', 'sentiment_score': 0.0, 'emotions': [],
+                'cbt_patterns': [], 'urgency_level': None, 'moderation': {'is_harmful': False, 'score': 0.0}
+            })
+            continue
+        matches = scan_patterns(text)
+        label_score = sentiment[text]
+        results.append({
+            'sentiment': label_score[0] if label_score else None,
+            'sentiment_score': label_score[1] if label_score else None,
+            'emotions': emotions[text],
+            'cbt_patterns': detect_cbt_patterns(text, matches),
+            'urgency_level': next((level for level in URGENCY_CATEGORIES if level in matches), None),
+            'moderation': moderation[text],
+        })
+    return results
 
 def generate_anti_repetition_instruction(repetitive_patterns):
     """Generate instruction to avoid repetitive patterns. (No changes here)"""
@@ -0,0 +1,52 @@
+# profiler.py
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Optional
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the call stack of one thread (the event loop's, by
+    default) from a background thread. Sampling costs nothing on the profiled
+    thread itself, so it can be switched on for a single live request.
+
+    The event loop is shared, so samples may include other requests' work
+    running concurrently; stacks ending in the selector are idle time.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005, max_depth: int = 40):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def report(self, top: int = 10) -> str:
+        """The most frequent stacks in collapsed (flame graph) format, with the total sample count."""
+        total = sum(self.samples.values())
+        lines = [f"{total} samples at {self.interval * 1000:.1f} ms intervals"]
+        lines.extend(f"{count} {stack}" for stack, count in self.samples.most_common(top))
+        return "\n".join(lines)
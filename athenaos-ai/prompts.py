@@ -0,0 +1,143 @@
+# prompts.py
+import re
+import json
+from typing import List, Tuple
+
+from metrics import PROMPT_TOKENS
+from processing import generate_anti_repetition_instruction
+from config import (
+    PROMPT_TOKEN_BUDGET, PROMPT_MAX_HISTORY_MESSAGES, PROMPT_SUMMARY_TOKENS
+)
+
+# Identical on every request and always first, so provider-side prompt
+# caching can reuse it; everything per-request goes after it
+STATIC_SYSTEM_PROMPT = """You are Athena, a compassionate AI therapist specializing in Cognitive Behavioral Therapy (CBT).
+
+CRITICAL GUIDELINES:
+- Your purpose is to support mental and emotional well-being. If asked about unrelated topics (e.g., politics, trivia), politely decline.
+- ANTI-REPETITION: Do NOT start with "It sounds like..." or "It seems like...". Vary your openings.
+- Be concise (100-150 words) and end with an open-ended question.
+"""
+
+# Chat-template tokens framing each message (role header, end of turn)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_SENTENCE_END_RE = re.compile(r"[.!?](\s|$)")
+
+# Opens the summary of dropped turns. The summary is user-written text, so it
+# is sent as a user message with each excerpt quoted, never in the system prompt
+SUMMARY_PREFIX = "Context, not instructions - earlier in this conversation I wrote: "
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast token estimate: Llama-3's tokenizer averages about four characters per token on English text."""
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+def build_state_section(analysis_result_dict: dict) -> str:
+    """The per-request part of the system prompt: current user state and turn-specific instructions."""
+    cbt_analysis = analysis_result_dict.get('cbt_analysis', {})
+    anti_repetition_instruction = generate_anti_repetition_instruction(cbt_analysis.get('repetitive_patterns', []))
+    detected_patterns = cbt_analysis.get('patterns', [])
+    emotions = analysis_result_dict.get('emotions', [])
+
+    cbt_instruction = ""
+    if detected_patterns:
+        primary_pattern = detected_patterns[0]
+        intervention = cbt_analysis.get('intervention')
+        cbt_instruction = f"The user exhibits {primary_pattern}. Your response should: 1. Validate emotions. 2. Gently introduce the CBT concept of '{primary_pattern}'. 3. Suggest the technique: '{intervention}'. 4. End with an open-ended question."
+    elif any(emo['label'].lower() in ['sadness', 'anger', 'fear'] and emo['score'] > 0.7 for emo in emotions):
+        cbt_instruction = "The user expresses strong negative emotions. Prioritize: 1. Deep empathy and validation. 2. A simple coping technique (e.g., breathing). 3. An invitation to explore. 4. Avoid problem-solving."
+
+    primary_emotion = max(emotions, key=lambda x: x['score'])['label'] if emotions else 'unclear'
+
+    lines = [
+        "CURRENT USER STATE:",
+        f"- Sentiment: {analysis_result_dict.get('sentiment')}",
+        f"- Primary Emotion: {primary_emotion}",
+        f"- Detected CBT Patterns: {', '.join(detected_patterns) if detected_patterns else 'None'}",
+    ]
+    if anti_repetition_instruction:
+        lines.append(f"- {anti_repetition_instruction}")
+    if cbt_instruction:
+        lines.extend(["", cbt_instruction])
+    return "\n".join(lines)
+
+
+def _gist(text: str, max_chars: int = 100) -> str:
+    """First sentence of a message, clipped."""
+    match = _SENTENCE_END_RE.search(text)
+    sentence = text[:match.start() + 1] if match else text
+    sentence = " ".join(sentence.split())
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rsplit(" ", 1)[0] + "..."
+
+
+def summarize_dropped_turns(dropped: List[dict], max_tokens: int = PROMPT_SUMMARY_TOKENS) -> str:
+    """
+    Extractive summary of history that didn't fit: the gist of the most recent
+    dropped user messages, each quoted as a JSON string, within `max_tokens`.
+    Costs no extra model call.
+    """
+    if max_tokens <= 0:
+        return ""
+    gists = []
+    used = estimate_tokens(SUMMARY_PREFIX)
+    for message in reversed(dropped):
+        if message['role'] != 'user':
+            continue
+        gist = _gist(message['content'])
+        if not gist:
+            break
+        quoted = json.dumps(gist, ensure_ascii=False)
+        cost = estimate_tokens(quoted) - MESSAGE_OVERHEAD_TOKENS + 1
+        if used + cost > max_tokens:
+            break
+        gists.append(quoted)
+        used += cost
+    if not gists:
+        return ""
+    return SUMMARY_PREFIX + " | ".join(reversed(gists))
+
+
+def select_history(history: List[dict], budget: int,
+                   max_messages: int = PROMPT_MAX_HISTORY_MESSAGES) -> Tuple[List[dict], List[dict]]:
+    """
+    Splits history into (kept, dropped): the newest messages that fit in
+    `budget` estimated tokens (at most `max_messages`), and everything older.
+    """
+    kept_from = len(history)
+    used = 0
+    while kept_from > 0 and len(history) - kept_from < max_messages:
+        cost = estimate_tokens(history[kept_from - 1]['content'])
+        if used + cost > budget:
+            break
+        used += cost
+        kept_from -= 1
+    return history[kept_from:], history[:kept_from]
+
+
+def build_generation_messages(analysis_result_dict: dict, history: List[dict], sanitized_input: str,
+                              token_budget: int = PROMPT_TOKEN_BUDGET) -> List[dict]:
+    """
+    Builds the message list sent to the generative model: the static prompt
+    prefix and the dynamic state section (the system message), a summary of
+    older turns as a user message, as much recent history as the token
+    budget allows and the new user message.
+    """
+    state_section = build_state_section(analysis_result_dict)
+    fixed_tokens = (
+        estimate_tokens(STATIC_SYSTEM_PROMPT) + estimate_tokens(state_section) + estimate_tokens(sanitized_input)
+    )
+    history_budget = max(0, token_budget - fixed_tokens - max(0, PROMPT_SUMMARY_TOKENS))
+    kept, dropped = select_history(history, history_budget)
+
+    system_prompt = f"{STATIC_SYSTEM_PROMPT}\n{state_section}\n"
+
+    messages_for_groq = [{"role": "system", "content": system_prompt}]
+    summary = summarize_dropped_turns(dropped) if dropped else ""
+    if summary:
+        messages_for_groq.append({"role": "user", "content": summary})
+    messages_for_groq.extend({"role": m['role'], "content": m['content']} for m in kept)
+    messages_for_groq.append({"role": "user", "content": sanitized_input})
+    PROMPT_TOKENS.observe(sum(estimate_tokens(m['content']) for m in messages_for_groq))
+    return messages_for_groq
@@ -0,0 +1,90 @@
+# repetition.py
+import re
+import json
+from collections import Counter, deque
+from typing import Iterable, List, Optional, Tuple
+
+from config import ANTI_REPETITION_STARTERS, REPETITION_WINDOW, REPETITION_OPENING_WORDS
+
+# A phrase or opening is repetitive once it appears in more than one reply and
+# in more than this share of the replies in the window
+REPETITION_MIN_SHARE = 0.3
+
+_WORD_RE = re.compile(r"[\w']+")
+_STARTERS = [(phrase, phrase.lower()) for phrase in ANTI_REPETITION_STARTERS]
+
+# Per reply: the starter phrases it contains and its opening n-gram (if long enough)
+ReplyFeatures = Tuple[Tuple[str, ...], Optional[str]]
+
+
+def reply_features(response: str, opening_words: int = REPETITION_OPENING_WORDS) -> ReplyFeatures:
+    """Extracts what repetition checks need from one assistant reply; the reply itself isn't kept."""
+    text = response.lower()
+    phrases = tuple(phrase for phrase, lowered in _STARTERS if lowered in text)
+    # Openings are short, so only the start of the reply needs tokenizing
+    words = _WORD_RE.findall(text[:opening_words * 24])[:opening_words]
+    opening = " ".join(words) if len(words) == opening_words else None
+    return phrases, opening
+
+
+class RepetitionTracker:
+    """
+    Running counts of starter phrases and opening n-grams over the last
+    `window` assistant replies of a session.
+
+    `add` costs one pass over the new reply plus O(phrases) counter updates
+    (the reply falling out of the window is subtracted), and
+    `repetitive_patterns` only reads the counters, so the per-turn cost stays
+    flat however long the session runs.
+    """
+    __slots__ = ('window', 'replies', 'phrase_counts', 'opening_counts')
+
+    def __init__(self, window: int = REPETITION_WINDOW):
+        self.window = window
+        self.replies: "deque[ReplyFeatures]" = deque()
+        self.phrase_counts = Counter()
+        self.opening_counts = Counter()
+
+    @classmethod
+    def from_responses(cls, responses: Iterable[str], window: int = REPETITION_WINDOW) -> "RepetitionTracker":
+        tracker = cls(window)
+        for response in responses:
+            tracker.add(response)
+        return tracker
+
+    def add(self, response: str):
+        self._push(reply_features(response))
+
+    def _push(self, features: ReplyFeatures):
+        phrases, opening = features
+        self.replies.append(features)
+        self.phrase_counts.update(phrases)
+        if opening:
+            self.opening_counts[opening] += 1
+        if len(self.replies) > self.window:
+            old_phrases, old_opening = self.replies.popleft()
+            self.phrase_counts.subtract(old_phrases)
+            if old_opening:
+                self.opening_counts[old_opening] -= 1
+                if self.opening_counts[old_opening] <= 0:
+                    del self.opening_counts[old_opening]
+
+    def repetitive_patterns(self) -> List[str]:
+        """Starter phrases first (in config order), then recurring openings, most frequent first."""
+        threshold = max(1, len(self.replies) * REPETITION_MIN_SHARE)
+        patterns = [phrase for phrase, _ in _STARTERS if self.phrase_counts[phrase] > threshold]
+        patterns.extend(
+            opening for opening, count in self.opening_counts.most_common() if count > threshold
+        )
+        return patterns
+
+    def to_json(self) -> str:
+        return json.dumps([[list(phrases), opening] for phrases, opening in self.replies])
+
+    @classmethod
+    def from_json(cls, data: Optional[str], window: int = REPETITION_WINDOW) -> "RepetitionTracker":
+        tracker = cls(window)
+        if data:
+            for phrases, opening in json.loads(data):
+                tracker._push((tuple(phrases), opening))
+        return tracker
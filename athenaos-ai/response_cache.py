@@ -0,0 +1,190 @@
+# response_cache.py
+import re
+import math
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from cache import normalize_text
+from config import (
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_SIMILARITY, RESPONSE_CACHE_VARIANTS, RESPONSE_CACHE_MAX_WORDS
+)
+
+# Hashed embedding size. Collisions only add a little noise for the short
+# messages this cache targets.
+EMBEDDING_DIMENSIONS = 1024
+
+# Sparse unit vector: {bucket: weight}
+Vector = Dict[int, float]
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+# Negation barely moves n-gram similarity ("im (not) feeling anxious" scores
+# about 0.89), so the negations in a message are part of its exact partition
+_NEGATIONS = frozenset([
+    "not", "no", "never", "nothing", "nobody", "none", "cannot", "without",
+    "dont", "doesnt", "didnt", "cant", "wont", "isnt", "arent", "wasnt", "havent", "couldnt", "shouldnt",
+])
+
+
+def semantic_text(text: str) -> str:
+    """Normalized text without punctuation, so "hello!" and "hello" share an entry."""
+    return " ".join(_PUNCTUATION_RE.sub("", normalize_text(text)).split())
+
+
+def negations(words: str) -> Tuple[str, ...]:
+    return tuple(sorted(_NEGATIONS.intersection(words.split())))
+
+
+def embed(normalized_text: str) -> Vector:
+    """Hashed character-trigram embedding, L2-normalized. Stable across processes (CRC32, not hash())."""
+    padded = f" {normalized_text} "
+    counts: Dict[int, float] = {}
+    for i in range(len(padded) - 2):
+        bucket = zlib.crc32(padded[i:i + 3].encode("utf-8")) % EMBEDDING_DIMENSIONS
+        counts[bucket] = counts.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {bucket: v / norm for bucket, v in counts.items()}
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+def echoes(reply: str, words: Set[str]) -> bool:
+    """Whether `reply` repeats any of `words`, e.g. a name the other message gave."""
+    return bool(words) and not words.isdisjoint(semantic_text(reply).split())
+
+
+def cache_context(analysis: dict, history: List[dict], text: str,
+                  max_words: int = RESPONSE_CACHE_MAX_WORDS) -> Optional[Tuple]:
+    """
+    The partition a message's reply is cached under: its sentiment, primary
+    emotion and CBT patterns. None when the message must always be generated:
+    a crisis or concern match, any prior history (a reply written with one
+    conversation in context may quote or refer to it), or more than
+    `max_words` words (similarity can't tell long messages that need very
+    different replies apart).
+    """
+    if analysis.get('urgency_level') or history or len(text.split()) > max_words:
+        return None
+    emotions = analysis.get('emotions') or []
+    primary_emotion = max(emotions, key=lambda x: x['score'])['label'] if emotions else None
+    patterns = tuple(analysis.get('cbt_analysis', {}).get('patterns', []))
+    return analysis.get('sentiment'), primary_emotion, patterns
+
+
+class _Entry:
+    __slots__ = ('context', 'text', 'vector', 'variants', 'served', 'expires_at')
+
+    def __init__(self, context: Hashable, text: str, vector: Vector, expires_at: float):
+        self.context = context
+        self.text = text
+        self.vector = vector
+        self.variants: List[str] = []
+        self.served = 0
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    In-memory semantic cache of generated replies.
+
+    Lookups try the exact normalized text first (one dict access), then a
+    cosine scan over the entries of the same analysis context only. Each
+    entry collects up to `max_variants` replies from real generations before
+    it is served, and hits rotate through them so users don't see the same
+    reply verbatim. On a similar (not exact) match, replies that repeat a
+    word only one of the two messages contains ("my name is Sarah" vs.
+    "Sara") are neither served nor recorded. Entries expire `ttl` seconds
+    after creation and the least recently used are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY, max_variants: int = RESPONSE_CACHE_VARIANTS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.max_variants = max(1, max_variants)
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._by_context: Dict[Hashable, Set[Tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _find(self, normalized: str, context: Hashable) -> Optional[_Entry]:
+        now = time.monotonic()
+        entry = self._entries.get((context, normalized))
+        if entry is None:
+            vector = embed(normalized)
+            best = 0.0
+            for key in self._by_context.get(context, ()):
+                candidate = self._entries[key]
+                score = cosine(vector, candidate.vector)
+                if score > best:
+                    best, entry = score, candidate
+            if best < self.similarity:
+                entry = None
+        if entry is not None and entry.expires_at <= now:
+            self._remove((entry.context, entry.text))
+            return None
+        if entry is not None:
+            self._entries.move_to_end((entry.context, entry.text))
+        return entry
+
+    def lookup(self, text: str, context: Hashable) -> Optional[str]:
+        """Returns a cached reply for `text`, or None."""
+        normalized = semantic_text(text)
+        entry = self._find(normalized, (context, negations(normalized)))
+        if entry is None or len(entry.variants) < self.max_variants:
+            self.misses += 1
+            return None
+        distinct = set(entry.text.split()).symmetric_difference(normalized.split())
+        replies = [reply for reply in entry.variants if not echoes(reply, distinct)]
+        if not replies:
+            self.misses += 1
+            return None
+        reply = replies[entry.served % len(replies)]
+        entry.served += 1
+        self.hits += 1
+        return reply
+
+    def add(self, text: str, context: Hashable, reply: str):
+        """Records a generated reply as a variant for `text` (or the similar message it was matched to)."""
+        if not reply:
+            return
+        normalized = semantic_text(text)
+        context = (context, negations(normalized))
+        entry = self._find(normalized, context)
+        if entry is None:
+            key = (context, normalized)
+            entry = self._entries[key] = _Entry(context, normalized, embed(normalized), time.monotonic() + self.ttl)
+            self._by_context.setdefault(context, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        distinct = set(entry.text.split()).symmetric_difference(normalized.split())
+        if len(entry.variants) < self.max_variants and reply not in entry.variants and not echoes(reply, distinct):
+            entry.variants.append(reply)
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key)
+        keys = self._by_context.get(entry.context)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[entry.context]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Process-wide cache used by the chat endpoints
+response_cache: Optional[ResponseCache] = ResponseCache() if RESPONSE_CACHE_ENABLED else None
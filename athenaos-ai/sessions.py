@@ -0,0 +1,484 @@
+# sessions.py
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from repetition import RepetitionTracker
+from config import (
+    SESSION_BACKEND, SESSION_DB_PATH, REDIS_URL, SESSION_KEY_PREFIX, REDIS_SOCKET_TIMEOUT, REDIS_CONNECT_TIMEOUT,
+    SESSION_MAX_MESSAGES, SESSION_IDLE_TTL, SESSION_MAX_BYTES
+)
+
+logger = logging.getLogger(__name__)
+
+# Approximate per-message overhead on top of the content string (slots object,
+# list slot, shared role string), used for the memory budget
+MESSAGE_OVERHEAD_BYTES = 64
+
+
+class Message:
+    """A compact conversation message. Role strings are interned, so every message shares them."""
+    __slots__ = ('role', 'content')
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+
+    @property
+    def size(self) -> int:
+        return MESSAGE_OVERHEAD_BYTES + sys.getsizeof(self.content)
+
+    def key(self):
+        return (self.role, self.content)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {'role': self.role, 'content': self.content}
+
+
+class Session:
+    __slots__ = ('messages', 'last_access', 'size', 'repetition')
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.last_access = time.monotonic()
+        self.size = 0
+        self.repetition = RepetitionTracker()
+
+
+def new_messages(stored: Sequence[Message], incoming: Sequence[Message]) -> Sequence[Message]:
+    """
+    Returns the part of `incoming` that is not already stored.
+
+    Callers resend their recent history on every request, so `incoming` usually
+    overlaps the end of `stored`. The longest prefix of `incoming` whose tail
+    lines up with the tail of `stored` is treated as already seen.
+    """
+    if not stored:
+        return incoming
+    stored_keys = [m.key() for m in stored]
+    incoming_keys = [m.key() for m in incoming]
+    for end in range(len(incoming_keys), 0, -1):
+        overlap = min(end, len(stored_keys))
+        if incoming_keys[end - overlap:end] == stored_keys[len(stored_keys) - overlap:]:
+            return incoming[end:]
+    return incoming
+
+
+class SessionBackend(ABC):
+    """
+    Interface for conversation history storage.
+
+    Backends are append-only: `append` writes a batch of messages (e.g. the
+    user + assistant pair of one turn) in one operation, and `recent` reads the
+    last K messages in O(K). Calls are awaited from request handlers, so
+    backends doing I/O must not block the event loop, and each operation
+    should cost a single local or round-trip access. `stats` is read at
+    metrics scrape time and must not do I/O.
+
+    Backends also keep a RepetitionTracker per session, updated as assistant
+    messages are appended, so repetition checks never rescan the history.
+    """
+
+    def __init__(self, max_messages: int = SESSION_MAX_MESSAGES, idle_ttl: float = SESSION_IDLE_TTL):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+
+    @abstractmethod
+    async def append(self, session_id: str, messages: Iterable[Dict[str, str]]):
+        """Appends messages ({'role', 'content'} dicts) to a session."""
+
+    @abstractmethod
+    async def recent(self, session_id: str, limit: int) -> List[Dict[str, str]]:
+        """Returns the last `limit` messages of a session as {'role', 'content'} dicts."""
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        """Removes a session and its history."""
+
+    async def repetition(self, session_id: str) -> RepetitionTracker:
+        """Repetition state over the session's recent assistant replies."""
+        # Fallback for backends without stored state: rebuild from history
+        return RepetitionTracker.from_responses(
+            m['content'] for m in await self.get_history(session_id) if m['role'] == 'assistant'
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    async def close(self):
+        pass
+
+    async def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        return await self.recent(session_id, self.max_messages)
+
+    async def merge_history(self, session_id: str, history: Iterable[Dict[str, str]]):
+        """Appends only the part of a caller-supplied history that the session doesn't already hold."""
+        incoming = [Message(m['role'], m['content']) for m in history]
+        if not incoming:
+            return
+        # Only the last len(incoming) stored messages can overlap the incoming history
+        stored = [Message(m['role'], m['content']) for m in await self.recent(session_id, len(incoming))]
+        fresh = new_messages(stored, incoming)
+        if fresh:
+            await self.append(session_id, [m.to_dict() for m in fresh])
+
+
+class MemorySessionStore(SessionBackend):
+    """
+    Bounded in-memory conversation history, local to this process.
+
+    - Each session keeps at most `max_messages` messages (oldest dropped first).
+    - Sessions idle for longer than `idle_ttl` seconds are evicted.
+    - When the total estimated size exceeds `max_bytes`, least recently used
+      sessions are evicted until it fits again.
+    - History resent by the caller is deduplicated against what is stored.
+    """
+
+    def __init__(self, max_messages: int = SESSION_MAX_MESSAGES, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_bytes: int = SESSION_MAX_BYTES):
+        super().__init__(max_messages, idle_ttl)
+        self.max_bytes = max_bytes
+        # Ordered from least to most recently used
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.total_bytes = 0
+        self.total_messages = 0
+        self.evictions = 0
+
+    def _touch(self, session_id: str) -> Session:
+        self.evict_expired()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = Session()
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_access = time.monotonic()
+        return session
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self.total_bytes -= session.size
+        self.total_messages -= len(session.messages)
+
+    def evict_expired(self):
+        """Evicts idle sessions. They sit at the front of the LRU order, so this is O(evicted)."""
+        deadline = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > deadline:
+                break
+            self._drop(session_id)
+            self.evictions += 1
+
+    async def append(self, session_id: str, messages: Iterable[Dict[str, str]]):
+        self._append(session_id, self._touch(session_id), [Message(m['role'], m['content']) for m in messages])
+
+    async def merge_history(self, session_id: str, history: Iterable[Dict[str, str]]):
+        # Compares against the stored records directly instead of reading them back as dicts
+        session = self._touch(session_id)
+        incoming = [Message(m['role'], m['content']) for m in history]
+        self._append(session_id, session, new_messages(session.messages, incoming))
+
+    def _append(self, session_id: str, session: Session, messages: Sequence[Message]):
+        if not messages:
+            return
+        for message in messages:
+            session.messages.append(message)
+            session.size += message.size
+            self.total_bytes += message.size
+            if message.role == 'assistant':
+                session.repetition.add(message.content)
+        self.total_messages += len(messages)
+        overflow = len(session.messages) - self.max_messages
+        if overflow > 0:
+            for message in session.messages[:overflow]:
+                session.size -= message.size
+                self.total_bytes -= message.size
+            del session.messages[:overflow]
+            self.total_messages -= overflow
+        # Enforce the global budget, never evicting the session being written
+        while self.total_bytes > self.max_bytes and len(self._sessions) > 1:
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == session_id:
+                break
+            self._drop(oldest_id)
+            self.evictions += 1
+
+    async def recent(self, session_id: str, limit: int) -> List[Dict[str, str]]:
+        session = self._sessions.get(session_id)
+        if session is None or limit <= 0:
+            return []
+        return [m.to_dict() for m in session.messages[-limit:]]
+
+    async def repetition(self, session_id: str) -> RepetitionTracker:
+        session = self._sessions.get(session_id)
+        return session.repetition if session is not None else RepetitionTracker()
+
+    async def delete(self, session_id: str):
+        if session_id in self._sessions:
+            self._drop(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'memory',
+            'live_sessions': len(self._sessions),
+            'messages': self.total_messages,
+            'bytes_in_use': self.total_bytes,
+            'evictions': self.evictions,
+        }
+
+
+class SQLiteSessionStore(SessionBackend):
+    """
+    Session history in an embedded SQLite database in WAL mode, so every
+    uvicorn worker on a host (or a shared volume) sees the same history.
+
+    Messages are append-only rows indexed by (session_id, id); reading the
+    last K messages is an index range scan of K rows. Repetition state is a
+    JSON row per session, updated in the same transaction as the append.
+
+    Queries run on a single background thread, so a busy database (writers
+    wait up to 5 s for the lock) never blocks the event loop, and access to
+    the connection is serialized.
+    """
+
+    # Idle sessions are purged once every this many appends
+    EVICT_EVERY = 200
+
+    def __init__(self, db_path: str = SESSION_DB_PATH, max_messages: int = SESSION_MAX_MESSAGES,
+                 idle_ttl: float = SESSION_IDLE_TTL):
+        super().__init__(max_messages, idle_ttl)
+        self.db = sqlite3.connect(db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS session_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_messages ON session_messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions (last_access);
+            CREATE TABLE IF NOT EXISTS session_repetition (
+                session_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+        """)
+        self._appends = 0
+        (self._live_sessions,) = self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-sqlite")
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def append(self, session_id: str, messages: Iterable[Dict[str, str]]):
+        rows = [(session_id, m['role'], m['content']) for m in messages]
+        if rows:
+            await self._run(self._append_rows, session_id, rows)
+
+    def _append_rows(self, session_id: str, rows: List[tuple]):
+        # One transaction for the whole batch, including trimming to the per-session cap
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany(
+                "INSERT INTO session_messages (session_id, role, content) VALUES (?, ?, ?)", rows
+            )
+            created = self.db.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, last_access) VALUES (?, ?)", (session_id, time.time())
+            ).rowcount
+            if not created:
+                self.db.execute(
+                    "UPDATE sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id)
+                )
+            self.db.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND id <= ("
+                "SELECT id FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_messages)
+            )
+            replies = [content for _, role, content in rows if role == 'assistant']
+            if replies:
+                tracker = self._load_repetition(session_id)
+                for reply in replies:
+                    tracker.add(reply)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO session_repetition (session_id, state) VALUES (?, ?)",
+                    (session_id, tracker.to_json())
+                )
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+        self._live_sessions += created
+        self._appends += 1
+        if self._appends % self.EVICT_EVERY == 0:
+            # The append is already committed, so a failed purge must not fail it
+            try:
+                self.evict_expired()
+            except sqlite3.Error as e:
+                logger.error(f"Evicting idle SQLite sessions failed: {e}")
+
+    async def recent(self, session_id: str, limit: int) -> List[Dict[str, str]]:
+        if limit <= 0:
+            return []
+        return await self._run(self._recent, session_id, limit)
+
+    def _recent(self, session_id: str, limit: int) -> List[Dict[str, str]]:
+        rows = self.db.execute(
+            "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit)
+        ).fetchall()
+        return [{'role': role, 'content': content} for role, content in reversed(rows)]
+
+    def _load_repetition(self, session_id: str) -> RepetitionTracker:
+        row = self.db.execute(
+            "SELECT state FROM session_repetition WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return RepetitionTracker.from_json(row[0] if row else None)
+
+    async def repetition(self, session_id: str) -> RepetitionTracker:
+        return await self._run(self._load_repetition, session_id)
+
+    async def delete(self, session_id: str):
+        await self._run(self._delete, session_id)
+
+    def _delete(self, session_id: str):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self.db.execute("DELETE FROM session_repetition WHERE session_id = ?", (session_id,))
+            deleted = self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+        self._live_sessions -= deleted
+
+    def evict_expired(self):
+        """Purges idle sessions; runs on the database thread, every EVICT_EVERY appends."""
+        deadline = time.time() - self.idle_ttl
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute(
+                "DELETE FROM session_messages WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE last_access < ?)", (deadline,)
+            )
+            self.db.execute(
+                "DELETE FROM session_repetition WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE last_access < ?)", (deadline,)
+            )
+            self.db.execute("DELETE FROM sessions WHERE last_access < ?", (deadline,))
+            # Re-counted here so sessions created or evicted by other workers show up too
+            (live_sessions,) = self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+        self._live_sessions = live_sessions
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'sqlite', 'live_sessions': self._live_sessions}
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+        self.db.close()
+
+
+class RedisSessionStore(SessionBackend):
+    """
+    Session history in Redis (or any server speaking its protocol), shared by
+    every worker and replica.
+
+    Each session is a list of JSON-encoded [role, content] pairs. A batch is
+    appended, trimmed to the cap and given a fresh idle TTL in one pipelined
+    round trip; a batch holding assistant replies first reads the repetition
+    state, so it takes two. The last K messages are read with a single LRANGE.
+    Repetition state lives next to the list as a JSON string with the same
+    idle TTL. Any redis.asyncio compatible client can be passed in, e.g.
+    fakeredis.aioredis for testing.
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL, key_prefix: str = SESSION_KEY_PREFIX,
+                 max_messages: int = SESSION_MAX_MESSAGES, idle_ttl: float = SESSION_IDLE_TTL):
+        super().__init__(max_messages, idle_ttl)
+        if client is None:
+            # Optional dependency, only needed when SESSION_BACKEND=redis
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(
+                url, socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_CONNECT_TIMEOUT
+            )
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+
+    def _repetition_key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}:repetition"
+
+    async def append(self, session_id: str, messages: Iterable[Dict[str, str]]):
+        messages = list(messages)
+        encoded = [json.dumps([m['role'], m['content']]) for m in messages]
+        if not encoded:
+            return
+        key = self._key(session_id)
+        repetition_key = self._repetition_key(session_id)
+        ttl = max(1, int(self.idle_ttl))
+        replies = [m['content'] for m in messages if m['role'] == 'assistant']
+        tracker = await self.repetition(session_id) if replies else None
+        pipe = self.client.pipeline(transaction=False)
+        pipe.rpush(key, *encoded)
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, ttl)
+        if tracker is not None:
+            for reply in replies:
+                tracker.add(reply)
+            pipe.set(repetition_key, tracker.to_json(), ex=ttl)
+        else:
+            pipe.expire(repetition_key, ttl)
+        await pipe.execute()
+
+    async def recent(self, session_id: str, limit: int) -> List[Dict[str, str]]:
+        if limit <= 0:
+            return []
+        items = await self.client.lrange(self._key(session_id), -limit, -1)
+        messages = []
+        for item in items:
+            role, content = json.loads(item)
+            messages.append({'role': role, 'content': content})
+        return messages
+
+    async def repetition(self, session_id: str) -> RepetitionTracker:
+        data = await self.client.get(self._repetition_key(session_id))
+        return RepetitionTracker.from_json(data.decode() if isinstance(data, bytes) else data)
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self._key(session_id), self._repetition_key(session_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'redis'}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_session_store(backend: Optional[str] = None) -> SessionBackend:
+    """Builds the session backend selected by SESSION_BACKEND."""
+    backend = (backend or SESSION_BACKEND).lower()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "redis":
+        return RedisSessionStore()
+    if backend != "memory":
+        logger.warning(f"Unknown SESSION_BACKEND '{backend}', using in-memory sessions.")
+    return MemorySessionStore()
@@ -0,0 +1,101 @@
+# startup.py
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import (
+    WARMUP_ENABLED, WARMUP_TIMEOUT, MODERATION_API_URL, SENTIMENT_API_URL, EMOTION_API_URL
+)
+from generation import GenerationRouter
+from models import warm_up_model
+from transport import get_transport
+
+logger = logging.getLogger(__name__)
+
+
+class StartupState:
+    """
+    Import, startup and warm-up timings, and whether the service is ready.
+
+    The service is ready once warm-up has finished, whether or not every
+    target answered: an upstream that is down at boot is handled by the
+    circuit breakers and fallbacks, and failing readiness would only keep a
+    healthy instance out of rotation.
+    """
+
+    def __init__(self, import_seconds: float):
+        self.import_seconds = import_seconds
+        self.startup_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.warmup: Dict[str, dict] = {}
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    def started(self, seconds: float):
+        self.startup_seconds = seconds
+        logger.info(f"Imported in {self.import_seconds * 1000:.0f} ms, started in {seconds * 1000:.0f} ms.")
+
+    def begin_warm_up(self, router: GenerationRouter, enabled: bool = WARMUP_ENABLED,
+                      timeout: float = WARMUP_TIMEOUT):
+        """Warms up in the background so the server accepts connections (and /ready) meanwhile."""
+        if not enabled:
+            self.ready = True
+            return
+        self._task = asyncio.ensure_future(self._warm_up(warm_up_targets(router), timeout))
+
+    async def _warm_up(self, targets: Dict[str, Callable[[], Awaitable]], timeout: float):
+        start = time.perf_counter()
+        tasks = {asyncio.ensure_future(_timed_ping(ping)): name for name, ping in targets.items()}
+        done, pending = await asyncio.wait(set(tasks), timeout=timeout) if tasks else (set(), set())
+        for task in pending:
+            task.cancel()
+        for task, name in tasks.items():
+            self.warmup[name] = task.result() if task in done else {'ok': False, 'ms': round(timeout * 1000, 1)}
+        self.warmup_seconds = time.perf_counter() - start
+        self.ready = True
+        failed = [name for name, result in self.warmup.items() if not result['ok']]
+        logger.info(
+            f"Warm-up finished in {self.warmup_seconds * 1000:.0f} ms"
+            + (f"; no answer from: {', '.join(failed)}." if failed else ".")
+        )
+
+    def report(self) -> dict:
+        def ms(seconds):
+            return round(seconds * 1000, 1) if seconds is not None else None
+        return {
+            'ready': self.ready,
+            'import_ms': ms(self.import_seconds),
+            'startup_ms': ms(self.startup_seconds),
+            'warmup_ms': ms(self.warmup_seconds),
+            'warmup': self.warmup,
+        }
+
+    async def aclose(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def warm_up_targets(router: GenerationRouter) -> Dict[str, Callable[[], Awaitable]]:
+    """One ping per model endpoint and per generation provider, by name."""
+    targets: Dict[str, Callable[[], Awaitable]] = {}
+    for url in (MODERATION_API_URL, SENTIMENT_API_URL, EMOTION_API_URL):
+        targets[get_transport().endpoint_label(url)] = lambda url=url: warm_up_model(url)
+    for provider in router.providers:
+        targets[provider.name] = provider.warm_up
+    return targets
+
+
+async def _timed_ping(ping: Callable[[], Awaitable]) -> dict:
+    start = time.perf_counter()
+    try:
+        # Model pings report failure as False; provider pings raise
+        ok = (await ping()) is not False
+    except Exception as e:
+        logger.warning(f"Warm-up ping failed: {e!r}")
+        ok = False
+    return {'ok': ok, 'ms': round((time.perf_counter() - start) * 1000, 1)}
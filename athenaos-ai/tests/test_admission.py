@@ -0,0 +1,243 @@
+# tests/test_admission.py
+import gc
+import time
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import (
+    CLIENT_CLOSED_REQUEST, AdmissionController, iterate_with_deadline, request_deadline, run_until_disconnect
+)
+from config import DEADLINE_HEADER
+
+
+async def settle():
+    """Lets every runnable task take its next step."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_request_deadline_reads_the_budget_header():
+    before = time.monotonic()
+    deadline = request_deadline({DEADLINE_HEADER: "1500"})
+    assert before + 1.5 <= deadline <= time.monotonic() + 1.5
+    assert request_deadline({DEADLINE_HEADER: "0"}) is None
+    # An unparseable header falls back to the default budget
+    assert request_deadline({DEADLINE_HEADER: "soon"}) == pytest.approx(request_deadline({}), abs=0.1)
+
+
+def test_second_request_for_a_busy_session_is_rejected():
+    async def run():
+        controller = AdmissionController(max_in_flight=4)
+        ticket = await controller.acquire("s")
+        with pytest.raises(HTTPException) as busy:
+            await controller.acquire("s")
+        await controller.acquire("t")
+        ticket.release()
+        # The session is free again once its reply finishes
+        await controller.acquire("s")
+        return busy.value, controller.stats()
+
+    busy, stats = asyncio.run(run())
+    assert busy.status_code == 429 and "Retry-After" in busy.headers
+    assert stats['in_flight'] == 2 and stats['active_sessions'] == 2
+
+
+def test_requests_are_shed_when_the_queue_is_full():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_queue=0)
+        await controller.acquire("s")
+        with pytest.raises(HTTPException) as shed:
+            await controller.acquire("t")
+        return shed.value, controller
+
+    shed, controller = asyncio.run(run())
+    assert shed.status_code == 503 and int(shed.headers["Retry-After"]) >= 1
+    # The rejected request gave back its session
+    assert controller.active_sessions == {"s"} and controller.queued == 0
+
+
+def test_requests_are_shed_when_the_expected_wait_exceeds_their_deadline():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, queue_target=60)
+        controller.service_time = 5.0
+        await controller.acquire()
+        with pytest.raises(HTTPException) as shed:
+            await controller.acquire(deadline=time.monotonic() + 1.0)
+        return shed.value, controller.queued
+
+    shed, queued = asyncio.run(run())
+    assert shed.status_code == 503 and int(shed.headers["Retry-After"]) == 5
+    assert queued == 0
+
+
+def test_released_slots_are_handed_to_waiters_in_order():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, queue_target=10)
+        controller.service_time = 0.01
+        order = []
+
+        async def request(name):
+            async with controller.admit() as ticket:
+                order.append(name)
+                await asyncio.sleep(0)
+            return ticket
+
+        first = await controller.acquire()
+        tasks = [asyncio.ensure_future(request(name)) for name in ("a", "b", "c")]
+        await settle()
+        queued = controller.queued
+        first.release()
+        await asyncio.gather(*tasks)
+        return order, queued, controller.stats()
+
+    order, queued, stats = asyncio.run(run())
+    assert order == ["a", "b", "c"] and queued == 3
+    assert stats['in_flight'] == 0 and stats['queued'] == 0
+
+
+def test_waiter_times_out_in_the_queue():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, queue_target=0.05)
+        controller.service_time = 0.01
+        ticket = await controller.acquire()
+        with pytest.raises(HTTPException) as timed_out:
+            await controller.acquire("s")
+        ticket.release()
+        return timed_out.value, controller.stats()
+
+    timed_out, stats = asyncio.run(run())
+    assert timed_out.status_code == 503
+    assert stats['in_flight'] == 0 and stats['queued'] == 0 and stats['active_sessions'] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, queue_target=10)
+        controller.service_time = 0.01
+        ticket = await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire("s"))
+        await settle()
+        waiter.cancel()
+        await settle()
+        queued = controller.queued
+        ticket.release()
+        return waiter.cancelled(), queued, controller.stats()
+
+    cancelled, queued, stats = asyncio.run(run())
+    assert cancelled and queued == 0
+    assert stats['in_flight'] == 0 and stats['active_sessions'] == 0
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, queue_target=10)
+        controller.service_time = 0.01
+        ticket = await controller.acquire()
+        first = asyncio.ensure_future(controller.acquire())
+        second = asyncio.ensure_future(controller.acquire())
+        await settle()
+        # The slot goes to `first`, which is cancelled before it can resume
+        ticket.release()
+        first.cancel()
+        await settle()
+        if not first.cancelled():
+            # Python < 3.12 lets the hand-off win over the late cancel; the caller then owns the slot
+            (await first).release()
+        admitted = await asyncio.wait_for(second, timeout=1)
+        in_flight = controller.in_flight
+        admitted.release()
+        return in_flight, controller.stats()
+
+    in_flight, stats = asyncio.run(run())
+    assert in_flight == 1
+    assert stats['in_flight'] == 0 and stats['queued'] == 0
+
+
+def test_ticket_is_released_once():
+    async def run():
+        controller = AdmissionController(max_in_flight=2)
+        ticket = await controller.acquire("s")
+        await controller.acquire()
+        ticket.release()
+        ticket.release()
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats['in_flight'] == 1 and stats['active_sessions'] == 0
+
+
+def test_guarded_stream_releases_its_ticket():
+    async def body():
+        yield "a"
+        yield "b"
+
+    async def run():
+        controller = AdmissionController(max_in_flight=2)
+        streamed = await controller.acquire("s")
+        chunks = [chunk async for chunk in streamed.guard(body())]
+        # A stream that never starts (the client left first) releases on collection
+        dropped = await controller.acquire("t")
+        dropped.guard(body())
+        gc.collect()
+        return chunks, controller.stats()
+
+    chunks, stats = asyncio.run(run())
+    assert chunks == ["a", "b"]
+    assert stats['in_flight'] == 0 and stats['active_sessions'] == 0
+
+
+class FakeRequest:
+    """Only what run_until_disconnect reads: the ASGI receive channel."""
+
+    def __init__(self, disconnect_after=None):
+        self.disconnect_after = disconnect_after
+
+    async def receive(self):
+        if self.disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.disconnect_after)
+        return {"type": "http.disconnect"}
+
+
+def test_run_until_disconnect_returns_the_result():
+    async def work():
+        return "done"
+
+    assert asyncio.run(run_until_disconnect(FakeRequest(), work(), timeout=1.0)) == "done"
+
+
+@pytest.mark.parametrize("request_, timeout, status_code", [
+    (FakeRequest(disconnect_after=0.01), None, CLIENT_CLOSED_REQUEST),
+    (FakeRequest(), 0.01, 504),
+])
+def test_run_until_disconnect_cancels_abandoned_work(request_, timeout, status_code):
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run_until_disconnect(request_, work(), timeout=timeout))
+    assert error.value.status_code == status_code and cancelled == [True]
+
+
+def test_iterate_with_deadline_times_out_a_stalled_stream():
+    async def stalls():
+        yield "first"
+        await asyncio.sleep(10)
+        yield "never"
+
+    async def run():
+        received = []
+        with pytest.raises(asyncio.TimeoutError):
+            async for item in iterate_with_deadline(stalls(), time.monotonic() + 0.05):
+                received.append(item)
+        return received
+
+    assert asyncio.run(run()) == ["first"]
@@ -0,0 +1,107 @@
+# tests/test_batching.py
+import asyncio
+import json
+
+import httpx
+
+import models
+from batching import MicroBatcher
+from transport import InferenceTransport
+
+URL = "https://upstream.test/models/emotion"
+
+TEXTS = [f"message {i % 7} {'sad' if i % 3 else 'fine'}" for i in range(20)]
+
+
+def classify(text):
+    """Deterministic stand-in for a model: scores depend only on the text."""
+    score = (sum(map(ord, text)) % 100) / 100
+    return [{"label": "sadness", "score": score}, {"label": "joy", "score": round(1 - score, 2)}]
+
+
+class FakeModel:
+    def __init__(self):
+        self.batches = []
+
+    async def send_batch(self, api_url, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(0)
+        return [[classify(text)] for text in texts]
+
+
+async def submit_all(batcher, texts):
+    return await asyncio.gather(*(batcher.submit(text) for text in texts))
+
+
+def test_batched_results_match_single_calls_in_order():
+    async def run():
+        single_model, batched_model = FakeModel(), FakeModel()
+        single = await submit_all(MicroBatcher(URL, single_model.send_batch, max_batch_size=1), TEXTS)
+        batcher = MicroBatcher(URL, batched_model.send_batch, max_batch_size=8, max_wait=0.01)
+        batched = await submit_all(batcher, TEXTS)
+        return single, batched, single_model, batched_model
+
+    single, batched, single_model, batched_model = asyncio.run(run())
+    assert single == [[classify(text)] for text in TEXTS]
+    assert batched == single
+    assert all(len(batch) == 1 for batch in single_model.batches)
+    assert len(batched_model.batches) == 3
+    assert all(len(batch) <= 8 for batch in batched_model.batches)
+
+
+def test_duplicate_texts_are_sent_once():
+    async def run():
+        model = FakeModel()
+        results = await submit_all(MicroBatcher(URL, model.send_batch, max_batch_size=10, max_wait=0.01),
+                                   ["a", "b", "a", "a"])
+        return model, results
+
+    model, results = asyncio.run(run())
+    assert model.batches == [["a", "b"]]
+    assert results == [[classify("a")], [classify("b")], [classify("a")], [classify("a")]]
+
+
+def test_failed_batch_returns_none_to_every_caller():
+    async def failing(api_url, texts):
+        raise RuntimeError("boom")
+
+    results = asyncio.run(submit_all(MicroBatcher(URL, failing, max_batch_size=4, max_wait=0.01), TEXTS[:3]))
+    assert results == [None, None, None]
+
+
+def use_transport(monkeypatch, handler):
+    transport = InferenceTransport(api_key=None, max_retries=0)
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(models, "get_transport", lambda: transport)
+    return transport
+
+
+def hf_handler(request):
+    inputs = json.loads(request.content)["inputs"]
+    if isinstance(inputs, list):
+        return httpx.Response(200, json=[classify(text) for text in inputs])
+    return httpx.Response(200, json=[classify(inputs)])
+
+
+def test_post_batch_matches_single_requests(monkeypatch):
+    transport = use_transport(monkeypatch, hf_handler)
+
+    async def run():
+        batched = await models.post_batch(URL, TEXTS[:5])
+        single = [(await models.post_batch(URL, [text]))[0] for text in TEXTS[:5]]
+        await transport.aclose()
+        return batched, single
+
+    batched, single = asyncio.run(run())
+    assert batched == single == [[classify(text)] for text in TEXTS[:5]]
+
+
+def test_post_batch_rejects_mismatched_response(monkeypatch):
+    transport = use_transport(monkeypatch, lambda request: httpx.Response(200, json=[classify("x")]))
+
+    async def run():
+        result = await models.post_batch(URL, ["x", "y"])
+        await transport.aclose()
+        return result
+
+    assert asyncio.run(run()) == [None, None]
@@ -0,0 +1,84 @@
+# tests/test_bulk.py
+import io
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import models
+from bulk import BulkInputError, iter_json_items, spool_request_body
+from transport import CircuitBreaker, InferenceTransport
+
+URL = "https://upstream.test/models/sentiment"
+
+
+def make_request(chunks, content_length=None):
+    headers = [(b"content-length", str(content_length).encode())] if content_length is not None else []
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    return Request({"type": "http", "method": "POST", "path": "/analyze", "headers": headers}, receive)
+
+
+def spool(chunks, max_bytes, content_length=None):
+    async def run():
+        body = await spool_request_body(make_request(chunks, content_length), max_bytes=max_bytes)
+        try:
+            return body.read()
+        finally:
+            body.close()
+    return asyncio.run(run())
+
+
+def test_body_within_limit_is_spooled():
+    assert spool([b'["a", ', b'"b"]'], max_bytes=10) == b'["a", "b"]'
+
+
+def test_oversized_body_without_content_length_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        spool([b"x" * 6, b"x" * 6], max_bytes=10)
+    assert error.value.status_code == 413
+
+
+def test_oversized_content_length_is_rejected_before_reading():
+    with pytest.raises(HTTPException) as error:
+        spool([], max_bytes=10, content_length=11)
+    assert error.value.status_code == 413
+
+
+def test_json_array_and_ndjson_items():
+    assert list(iter_json_items(io.BytesIO(b' ["a", {"id": 1, "text": "b"}, 3] '))) == ["a", {"id": 1, "text": "b"}, 3]
+    assert list(iter_json_items(io.BytesIO(b'"a"\n{"text": "b"}\n'))) == ["a", {"text": "b"}]
+
+
+def test_items_before_malformed_input_are_yielded():
+    items = iter_json_items(io.BytesIO(b'"a"\n"b"\n{broken'))
+    assert next(items) == "a"
+    assert next(items) == "b"
+    with pytest.raises(BulkInputError):
+        next(items)
+
+
+def test_bulk_failures_do_not_open_live_circuits(monkeypatch):
+    live = InferenceTransport(api_key=None, max_retries=0)
+    bulk = InferenceTransport(api_key=None, max_retries=0)
+    bulk._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(503, json={})))
+    monkeypatch.setattr(models, "get_transport", lambda: live)
+    monkeypatch.setattr(models, "get_bulk_transport", lambda: bulk)
+    monkeypatch.setattr(models, "local_backend", None)
+    monkeypatch.setattr(models, "HUGGINGFACE_API_KEY", "test-key")
+
+    async def run():
+        for _ in range(bulk.breaker_for(URL).failure_threshold):
+            assert await models.query_huggingface_api_batch(URL, ["a", "b"]) == [None, None]
+        await bulk.aclose()
+
+    asyncio.run(run())
+    assert bulk.breaker_for(URL).state == CircuitBreaker.OPEN
+    assert live.breaker_for(URL).state == CircuitBreaker.CLOSED
+    assert live.breaker_for(URL).allow_request()
@@ -0,0 +1,66 @@
+# tests/test_cache.py
+import asyncio
+
+from cache import InferenceCache, make_cache_key
+
+RESULT = [[{"label": "positive", "score": 0.9}]]
+
+
+def test_key_ignores_case_and_whitespace():
+    assert make_cache_key("url", "I feel  fine\n") == make_cache_key("url", "i FEEL fine")
+    assert make_cache_key("url", "fine") != make_cache_key("other", "fine")
+
+
+def test_memory_tier_hit_miss_and_expiry():
+    async def run():
+        cache = InferenceCache(max_entries=2, ttl=60, db_path="")
+        assert await cache.get("a") is None
+        cache.set("a", RESULT)
+        assert await cache.get("a") == RESULT
+        cache.set("b", RESULT)
+        cache.set("c", RESULT)
+        # "a" was least recently used and is evicted
+        assert await cache.get("a") is None
+        cache.ttl = -1
+        cache.set("d", RESULT)
+        assert await cache.get("d") is None
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats['hits'] == 1 and stats['misses'] == 3
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+
+    async def run():
+        writer = InferenceCache(ttl=60, db_path=db_path)
+        writer.set("key", RESULT)
+        # Waits for the write-behind to reach the database
+        writer.close()
+
+        reader = InferenceCache(ttl=60, db_path=db_path)
+        value = await reader.get("key")
+        missing = await reader.get("other")
+        stats = reader.stats()
+        reader.close()
+        return value, missing, stats
+
+    value, missing, stats = asyncio.run(run())
+    assert value == RESULT
+    assert missing is None
+    assert stats['disk_hits'] == 1 and stats['misses'] == 1
+
+
+def test_clear_empties_both_tiers(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+
+    async def run():
+        cache = InferenceCache(ttl=60, db_path=db_path)
+        cache.set("key", RESULT)
+        cache.clear()
+        value = await cache.get("key")
+        cache.close()
+        return value
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,69 @@
+# tests/test_generation.py
+import asyncio
+
+import pytest
+
+from generation import GenerationRouter, GenerationUnavailable, Provider
+
+
+class FakeProvider(Provider):
+    def __init__(self, name, tokens=("Hello", " there"), delay=0.0, error=None):
+        super().__init__(name, "test-model", max_concurrency=4)
+        self.tokens = tokens
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def stream(self, messages, **params):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        for token in self.tokens:
+            yield token
+
+
+def complete(router):
+    return asyncio.run(router.complete([{"role": "user", "content": "hi"}]))
+
+
+def test_provider_is_abstract():
+    with pytest.raises(TypeError):
+        Provider("bare", "test-model", max_concurrency=1)
+
+
+def test_first_provider_answers():
+    primary, fallback = FakeProvider("primary"), FakeProvider("fallback", tokens=("Other",))
+    assert complete(GenerationRouter([primary, fallback], hedge_enabled=False)) == "Hello there"
+    assert fallback.calls == 0
+
+
+def test_fails_over_on_error_before_first_token():
+    primary = FakeProvider("primary", error=RuntimeError("503"))
+    fallback = FakeProvider("fallback", tokens=("Fallback",))
+    assert complete(GenerationRouter([primary, fallback], hedge_enabled=False)) == "Fallback"
+    assert primary.error_ewma > 0
+
+
+def test_empty_stream_fails_over():
+    empty = FakeProvider("empty", tokens=())
+    fallback = FakeProvider("fallback", tokens=("Fallback",))
+    assert complete(GenerationRouter([empty, fallback], hedge_enabled=False)) == "Fallback"
+    assert empty.error_ewma > 0
+    assert not empty.samples
+
+
+def test_empty_hedge_does_not_win_the_race():
+    slow = FakeProvider("slow", tokens=("Slow", " reply"), delay=0.3)
+    # Recent fast first tokens put the hedge deadline at its minimum
+    slow.samples.extend([0.001] * 50)
+    empty = FakeProvider("empty", tokens=())
+    assert complete(GenerationRouter([slow, empty], hedge_enabled=True)) == "Slow reply"
+    assert empty.calls == 1
+
+
+def test_all_providers_failing_raises():
+    router = GenerationRouter([FakeProvider("a", tokens=()), FakeProvider("b", error=RuntimeError("down"))],
+                              hedge_enabled=False)
+    with pytest.raises(GenerationUnavailable):
+        complete(router)
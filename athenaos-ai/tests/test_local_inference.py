@@ -0,0 +1,172 @@
+# tests/test_local_inference.py
+import os
+import json
+import asyncio
+
+import pytest
+
+import cache
+import models
+import processing
+import local_inference
+from config import EMOTION_API_URL, MODERATION_API_URL, SENTIMENT_API_URL
+from local_inference import LocalInferenceBackend, OnnxClassifier, model_id_from_url
+
+# What each stub model answers, highest score first, as OnnxClassifier.classify does
+STUB_LABELS = {
+    "facebook/roberta-hate-speech-dynabench-r4-target": [("nothate", 0.9), ("hate", 0.1)],
+    "cardiffnlp/twitter-roberta-base-sentiment-latest": [("negative", 0.7), ("neutral", 0.2), ("positive", 0.1)],
+    "bhadresh-savani/distilbert-base-uncased-emotion": [("sadness", 0.6), ("fear", 0.3), ("joy", 0.1)],
+}
+
+
+class StubClassifier:
+    """Stands in for OnnxClassifier: fixed labels per model, records every batch."""
+
+    loaded = []
+
+    def __init__(self, model_dir):
+        self.model_id = os.path.relpath(model_dir, "model_store").replace(os.sep, "/")
+        self.batches = []
+        StubClassifier.loaded.append(self)
+
+    def classify(self, texts):
+        self.batches.append(list(texts))
+        return [[{'label': label, 'score': score} for label, score in STUB_LABELS[self.model_id]] for _ in texts]
+
+
+@pytest.fixture
+def stub_backend(monkeypatch):
+    StubClassifier.loaded = []
+    backend = LocalInferenceBackend(model_dir="model_store", max_workers=2, classifier_factory=StubClassifier)
+    monkeypatch.setattr(models, "local_backend", backend)
+    monkeypatch.setattr(models, "inference_cache", None)
+    monkeypatch.setattr(models, "_batchers", {})
+    yield backend
+    backend.shutdown()
+
+
+def test_model_id_from_url():
+    assert model_id_from_url(SENTIMENT_API_URL) == "cardiffnlp/twitter-roberta-base-sentiment-latest"
+    assert model_id_from_url("http://localhost:8000/models/org/name/") == "org/name"
+
+
+def test_backend_and_cache_are_built_at_startup_not_import(monkeypatch):
+    monkeypatch.setattr(local_inference, "INFERENCE_BACKEND", "local")
+    monkeypatch.setattr(cache, "INFERENCE_CACHE_ENABLED", True)
+    monkeypatch.setattr(models, "_batchers", {})
+    assert models.local_backend is None and models.inference_cache is None
+
+    models.init_inference()
+    try:
+        assert isinstance(models.local_backend, LocalInferenceBackend)
+        assert isinstance(models.inference_cache, cache.InferenceCache)
+        models.get_batcher(EMOTION_API_URL)
+    finally:
+        asyncio.run(models.close_inference())
+    assert models.local_backend is None and models.inference_cache is None
+    assert models._batchers == {}
+
+
+def test_classify_batch_shapes_results_like_the_api(stub_backend):
+    results = asyncio.run(stub_backend.classify_batch(SENTIMENT_API_URL, ["a", "b"]))
+    expected = [{'label': label, 'score': score} for label, score in STUB_LABELS[model_id_from_url(SENTIMENT_API_URL)]]
+    assert results == [[expected], [expected]]
+
+
+def test_models_are_loaded_once_per_endpoint(stub_backend):
+    async def run():
+        for _ in range(3):
+            await stub_backend.classify_batch(EMOTION_API_URL, ["a"])
+        await stub_backend.classify_batch(SENTIMENT_API_URL, ["a"])
+
+    asyncio.run(run())
+    assert [classifier.model_id for classifier in StubClassifier.loaded] == [
+        model_id_from_url(EMOTION_API_URL), model_id_from_url(SENTIMENT_API_URL)
+    ]
+
+
+def test_model_that_fails_to_load_returns_none():
+    def broken(model_dir):
+        raise FileNotFoundError(model_dir)
+
+    backend = LocalInferenceBackend(model_dir="model_store", max_workers=1, classifier_factory=broken)
+    try:
+        assert asyncio.run(backend.classify_batch(EMOTION_API_URL, ["a", "b"])) == [None, None]
+    finally:
+        backend.shutdown()
+
+
+def test_query_dispatches_to_local_backend_in_one_batch(stub_backend):
+    texts = ["first", "second", "third"]
+
+    async def run():
+        return await asyncio.gather(*(models.query_huggingface_api(EMOTION_API_URL, text) for text in texts))
+
+    results = asyncio.run(run())
+    classifier, = StubClassifier.loaded
+    assert classifier.batches == [texts]
+    assert results == asyncio.run(stub_backend.classify_batch(EMOTION_API_URL, texts))
+
+
+def test_local_results_parse_like_api_results(stub_backend):
+    async def run():
+        return await asyncio.gather(
+            processing.moderate_text("hello"),
+            processing.analyze_sentiment("hello"),
+            processing.analyze_emotions("hello"),
+        )
+
+    moderation, sentiment, emotions = asyncio.run(run())
+    assert moderation == {'is_harmful': False, 'score': 0.1}
+    assert sentiment == ('negative', 0.7)
+    assert [emotion['label'] for emotion in emotions] == ['sadness', 'fear']
+    assert {classifier.model_id for classifier in StubClassifier.loaded} == {
+        model_id_from_url(url) for url in (MODERATION_API_URL, SENTIMENT_API_URL, EMOTION_API_URL)
+    }
+
+
+def write_tiny_model(model_dir):
+    """A bag-of-words ONNX classifier over a three-word vocabulary, with its tokenizer and config."""
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    tokenizers = pytest.importorskip("tokenizers")
+    np = pytest.importorskip("numpy")
+    from onnx import TensorProto, helper, numpy_helper
+
+    vocab = {"[PAD]": 0, "[UNK]": 1, "happy": 2, "sad": 3, "angry": 4}
+    embeddings = np.zeros((len(vocab), 3), dtype=np.float32)
+    embeddings[vocab["happy"], 0] = embeddings[vocab["sad"], 1] = embeddings[vocab["angry"], 2] = 4.0
+    graph = helper.make_graph(
+        [
+            helper.make_node("Gather", ["embeddings", "input_ids"], ["tokens"]),
+            helper.make_node("ReduceSum", ["tokens"], ["logits"], axes=[1], keepdims=0),
+        ],
+        "tiny",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "sequence"]),
+        ],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", 3])],
+        [numpy_helper.from_array(embeddings, "embeddings")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 11)], ir_version=7)
+    onnx.save(model, os.path.join(model_dir, "model.onnx"))
+
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.save(os.path.join(model_dir, "tokenizer.json"))
+    with open(os.path.join(model_dir, "config.json"), "w") as f:
+        json.dump({"id2label": {"0": "joy", "1": "sadness", "2": "anger"}}, f)
+
+
+def test_onnx_classifier_maps_logits_to_labels(tmp_path):
+    write_tiny_model(str(tmp_path))
+    classifier = OnnxClassifier(str(tmp_path), max_length=16, intra_op_threads=1)
+    happy, sad, angry = classifier.classify(["happy", "so sad today", "angry angry sad"])
+
+    assert [item['label'] for item in happy] == ['joy', 'sadness', 'anger']
+    assert sad[0]['label'] == 'sadness'
+    assert [item['label'] for item in angry][:2] == ['anger', 'sadness']
+    for scores in (happy, sad, angry):
+        assert sum(item['score'] for item in scores) == pytest.approx(1.0)
+        assert scores == sorted(scores, key=lambda x: x['score'], reverse=True)
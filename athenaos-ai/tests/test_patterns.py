@@ -0,0 +1,97 @@
+# tests/test_patterns.py
+import re
+import random
+
+import pytest
+
+from config import CRISIS_PATTERNS, CONCERN_PATTERNS, CBT_PATTERNS
+from patterns import PatternEngine, without_capture_groups
+from processing import enhanced_crisis_detection, detect_cbt_patterns
+
+
+# The per-pattern implementations PatternEngine replaced, kept as the reference
+def reference_crisis_detection(text):
+    if not text:
+        return None
+    text_lower = text.lower()
+    for pattern in CRISIS_PATTERNS:
+        if re.search(pattern, text_lower):
+            return "crisis"
+    for pattern in CONCERN_PATTERNS:
+        if re.search(pattern, text_lower):
+            return "concern"
+    return None
+
+
+def reference_cbt_patterns(text):
+    if not text:
+        return []
+    text_lower = text.lower()
+    return [name for name, regex in CBT_PATTERNS.items() if re.search(regex, text_lower)]
+
+
+def reference_scan(categories, text):
+    text_lower = text.lower()
+    return [name for name, patterns in categories.items() if any(re.search(p, text_lower) for p in patterns)]
+
+
+FRAGMENTS = [
+    "I want to die", "I'm going to kill myself", "i can't take it like this anymore", "I am really thinking of suicide",
+    "planning to end my life", "I've taken pills to end my life", "I have a plan to kill myself",
+    "I've been feeling really depressed", "I often think about self-harm", "I'm struggling with suicidal thoughts",
+    "there's no reason to live", "I don't want to be here anymore", "I feel so hopeless", "i feel NUMB",
+    "everything is ruined", "it's a total disaster", "I'm a complete failure", "nothing works", "it's perfect",
+    "everyone hates me", "nobody cares", "every time I try", "no one ever listens", "it's my fault",
+    "I blame myself", "because of me", "I caused this", "I'm responsible",
+    "work was fine today", "I went for a walk", "thanks, that helped", "allowance", "nevertheless", "my faulty car",
+    "I wanted to diet", "want to die", "i feel hopelessness", "", "   ", "!!!", "I'M GOING TO KILL MYSELF",
+]
+
+
+def corpus(count=400, seed=7):
+    rng = random.Random(seed)
+    texts = list(FRAGMENTS)
+    for _ in range(count):
+        parts = rng.sample(FRAGMENTS, rng.randint(1, 4))
+        texts.append(rng.choice([". ", ", ", " and ", "\n"]).join(parts))
+    return texts
+
+
+@pytest.mark.parametrize("text", corpus())
+def test_urgency_and_cbt_patterns_match_reference(text):
+    assert enhanced_crisis_detection(text) == reference_crisis_detection(text)
+    assert detect_cbt_patterns(text) == reference_cbt_patterns(text)
+
+
+def test_engine_matches_reference_with_awkward_patterns():
+    categories = {
+        'repeat': [r"\b(\w+) \1\b"],
+        'named': [r"(?P<word>sad|blue)(?:ness)?\b", r"\bfeel(ing)? (down|low)\b"],
+        'classes': [r"[]x]+y", r"[^a-z ]{3,}", r"\(literal\)"],
+        'flagged': [r"(?i)^hello"],
+        'empty': [],
+        'alternation': [r"a|b\b", r"\bneither\b"],
+    }
+    engine = PatternEngine(categories)
+    texts = [
+        "the the cat", "sadness all around", "feeling low", "]]xy", "123 go", "(literal) text",
+        "Hello there", "say hello", "b", "neither", "nothing here", "", "SAD SAD day",
+    ] + corpus(100, seed=3)
+    for text in texts:
+        assert list(engine.scan(text)) == reference_scan(categories, text), text
+
+
+def test_scan_reports_every_match_with_its_pattern():
+    engine = PatternEngine({'cbt': [r"\balways\b", r"\bnever\b"], 'crisis': CRISIS_PATTERNS})
+    matches = engine.scan("I ALWAYS fail, never win, always.")
+    assert [(m.pattern, m.span) for m in matches['cbt']] == [
+        (r"\balways\b", (2, 8)), (r"\bnever\b", (15, 20)), (r"\balways\b", (26, 32))
+    ]
+    assert 'crisis' not in matches
+
+
+def test_without_capture_groups():
+    assert without_capture_groups(r"(a|b)(?:c)(?P<x>d)") == r"(?:a|b)(?:c)(?:d)"
+    assert without_capture_groups(r"\(x\)[(]") == r"\(x\)[(]"
+    assert without_capture_groups(r"[]()](e)") == r"[]()](?:e)"
+    assert without_capture_groups(r"(?=f)(?!g)(?<=h)") == r"(?=f)(?!g)(?<=h)"
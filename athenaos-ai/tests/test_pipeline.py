@@ -0,0 +1,134 @@
+# tests/test_pipeline.py
+import asyncio
+
+import pytest
+
+import processing
+from config import EMOTION_API_URL, MODERATION_API_URL, SENTIMENT_API_URL
+from metrics import FALLBACKS
+
+RESPONSES = {
+    MODERATION_API_URL: [[{"label": "nothate", "score": 0.95}, {"label": "hate", "score": 0.05}]],
+    SENTIMENT_API_URL: [[{"label": "negative", "score": 0.8}, {"label": "neutral", "score": 0.2}]],
+    EMOTION_API_URL: [[{"label": "sadness", "score": 0.7}, {"label": "fear", "score": 0.25}]],
+}
+
+CRISIS = "I want to kill myself"
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+
+    async def fake_query(api_url, text):
+        calls.append(api_url)
+        return RESPONSES[api_url]
+
+    monkeypatch.setattr(processing, "query_huggingface_api", fake_query)
+    return calls
+
+
+def test_crisis_skips_model_stages_without_a_background_consumer(model_calls):
+    async def run():
+        result = await processing.run_analysis_pipeline(CRISIS)
+        # Give a stray background task the chance to run
+        await asyncio.sleep(0.01)
+        return result
+
+    result = asyncio.run(run())
+    assert result.short_circuit == 'crisis'
+    assert result.background is None
+    assert model_calls == []
+    assert result.analysis['emotions'] == []
+
+
+def test_crisis_completes_analysis_in_background_when_asked(model_calls):
+    async def run():
+        result = await processing.run_analysis_pipeline(CRISIS, complete_in_background=True)
+        return result, await result.background
+
+    result, completed = asyncio.run(run())
+    assert result.short_circuit == 'crisis'
+    assert sorted(model_calls) == sorted([SENTIMENT_API_URL, EMOTION_API_URL])
+    assert completed['sentiment'] == 'crisis'
+    assert completed['sentiment_score'] == 0.8
+    assert [emotion['label'] for emotion in completed['emotions']] == ['sadness', 'fear']
+
+
+def test_regular_message_runs_every_model_stage(model_calls):
+    result = asyncio.run(processing.run_analysis_pipeline("work was long today", complete_in_background=True))
+    assert result.short_circuit is None
+    assert result.background is None
+    assert sorted(model_calls) == sorted(RESPONSES)
+    assert result.moderation == {'is_harmful': False, 'score': 0.05}
+    assert result.analysis['sentiment'] == 'negative'
+
+
+def test_partially_failed_chunks_count_as_a_fallback(monkeypatch):
+    async def flaky_query(api_url, text):
+        # The second chunk of every long text fails
+        return None if text.startswith("Second") else RESPONSES[api_url]
+
+    monkeypatch.setattr(processing, "query_huggingface_api", flaky_query)
+    monkeypatch.setattr(processing, "ANALYSIS_CHUNK_CHARS", 40)
+    text = "First part of a long journal entry. Second part that the model never labels."
+    before = {stage: FALLBACKS.value(stage=stage) for stage in ('moderation', 'sentiment', 'emotion')}
+
+    async def run():
+        return await asyncio.gather(
+            processing.classify_chunks(SENTIMENT_API_URL, text),
+            processing.analyze_sentiment(text),
+            processing.analyze_emotions(text),
+            processing.moderate_text(text),
+        )
+
+    chunks, sentiment, emotions, moderation = asyncio.run(run())
+    assert chunks == []
+    assert sentiment == ('unknown', 0.0)
+    assert emotions == []
+    assert moderation == {'is_harmful': False, 'score': 0.0}
+    for stage, count in before.items():
+        assert FALLBACKS.value(stage=stage) == count + 1
+
+
+def test_every_chunk_is_used_when_all_succeed(model_calls, monkeypatch):
+    monkeypatch.setattr(processing, "ANALYSIS_CHUNK_CHARS", 40)
+    text = "First part of a long journal entry. Second part, also labeled this time."
+    chunks = asyncio.run(processing.classify_chunks(SENTIMENT_API_URL, text))
+    assert [length for _, length in chunks] == [35, 36]
+    assert all(response == RESPONSES[SENTIMENT_API_URL] for response, _ in chunks)
+
+
+def test_malformed_sentiment_keeps_the_moderation_verdict(monkeypatch):
+    responses = {
+        MODERATION_API_URL: [[{"label": "hate", "score": 0.99}, {"label": "nothate", "score": 0.01}]],
+        # Flat instead of nested in a one-element list
+        SENTIMENT_API_URL: [{"label": "negative", "score": 0.9}],
+        EMOTION_API_URL: RESPONSES[EMOTION_API_URL],
+    }
+
+    async def fake_query(api_url, text):
+        return responses[api_url]
+
+    monkeypatch.setattr(processing, "query_huggingface_api", fake_query)
+    before = FALLBACKS.value(stage='sentiment')
+
+    result = asyncio.run(processing.run_analysis_pipeline("you people are all the same"))
+    assert result.moderation == {'is_harmful': True, 'score': 0.99}
+    assert result.analysis['sentiment'] == 'unknown'
+    assert [emotion['label'] for emotion in result.analysis['emotions']] == ['sadness', 'fear']
+    assert FALLBACKS.value(stage='sentiment') == before + 1
+
+
+def test_unexpected_stage_error_falls_back_without_losing_moderation(monkeypatch, model_calls):
+    async def broken(text):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(processing, "analyze_emotions", broken)
+    before = FALLBACKS.value(stage='emotion')
+
+    result = asyncio.run(processing.run_analysis_pipeline("work was long today"))
+    assert result.moderation == {'is_harmful': False, 'score': 0.05}
+    assert result.analysis['sentiment'] == 'negative'
+    assert result.analysis['emotions'] == []
+    assert FALLBACKS.value(stage='emotion') == before + 1
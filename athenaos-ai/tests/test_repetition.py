@@ -0,0 +1,86 @@
+# tests/test_repetition.py
+import random
+
+import pytest
+
+from config import ANTI_REPETITION_STARTERS, REPETITION_WINDOW
+from processing import analyze_conversation_patterns
+from repetition import RepetitionTracker
+
+
+def reference_conversation_patterns(history):
+    """The full-rescan implementation RepetitionTracker replaced (starter phrases only)."""
+    if not history:
+        return []
+    assistant_responses = [msg['content'] for msg in history if msg['role'] == 'assistant']
+    repetitive_phrases = []
+    for phrase in ANTI_REPETITION_STARTERS:
+        count = sum(1 for response in assistant_responses if phrase.lower() in response.lower())
+        if count > 1 and count > len(assistant_responses) * 0.3:
+            repetitive_phrases.append(phrase)
+    return repetitive_phrases
+
+
+FILLERS = [
+    "Let's look at that together.", "What would help most tonight?", "How did that feel?",
+    "Have you noticed when these thoughts show up?", "One small step could be a walk.",
+]
+
+
+def random_reply(rng):
+    parts = rng.sample(FILLERS, rng.randint(1, 2))
+    for _ in range(rng.randint(0, 2)):
+        phrase = rng.choice(ANTI_REPETITION_STARTERS)
+        phrase = rng.choice([phrase, phrase.upper(), phrase.lower()])
+        parts.insert(rng.randint(0, len(parts)), phrase + rng.choice([".", ",", "!"]))
+    return " ".join(parts)
+
+
+def random_history(rng, replies):
+    history = []
+    for i in range(replies):
+        history.append({'role': 'user', 'content': f"message {i}"})
+        history.append({'role': 'assistant', 'content': random_reply(rng)})
+    return history
+
+
+def starter_phrases(patterns):
+    return [pattern for pattern in patterns if pattern in ANTI_REPETITION_STARTERS]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_starter_phrases_match_full_rescan(seed):
+    rng = random.Random(seed)
+    history = random_history(rng, rng.randint(0, REPETITION_WINDOW))
+    expected = reference_conversation_patterns(history)
+    assert starter_phrases(analyze_conversation_patterns(history)) == expected
+
+    replies = [m['content'] for m in history if m['role'] == 'assistant']
+    assert starter_phrases(RepetitionTracker.from_responses(replies).repetitive_patterns()) == expected
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_long_sessions_match_rescan_of_the_window(seed):
+    rng = random.Random(1000 + seed)
+    history = random_history(rng, rng.randint(REPETITION_WINDOW + 1, 3 * REPETITION_WINDOW))
+    window = history[-2 * REPETITION_WINDOW:]
+    assert starter_phrases(analyze_conversation_patterns(history)) == reference_conversation_patterns(window)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_and_serialized_trackers_agree(seed):
+    rng = random.Random(5000 + seed)
+    replies = [random_reply(rng) for _ in range(rng.randint(1, 2 * REPETITION_WINDOW))]
+    tracker = RepetitionTracker()
+    for count, reply in enumerate(replies, 1):
+        tracker.add(reply)
+        rebuilt = RepetitionTracker.from_responses(replies[:count])
+        assert tracker.repetitive_patterns() == rebuilt.repetitive_patterns()
+    restored = RepetitionTracker.from_json(tracker.to_json())
+    assert restored.repetitive_patterns() == tracker.repetitive_patterns()
+    assert restored.phrase_counts == tracker.phrase_counts
+
+
+def test_recurring_openings_are_flagged():
+    replies = ["It sounds like work is hard.", "It sounds like you're tired.", "It sounds like a lot."]
+    assert RepetitionTracker.from_responses(replies).repetitive_patterns() == ["it sounds like"]
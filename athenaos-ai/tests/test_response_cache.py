@@ -0,0 +1,70 @@
+# tests/test_response_cache.py
+from response_cache import ResponseCache, cache_context
+
+ANALYSIS = {
+    'sentiment': 'neutral',
+    'emotions': [{'label': 'joy', 'score': 0.4}, {'label': 'neutral', 'score': 0.6}],
+    'cbt_analysis': {'patterns': ['overgeneralization']},
+    'urgency_level': None,
+}
+
+OPENER = "how do I stop overthinking"
+
+
+def filled_cache(text, replies, context=None):
+    cache = ResponseCache(max_variants=len(replies))
+    context = context or cache_context(ANALYSIS, [], text)
+    for reply in replies:
+        cache.add(text, context, reply)
+    return cache, context
+
+
+def test_context_partitions_by_analysis():
+    assert cache_context(ANALYSIS, [], OPENER) == ('neutral', 'neutral', ('overgeneralization',))
+
+
+def test_conversations_with_history_are_never_cached():
+    history = [{'role': 'user', 'content': 'my sister Anna moved away'},
+               {'role': 'assistant', 'content': 'Missing Anna sounds hard.'}]
+    assert cache_context(ANALYSIS, history, OPENER) is None
+    assert cache_context(ANALYSIS, history[:1], OPENER) is None
+
+
+def test_urgent_messages_are_never_cached():
+    assert cache_context({**ANALYSIS, 'urgency_level': 'concern'}, [], OPENER) is None
+
+
+def test_only_short_messages_are_cached():
+    # Similar enough to share an entry, yet they need very different replies
+    assert cache_context(ANALYSIS, [], "I lost my job today and my wife left me") is None
+    assert cache_context(ANALYSIS, [], OPENER, max_words=3) is None
+
+
+def test_entries_are_served_only_within_their_context():
+    cache, context = filled_cache(OPENER, ["Let's try noticing the thought first."])
+    assert cache.lookup(OPENER, context) == "Let's try noticing the thought first."
+    other = cache_context({**ANALYSIS, 'sentiment': 'negative'}, [], OPENER)
+    assert cache.lookup(OPENER, other) is None
+
+
+def test_variants_rotate():
+    replies = ["First reply.", "Second reply."]
+    cache, context = filled_cache(OPENER, replies)
+    assert [cache.lookup(OPENER, context) for _ in range(3)] == replies + replies[:1]
+
+
+def test_similar_message_is_not_served_a_reply_echoing_the_other_message():
+    cache, context = filled_cache("hi my name is Sarah", ["Hi Sarah, it's good to meet you.", "Welcome! What's on your mind?"])
+    # Similar enough to match, but only the reply that doesn't use the name may be served
+    assert cache.lookup("hi my name is Sara", context) == "Welcome! What's on your mind?"
+    assert cache.lookup("hi my name is Sara", context) == "Welcome! What's on your mind?"
+    assert cache.lookup("hi my name is Sarah", context) == "Hi Sarah, it's good to meet you."
+
+
+def test_replies_echoing_a_similar_message_are_not_recorded():
+    cache, context = filled_cache("hi my name is Sarah", ["Welcome! What's on your mind?"])
+    cache.max_variants = 2
+    cache.add("hi my name is Sara", context, "Hi Sara, nice to meet you.")
+    cache.add("hi my name is Sara", context, "Hello, good to meet you.")
+    assert cache.lookup("hi my name is Sarah", context) in {"Welcome! What's on your mind?", "Hello, good to meet you."}
+    assert cache.lookup("hi my name is Sarah", context) in {"Welcome! What's on your mind?", "Hello, good to meet you."}
@@ -0,0 +1,179 @@
+# tests/test_sessions.py
+import asyncio
+import inspect
+import sqlite3
+import threading
+
+import pytest
+
+from sessions import MemorySessionStore, RedisSessionStore, SessionBackend, SQLiteSessionStore
+
+BACKENDS = ["memory", "sqlite", "redis"]
+
+
+def make_store(backend, tmp_path, **kwargs):
+    if backend == "memory":
+        return MemorySessionStore(**kwargs)
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path=str(tmp_path / "sessions.db"), **kwargs)
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    return RedisSessionStore(client=aioredis.FakeRedis(), **kwargs)
+
+
+def run_with_store(backend, tmp_path, scenario, **kwargs):
+    async def run():
+        store = make_store(backend, tmp_path, **kwargs)
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+    return asyncio.run(run())
+
+
+def turn(i):
+    return [{'role': 'user', 'content': f"question {i}"}, {'role': 'assistant', 'content': f"answer {i}"}]
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        SessionBackend()
+    for name in ("append", "recent", "delete", "get_history", "merge_history", "repetition", "close"):
+        assert inspect.iscoroutinefunction(getattr(SessionBackend, name)), name
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_append_and_recent(backend, tmp_path):
+    async def scenario(store):
+        await store.append("s1", turn(1))
+        await store.append("s1", turn(2))
+        await store.append("s2", turn(9))
+        return await store.recent("s1", 3), await store.get_history("s2"), await store.recent("missing", 5)
+
+    last_three, other, missing = run_with_store(backend, tmp_path, scenario)
+    assert last_three == turn(1)[1:] + turn(2)
+    assert other == turn(9)
+    assert missing == []
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_history_is_capped(backend, tmp_path):
+    async def scenario(store):
+        for i in range(5):
+            await store.append("s", turn(i))
+        return await store.get_history("s")
+
+    assert run_with_store(backend, tmp_path, scenario, max_messages=4) == turn(3) + turn(4)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_merge_history_skips_what_is_stored(backend, tmp_path):
+    async def scenario(store):
+        await store.merge_history("s", turn(1))
+        # Callers resend their recent history with every request
+        await store.merge_history("s", turn(1) + turn(2))
+        await store.merge_history("s", turn(2))
+        return await store.get_history("s")
+
+    assert run_with_store(backend, tmp_path, scenario) == turn(1) + turn(2)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_repetition_tracks_assistant_replies(backend, tmp_path):
+    reply = "I'm here for you. That sounds really hard."
+
+    async def scenario(store):
+        for i in range(3):
+            await store.append("s", [{'role': 'user', 'content': f"q{i}"}, {'role': 'assistant', 'content': reply}])
+        return (await store.repetition("s")).repetitive_patterns(), (await store.repetition("new")).repetitive_patterns()
+
+    repeated, fresh = run_with_store(backend, tmp_path, scenario)
+    assert "I'm here for you" in repeated
+    assert fresh == []
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_delete(backend, tmp_path):
+    async def scenario(store):
+        await store.append("s", turn(1))
+        await store.delete("s")
+        return await store.get_history("s"), (await store.repetition("s")).repetitive_patterns()
+
+    assert run_with_store(backend, tmp_path, scenario) == ([], [])
+
+
+def test_sqlite_history_is_shared_between_stores(tmp_path):
+    async def run():
+        first = make_store("sqlite", tmp_path)
+        second = make_store("sqlite", tmp_path)
+        await first.append("s", turn(1))
+        history = await second.get_history("s")
+        await first.close()
+        await second.close()
+        return history, second.stats()
+
+    history, stats = asyncio.run(run())
+    assert history == turn(1)
+    # The second store counts the session once it re-syncs (on open or eviction)
+    assert stats == {'backend': 'sqlite', 'live_sessions': 0}
+
+
+def test_sqlite_stats_and_eviction(tmp_path):
+    async def scenario(store):
+        await store.append("a", turn(1))
+        await store.append("a", turn(2))
+        await store.append("b", turn(1))
+        counted = store.stats()['live_sessions']
+        await store.delete("a")
+        after_delete = store.stats()['live_sessions']
+        store.idle_ttl = -1
+        await store._run(store.evict_expired)
+        return counted, after_delete, store.stats()['live_sessions'], await store.get_history("b")
+
+    assert run_with_store("sqlite", tmp_path, scenario) == (2, 1, 0, [])
+
+
+def test_sqlite_failures_roll_back_and_keep_the_store_usable(tmp_path):
+    question = [{'role': 'user', 'content': "question"}]
+
+    async def scenario(store):
+        store.EVICT_EVERY = 1
+        store.idle_ttl = -1
+        # Breaks eviction and deletion, but not appends without assistant replies
+        store.db.execute("DROP TABLE session_repetition")
+        await store.append("a", question)
+        with pytest.raises(sqlite3.OperationalError):
+            await store.delete("a")
+        await store.append("b", question)
+        return store.db.in_transaction, await store.get_history("a"), await store.get_history("b")
+
+    assert run_with_store("sqlite", tmp_path, scenario) == (False, question, question)
+
+
+def test_sqlite_work_runs_off_the_event_loop(tmp_path):
+    async def scenario(store):
+        loop_thread = threading.get_ident()
+        threads = []
+        original = store._recent
+
+        def recording(*args):
+            threads.append(threading.get_ident())
+            return original(*args)
+
+        store._recent = recording
+        await store.recent("s", 5)
+        return loop_thread, threads
+
+    loop_thread, threads = run_with_store("sqlite", tmp_path, scenario)
+    assert threads and threads[0] != loop_thread
+
+
+def test_memory_store_evicts_idle_sessions():
+    async def run():
+        store = MemorySessionStore(idle_ttl=-1)
+        await store.append("old", turn(1))
+        await store.append("new", turn(1))
+        return await store.get_history("old"), store.stats()
+
+    history, stats = asyncio.run(run())
+    assert history == []
+    assert stats['evictions'] >= 1
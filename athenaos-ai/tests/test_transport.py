@@ -0,0 +1,79 @@
+# tests/test_transport.py
+import asyncio
+
+import httpx
+
+from transport import CircuitBreaker, InferenceTransport
+
+URL = "https://upstream.test/models/example"
+
+
+def open_breaker(transport: InferenceTransport) -> CircuitBreaker:
+    breaker = transport.breaker_for(URL)
+    breaker.reset_timeout = 0.0
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def make_transport(handler) -> InferenceTransport:
+    transport = InferenceTransport(api_key=None, max_retries=0)
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return transport
+
+
+def test_half_open_probe_success_closes_circuit():
+    async def run():
+        transport = make_transport(lambda request: httpx.Response(200, json=[[{"label": "ok", "score": 1.0}]]))
+        breaker = open_breaker(transport)
+        result = await transport.post_json(URL, {"inputs": "hi"})
+        await transport.aclose()
+        return breaker, result
+
+    breaker, result = asyncio.run(run())
+    assert result == [[{"label": "ok", "score": 1.0}]]
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_half_open_probe_releases_the_probe():
+    async def slow(request):
+        await asyncio.sleep(10)
+        return httpx.Response(200, json=[])
+
+    async def run():
+        transport = make_transport(slow)
+        breaker = open_breaker(transport)
+        probe = asyncio.ensure_future(transport.post_json(URL, {"inputs": "hi"}))
+        await asyncio.sleep(0.01)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        # A second caller is held back while the probe is in flight
+        assert await transport.post_json(URL, {"inputs": "hi"}) is None
+
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+        await transport.aclose()
+        return breaker
+
+    breaker = asyncio.run(run())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_failed_half_open_probe_reopens_circuit():
+    async def run():
+        transport = make_transport(lambda request: httpx.Response(503, json={}))
+        breaker = open_breaker(transport)
+        breaker.reset_timeout = 60.0
+        breaker.opened_at = 0.0
+        result = await transport.post_json(URL, {"inputs": "hi"})
+        await transport.aclose()
+        return breaker, result
+
+    breaker, result = asyncio.run(run())
+    assert result is None
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
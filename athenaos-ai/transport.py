@@ -0,0 +1,247 @@
+# transport.py
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import httpx
+
+from config import (
+    HUGGINGFACE_API_KEY,
+    MODERATION_API_URL, SENTIMENT_API_URL, EMOTION_API_URL,
+    HF_CONNECT_TIMEOUT, HF_READ_TIMEOUT, HF_MAX_RETRIES, HF_BACKOFF_BASE, HF_BACKOFF_MAX,
+    HF_MAX_CONNECTIONS, HF_MAX_KEEPALIVE_CONNECTIONS, HF_KEEPALIVE_EXPIRY,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+
+from metrics import UPSTREAM_ERRORS, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional 'h2' package; fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Status codes worth retrying: rate limiting and transient server-side errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    CLOSED: requests flow normally. After `failure_threshold` consecutive
+    failures the circuit OPENS and requests are rejected immediately. Once
+    `reset_timeout` seconds have passed it goes HALF_OPEN and lets a single
+    probe through: success closes it again, failure re-opens it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        # HALF_OPEN: only one probe request at a time
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed again.")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Frees the half-open probe slot of a call that ended without an outcome (e.g. cancelled)."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures."
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class InferenceTransport:
+    """
+    Owns the pooled, keep-alive HTTP client used for every Hugging Face Inference
+    API call, plus the retry policy and one circuit breaker per model endpoint.
+    """
+
+    def __init__(self, api_key: Optional[str] = HUGGINGFACE_API_KEY,
+                 connect_timeout: float = HF_CONNECT_TIMEOUT, read_timeout: float = HF_READ_TIMEOUT,
+                 max_retries: int = HF_MAX_RETRIES, backoff_base: float = HF_BACKOFF_BASE,
+                 backoff_max: float = HF_BACKOFF_MAX):
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breakers: Dict[str, CircuitBreaker] = {
+            url: CircuitBreaker(url) for url in (MODERATION_API_URL, SENTIMENT_API_URL, EMOTION_API_URL)
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so that it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=HF_MAX_CONNECTIONS,
+                    max_keepalive_connections=HF_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HF_KEEPALIVE_EXPIRY,
+                ),
+                headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else None,
+            )
+        return self._client
+
+    @staticmethod
+    def endpoint_label(url: str) -> str:
+        """Short metric label for an endpoint, e.g. 'twitter-roberta-base-sentiment-latest'."""
+        return url.rstrip("/").rsplit("/", 1)[-1]
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        if url not in self.breakers:
+            self.breakers[url] = CircuitBreaker(url)
+        return self.breakers[url]
+
+    def _backoff_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Full-jitter exponential backoff, honouring HF's `estimated_time` on 503s."""
+        if response is not None and response.status_code == 503:
+            try:
+                estimated_time = float(response.json().get("estimated_time", 0))
+            except (ValueError, AttributeError):
+                estimated_time = 0
+            if estimated_time > 0:
+                return min(estimated_time, self.backoff_max) + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def post_json(self, url: str, payload: dict):
+        """
+        POSTs a JSON payload to a model endpoint with retries.
+
+        Returns:
+            The decoded JSON response, or None if the call failed or the
+            endpoint's circuit is open (callers then use their fallback values).
+        """
+        breaker = self.breaker_for(url)
+        endpoint = self.endpoint_label(url)
+        if not breaker.allow_request():
+            logger.warning(f"Circuit open for {url}; skipping request.")
+            UPSTREAM_ERRORS.inc(endpoint=endpoint, reason="circuit_open")
+            return None
+
+        try:
+            return await self._post_with_retries(url, payload, breaker, endpoint)
+        except BaseException:
+            # Cancelled (deadline, hedge, client gone) or an unexpected error: no
+            # verdict on the endpoint, but a half-open probe must not stay in flight
+            breaker.release_probe()
+            raise
+
+    async def _post_with_retries(self, url: str, payload: dict, breaker: CircuitBreaker, endpoint: str):
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self.client.post(url, json=payload)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                    result = response.json()
+                    breaker.record_success()
+                    return result
+                error = f"HTTP {response.status_code}"
+                reason = f"http_{response.status_code}"
+            except httpx.HTTPStatusError as e:
+                # Client errors (bad input, auth) are not retried and say nothing
+                # about the endpoint's health
+                logger.error(f"API request to {url} failed: {e}")
+                UPSTREAM_ERRORS.inc(endpoint=endpoint, reason=f"http_{e.response.status_code}")
+                breaker.record_success()
+                return None
+            except httpx.TimeoutException as e:
+                error, reason = repr(e), "timeout"
+            except httpx.TransportError as e:
+                error, reason = repr(e), "transport"
+            except ValueError as e:
+                error, reason = repr(e), "invalid_json"
+
+            if attempt < self.max_retries:
+                UPSTREAM_RETRIES.inc(endpoint=endpoint)
+                delay = self._backoff_delay(attempt, response)
+                logger.warning(f"API request to {url} failed ({error}); retrying in {delay:.2f}s.")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"API request to {url} failed after {attempt + 1} attempts: {error}")
+
+        UPSTREAM_ERRORS.inc(endpoint=endpoint, reason=reason)
+        breaker.record_failure()
+        return None
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_transport: Optional[InferenceTransport] = None
+_bulk_transport: Optional[InferenceTransport] = None
+
+
+def get_transport() -> InferenceTransport:
+    """Returns the process-wide inference transport, creating it on first use."""
+    global _transport
+    if _transport is None:
+        _transport = InferenceTransport()
+    return _transport
+
+
+def get_bulk_transport() -> InferenceTransport:
+    """
+    Transport for bulk /analyze jobs, with its own connection pool and
+    circuit breakers, so failures during a backfill don't open the circuits
+    live chat traffic goes through (and the other way round).
+    """
+    global _bulk_transport
+    if _bulk_transport is None:
+        _bulk_transport = InferenceTransport()
+    return _bulk_transport
+
+
+async def close_transport():
+    """Closes the process-wide transports' connection pools."""
+    global _transport, _bulk_transport
+    for transport in (_transport, _bulk_transport):
+        if transport is not None:
+            await transport.aclose()
+    _transport = _bulk_transport = None